@@ -23,11 +23,13 @@ from spimagine.models.transform_model import TransformModel, TransformData
 
 from spimagine.utils.imgutils import read3dTiff, write3dTiff
 
-from spimagine.gui.volshow import volshow, volfig, qt_exec
+# the viewer needs OpenCL, without it only e.g. the numpy renderer can be used
+if config.__HAS_OPENCL__:
+    from spimagine.gui.volshow import volshow, volfig, qt_exec
 
-from spimagine.gui.mainwidget import MainWidget
+    from spimagine.gui.mainwidget import MainWidget
 
-from spimagine.gui.mesh import Mesh, SphericalMesh, EllipsoidMesh
+    from spimagine.gui.mesh import Mesh, SphericalMesh, EllipsoidMesh
 
 from spimagine.utils import *
 
@@ -22,7 +22,7 @@ import argparse
 
 import numpy as np
 from spimagine.utils.imgutils import read3dTiff, fromSpimFolder
-from spimagine.volumerender.volumerender import VolumeRenderer
+from spimagine.volumerender.volumerender_numpy import VolumeRendererNumpy
 from spimagine.models.transform_model import mat4_rotation, mat4_translate, mat4_scale, mat4_ortho, mat4_perspective
 
 
@@ -92,6 +92,15 @@ def main():
     parser.add_argument("--16bit",help="render into 16 bit png",
                         dest="is16Bit",action="store_true")
 
+    parser.add_argument("--fullres",help="render volumes that don't fit into device memory\nslab by slab at full resolution (default: downsampled)",
+                        dest="fullres",action="store_true")
+
+    parser.add_argument("--tile",help="render tiles of this size (saves device memory for large widths)",
+                        dest="tile",metavar="tile size",type=int,default=0)
+
+    parser.add_argument("--cpu",help="render with numpy instead of OpenCL\n(used anyway if no OpenCL device is found)",
+                        dest="cpu",action="store_true")
+
     if len(sys.argv)==1:
         parser.print_help()
         return
@@ -102,7 +111,19 @@ def main():
     for k,v in six.iteritems(vars(args)):
         print(k,v)
 
-    rend = VolumeRenderer((args.width,args.width))
+    rend = None
+    if not args.cpu:
+        try:
+            from spimagine.volumerender.volumerender import VolumeRenderer
+            renderWidth = args.tile if args.tile>0 else args.width
+            rend = VolumeRenderer((renderWidth,renderWidth))
+            rend.set_out_of_core(args.fullres)
+        except Exception as e:
+            print(e)
+            print("could not create OpenCL renderer - rendering with numpy...")
+
+    if rend is None:
+        rend = VolumeRendererNumpy((args.width,args.width))
 
     if args.format=="tif":
         data = read3dTiff(args.input)
@@ -125,7 +146,11 @@ def main():
     else:
         rend.set_projection(mat4_perspective(60,1.,1,10))
 
-    out = rend.render()
+    if args.tile>0 and not isinstance(rend, VolumeRendererNumpy):
+        rend.render_tiled((args.width,args.width))
+    else:
+        rend.render()
+    out = rend.output
 
     # image is saved by scipy.misc.toimage(out,low,high,cmin,cmax)
     # p' = p * high/cmax
@@ -9,7 +9,6 @@ import os
 from .myconfigparser import MyConfigParser
 from .loadcolormaps import loadcolormaps
 
-from gputools import init_device
 
 __CONFIGFILE__ = os.path.expanduser("~/.spimagine")
 
@@ -28,6 +27,26 @@ defaults = {
     "box_linewidth": 1.,
     "interpolation": "linear",
     "_qualifier_constant_to_global": 0,
+    "use_volume_buffer": 0,
+    "interaction_lod": 1,
+    "interaction_lod_scale": .5,
+    "interaction_lod_delay": 300,
+    "adaptive_quality": 1,
+    "target_fps": 20.,
+    "program_cache": 1,
+    "program_cache_dir": "~/.cache/spimagine",
+    "iso_gradient_volume": 0,
+    "ao_half_resolution": 1,
+    "ao_accumulate_frames": 1,
+    "async_upload": 1,
+    "timepoint_cache_mb": -1,
+    "memory_pool_mb": 256,
+    "volume_storage": "native",
+    "progressive_passes": 4,
+    "progressive_tolerance": .002,
+    "sampling_rate": 0.,
+    "accumulate_frames": 0,
+    "accumulate_steps": .25,
 }
 
 
@@ -53,11 +72,79 @@ __DEFAULT_INTERP__ = _get_param("interpolation", str)
 
 __QUALIFIER_CONSTANT_TO_GLOBAL__ = _get_param("_qualifier_constant_to_global", bool)
 
+# read the volume from plain buffers even if the device supports images
+__USE_VOLUME_BUFFER__ = _get_param("use_volume_buffer", int)
+
+# while the view is dragged, render with reduced resolution and steps (as fraction of the defaults)
+# and go back to full quality after interaction_lod_delay ms without interaction
+__INTERACTION_LOD__ = _get_param("interaction_lod", int)
+__INTERACTION_LOD_SCALE__ = _get_param("interaction_lod_scale", float)
+__INTERACTION_LOD_DELAY__ = _get_param("interaction_lod_delay", int)
+
+# if set, the interaction quality is instead adapted to reach target_fps
+__ADAPTIVE_QUALITY__ = _get_param("adaptive_quality", int)
+__TARGET_FPS__ = _get_param("target_fps", float)
+
+# keep the compiled OpenCL programs on disk
+__PROGRAM_CACHE__ = _get_param("program_cache", int)
+__PROGRAM_CACHE_DIR__ = _get_param("program_cache_dir", str)
+
+# precompute the gradients of a dataset once for the iso surface normals
+# (faster for big images at the cost of 16 bytes per voxel of device memory)
+__ISO_GRADIENT_VOLUME__ = _get_param("iso_gradient_volume", int)
+
+# compute the ambient occlusion of iso surfaces at half resolution and average it
+# over up to ao_accumulate_frames renders of the same view
+__AO_HALF_RESOLUTION__ = _get_param("ao_half_resolution", int)
+__AO_ACCUMULATE_FRAMES__ = _get_param("ao_accumulate_frames", int)
+
+# while playing, upload the next timepoint in the background while the current one is rendered
+__ASYNC_UPLOAD__ = _get_param("async_upload", int)
+
+# the device memory (in MB) that keeps already shown timepoints, shared by all renderers on a device
+# (-1: half of the device memory minus the memory for the current volumes, 0: off)
+__TIMEPOINT_CACHE_MB__ = _get_param("timepoint_cache_mb", float)
+
+# the device memory (in MB) of released buffers and volumes that are kept for reuse
+__MEMORY_POOL_MB__ = _get_param("memory_pool_mb", float)
+
+# how float volumes are stored on the device: "native" (float32), "half" (float16)
+# or "quantized" (uint8 with a scale/offset per 8^3 brick), see VolumeRenderer.set_storage
+__VOLUME_STORAGE__ = _get_param("volume_storage", str)
+
+# the views are rendered progressively in that many interleaved passes (the first one is
+# shown right away), until a pass changes no pixel by more than progressive_tolerance
+__PROGRESSIVE_PASSES__ = _get_param("progressive_passes", int)
+__PROGRESSIVE_TOLERANCE__ = _get_param("progressive_tolerance", float)
+
+# the samples per voxel along the rays of a max projection (at most max_steps per ray),
+# 0: every ray is divided into max_steps steps
+__SAMPLING_RATE__ = _get_param("sampling_rate", float)
+
+# if > 0, max projections are rendered as up to that many frames with jittered ray starts and
+# accumulate_steps*max_steps steps each (instead of the interleaved passes), the first one is
+# shown while interacting and the following ones are accumulated while the view is still
+__ACCUMULATE_FRAMES__ = _get_param("accumulate_frames", int)
+__ACCUMULATE_STEPS__ = _get_param("accumulate_steps", float)
+
 __COLORMAPDICT__ = loadcolormaps()
 
-init_device(id_platform=__ID_PLATFORM__,
-            id_device=__ID_DEVICE__,
-            use_gpu=__USE_GPU__)
+
+def _init_device():
+    """selects the OpenCL device, without one (e.g. on headless nodes) only
+    the numpy renderer can be used"""
+    try:
+        from gputools import init_device
+        init_device(id_platform=__ID_PLATFORM__,
+                    id_device=__ID_DEVICE__,
+                    use_gpu=__USE_GPU__)
+        return True
+    except Exception as e:
+        logger.warning("no OpenCL device available (%s)", e)
+        return False
+
+
+__HAS_OPENCL__ = _init_device()
 
 # this should fix an annoying file url drag drop bug in mac yosemite
 import platform
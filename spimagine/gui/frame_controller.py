@@ -0,0 +1,95 @@
+"""
+adapts the render quality (resolution and number of ray steps) to the measured
+frame times, so that interactive rendering keeps a given frame rate
+
+usage:
+
+ctrl = FrameTimeController(target_fps = 20)
+
+for each rendered frame:
+    if ctrl.add_frame(time_to_render):
+        # the quality level changed
+        set_quality(ctrl.resolution, ctrl.steps)
+
+"""
+
+from __future__ import absolute_import, print_function, division
+
+import logging
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameTimeController(object):
+    """ chooses a quality level from a list of (resolution, steps) fractions,
+    ordered from the best to the cheapest one
+
+    the level is lowered if the mean of the last n_frames frame times is above
+    the target time by more than the hysteresis, and raised only if the
+    finer level is expected to stay below the target by more than the hysteresis.
+    After each change n_frames new frames are collected before the next one.
+    """
+
+    default_levels = ((1., 1.), (1., .75), (.75, .75), (.75, .5),
+                      (.5, .5), (.5, .25), (.35, .25), (.25, .25))
+
+    def __init__(self, target_fps=20., levels=None, n_frames=5, hysteresis=.25):
+        self.levels = tuple(levels or FrameTimeController.default_levels)
+        if len(self.levels)==0:
+            raise ValueError("no quality levels given")
+        self.n_frames = n_frames
+        self.hysteresis = hysteresis
+        self.set_target_fps(target_fps)
+        self.level = 0
+        self._times = deque(maxlen=n_frames)
+
+    def set_target_fps(self, target_fps):
+        self.target_time = 1./target_fps
+
+    def reset(self, level=0):
+        self.level = int(np.clip(level, 0, len(self.levels)-1))
+        self._times.clear()
+
+    @property
+    def resolution(self):
+        return self.levels[self.level][0]
+
+    @property
+    def steps(self):
+        return self.levels[self.level][1]
+
+    @property
+    def frame_time(self):
+        """the mean of the recent frame times (None if there are none)"""
+        return np.mean(self._times) if len(self._times)>0 else None
+
+    def _cost(self, level):
+        """the relative cost of a level (pixels times steps)"""
+        resolution, steps = self.levels[level]
+        return resolution**2*steps
+
+    def add_frame(self, dt):
+        """adds the time (in seconds) a frame took, returns True if the level changed"""
+        self._times.append(dt)
+
+        if len(self._times)<self.n_frames:
+            return False
+
+        t = self.frame_time
+        level = self.level
+
+        if t>(1.+self.hysteresis)*self.target_time and level<len(self.levels)-1:
+            level += 1
+        elif level>0 and t*self._cost(level-1)/self._cost(level)<(1.-self.hysteresis)*self.target_time:
+            level -= 1
+
+        if level==self.level:
+            return False
+
+        logger.info("frame time %.1f ms (target %.1f ms): quality level %s -> %s (resolution %s, steps %s)",
+                    1000.*t, 1000.*self.target_time, self.level, level, *self.levels[level])
+        self.reset(level)
+        return True
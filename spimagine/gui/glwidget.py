@@ -49,9 +49,10 @@ import OpenGL.arrays.vbo as glvbo
 import spimagine
 from spimagine.volumerender.volumerender import VolumeRenderer
 from spimagine.utils.transform_matrices import *
-from spimagine.models.transform_model import TransformModel
+from spimagine.models.transform_model import TransformModel, LAYER_VOLUME, LAYER_SLICE, LAYER_MESH, LAYER_ALL
 from spimagine.models.data_model import DataModel
 from spimagine.gui.mesh import Mesh, SphericalMesh, EllipsoidMesh
+from spimagine.gui.frame_controller import FrameTimeController
 import numpy as np
 from spimagine.gui.gui_utils import *
 
@@ -61,8 +62,6 @@ if os.name == "nt":
 else:
     from numpy import linalg
 
-import pyopencl.array as cl_array
-from gputools import OCLArray
 
 import time
 from spimagine.utils.quaternion import Quaternion
@@ -90,6 +89,8 @@ def absPath(myPath):
 
 class GLWidget(QtOpenGL.QGLWidget):
     _dataModelChanged = QtCore.pyqtSignal()
+    # quality level, resolution and steps (as fractions of the defaults)
+    _renderQualityChanged = QtCore.pyqtSignal(int, float, float)
 
     _BACKGROUND_BLACK = (0., 0., 0., 0.)
     _BACKGROUND_WHITE = (1., 1., 1., 0.)
@@ -116,11 +117,22 @@ class GLWidget(QtOpenGL.QGLWidget):
         self.renderer.set_projection(mat4_perspective(60, 1., .1, 100))
         # self.renderer.set_projection(projMatOrtho(-2,2,-2,2,-10,10))
 
+        # large volumes are shown from a coarse pyramid level first and refined when idle
+        self.renderer.defer_level_upload = True
+
         self.output = np.zeros([self.renderer.height, self.renderer.width], dtype=np.float32)
         self.output_alpha = np.zeros([self.renderer.height, self.renderer.width], dtype=np.float32)
 
         self.sliceOutput = np.zeros((100, 100), dtype=np.float32)
 
+        # the layers (see transform_model) that changed since the last paint, the
+        # volume is ray cast again as long as renderedSteps < NSubrenderSteps
+        self._dirtyLayers = LAYER_ALL
+
+        # whether output/sliceOutput changed since they were uploaded as textures
+        self._outputChanged = True
+        self._sliceChanged = True
+
         self.setTransform(TransformModel())
 
         self.renderTimer = QtCore.QTimer(self)
@@ -129,9 +141,24 @@ class GLWidget(QtOpenGL.QGLWidget):
         self.renderTimer.start()
         self.renderedSteps = 0
 
+        # reduced quality while the view is dragged (see startInteraction)
+        self._isInteracting = False
+        self.interactionTimer = QtCore.QTimer(self)
+        self.interactionTimer.setSingleShot(True)
+        self.interactionTimer.setInterval(spimagine.config.__INTERACTION_LOD_DELAY__)
+        self.interactionTimer.timeout.connect(self.onInteractionEnd)
+
+        # starting from the level closest to the fixed interaction quality
+        self.frameController = FrameTimeController(target_fps=spimagine.config.__TARGET_FPS__)
+        scale = spimagine.config.__INTERACTION_LOD_SCALE__
+        self.frameController.reset(min([i for i, (res, steps) in enumerate(self.frameController.levels)
+                                        if res<=scale and steps<=scale]
+                                       or [len(self.frameController.levels)-1]))
+
         self.N_PREFETCH = N_PREFETCH
 
-        self.NSubrenderSteps = 1
+        # the number of interleaved passes of a progressive max projection
+        self.NSubrenderSteps = spimagine.config.__PROGRESSIVE_PASSES__
 
         self.dataModel = None
 
@@ -201,7 +228,8 @@ class GLWidget(QtOpenGL.QGLWidget):
         """arr should be of shape (N,3) and gives the rgb components of the colormap"""
         self.makeCurrent()
         self.texture_LUT = fillTexture2d(arr.reshape((1,) + arr.shape), self.texture_LUT)
-        self.refresh()
+        # the colormap is applied while painting
+        self.refresh(layers=0)
 
     def _shader_from_file(self, fname_vert, fname_frag):
         shader = QOpenGLShaderProgram()
@@ -291,11 +319,11 @@ class GLWidget(QtOpenGL.QGLWidget):
     def set_interpolation(self, interpolate = True):
         interp = "linear" if interpolate else "nearest"
         self.renderer.rebuild_program(interpolation = interp)
-        self.refresh()
+        self.refresh(LAYER_VOLUME)
 
     def setTransform(self, transform):
         self.transform = transform
-        self.transform._transformChanged.connect(self.refresh)
+        self.transform._layersChanged.connect(self.refresh)
         self.transform._stackUnitsChanged.connect(self.setStackUnits)
         self.transform._boundsChanged.connect(self.setBounds)
 
@@ -305,6 +333,8 @@ class GLWidget(QtOpenGL.QGLWidget):
         if self.dataModel:
             logger.debug("dataModelchanged")
 
+            self.renderer.clear_volume_cache()
+            self.renderer.set_value_scale(*self.dataModel.valueScale())
             self.renderer.set_data(self.dataModel[0], autoConvert=True)
 
             mi, ma = self._get_min_max()
@@ -321,13 +351,7 @@ class GLWidget(QtOpenGL.QGLWidget):
 
         if self.dataModel:
             try:
-                im = self.renderer.dataImg
-                tmp_buf = OCLArray.empty(im.shape, im.dtype)
-                tmp_buf.copy_image(im)
-                mi = float(cl_array.min(tmp_buf).get())
-                ma = float(cl_array.max(tmp_buf).get())
-
-
+                mi, ma = self.renderer.value_range()
             except Exception as e:
                 print(e)
                 mi = np.amin(self.dataModel[0])
@@ -342,6 +366,8 @@ class GLWidget(QtOpenGL.QGLWidget):
 
         logger.debug("dataSourcechanged")
 
+        self.renderer.clear_volume_cache()
+        self.renderer.set_value_scale(*self.dataModel.valueScale())
         self.renderer.set_data(self.dataModel[0], autoConvert=True)
 
         mi, ma = self._get_min_max()
@@ -361,15 +387,32 @@ class GLWidget(QtOpenGL.QGLWidget):
         self.renderer.set_units([px, py, pz])
 
     def dataPosChanged(self, pos):
-        self.renderer.update_data(self.dataModel[pos])
+        self.renderer.update_data(self.dataModel[pos], cacheKey=self._cacheKey(pos))
         self.refresh()
 
-    def refresh(self):
+    def _cacheKey(self, pos):
+        """the key of timepoint pos in the device volume cache of the renderer"""
+        return (id(self.dataModel), pos)
+
+    def prefetchPos(self, pos):
+        """starts uploading the timepoint pos in the background (e.g. the next one while playing)
+        if it was already loaded by the data model"""
+        if self.dataModel and spimagine.config.__ASYNC_UPLOAD__:
+            data = self.dataModel.loaded(pos)
+            if data is not None:
+                self.renderer.prefetch_data(data, cacheKey=self._cacheKey(pos))
+
+    def refresh(self, layers=LAYER_ALL):
+        """marks the given layers as changed, only a change of LAYER_VOLUME
+        ray casts the volume again, all others only update the slice texture
+        or draw the cached layers again"""
         # if self.parentWidget() and self.dataModel:
         #     self.parentWidget().setWindowTitle("SpImagine %s"%self.dataModel.name())
 
         self.renderUpdate = True
-        self.renderedSteps = 0
+        self._dirtyLayers |= layers
+        if layers & LAYER_VOLUME:
+            self.renderedSteps = 0
 
     def resizeGL(self, width, height):
         # somehow in qt5 the OpenGLWidget width/height parameters above are double the value of self.width/height
@@ -396,7 +439,7 @@ class GLWidget(QtOpenGL.QGLWidget):
                             glvbo.VBO(np.array(mesh.indices).astype(np.uint32, copy=False),
                                       target=GL_ELEMENT_ARRAY_BUFFER)])
 
-        self.refresh()
+        self.refresh(LAYER_MESH)
         # sort according to opacity as the opaque objects should be drawn first
         # self.meshes.sort(key=lambda x: x[0].alpha, reverse=True)
 
@@ -405,7 +448,8 @@ class GLWidget(QtOpenGL.QGLWidget):
 
         self.programTex.bind()
 
-        self.texture = fillTexture2d(self.output, self.texture)
+        if self._outputChanged or self.texture is None:
+            self.texture = fillTexture2d(self.output, self.texture)
         # self.textureAlpha = fillTexture2d(self.output_alpha, self.textureAlpha)
 
         glEnable(GL_BLEND)
@@ -452,7 +496,9 @@ class GLWidget(QtOpenGL.QGLWidget):
         self.programSlice.setAttributeArray("position", coords)
         self.programSlice.setAttributeArray("texcoord", texcoords)
 
-        self.textureSlice = fillTexture2d(self.sliceOutput, self.textureSlice)
+        if self._sliceChanged or self.textureSlice is None:
+            self.textureSlice = fillTexture2d(self.sliceOutput, self.textureSlice)
+            self._sliceChanged = False
 
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, self.textureSlice)
@@ -585,7 +631,8 @@ class GLWidget(QtOpenGL.QGLWidget):
 
         if self.dataModel:
 
-            self.textureAlpha = fillTexture2d(self.output_alpha, self.textureAlpha)
+            if self._outputChanged or self.textureAlpha is None:
+                self.textureAlpha = fillTexture2d(self.output_alpha, self.textureAlpha)
 
             if self.transform.isBox:
                 self._paintGL_box()
@@ -594,6 +641,7 @@ class GLWidget(QtOpenGL.QGLWidget):
                 self._paintGL_slice()
 
             self._paintGL_render()
+            self._outputChanged = False
 
         for (m, vbo_verts, vbo_normals, vbo_indices) in self.meshes:
             self._paintGL_mesh(m, vbo_verts, vbo_normals, vbo_indices)
@@ -610,35 +658,98 @@ class GLWidget(QtOpenGL.QGLWidget):
             self.renderer.set_max_val(self.transform.maxVal)
             self.renderer.set_gamma(self.transform.gamma)
             self.renderer.set_alpha_pow(self.transform.alphaPow)
+            self.renderer.set_sampling_rate(self.transform.samplingRate)
 
             self.renderer.set_occ_strength(self.transform.occ_strength)
             self.renderer.set_occ_radius(self.transform.occ_radius)
             self.renderer.set_occ_n_points(self.transform.occ_n_points)
 
-            if self.transform.isIso:
-                renderMethod = "iso_surface"
+            if self._accumulating():
+                self.renderer.accumulate(frame=self.renderedSteps, steps=spimagine.config.__ACCUMULATE_STEPS__)
+                result = self.renderer.result
+            else:
+                result = self.renderer.render(method=self._render_method(), return_alpha=True,
+                                              numParts=self._n_passes(), currentPart=self._current_part())
+            # only these two are needed, their transfer runs while the slice is prepared
+            result.prefetch("output", "output_alpha")
+
+            self._render_layers()
 
+            self.output, self.output_alpha = result.output, result.output_alpha
+            self._outputChanged = True
+        else:
+            self._render_layers()
+
+    def _render_method(self):
+        return "iso_surface" if self.transform.isIso else "max_project"
+
+    def _accumulating(self):
+        """whether the passes are jittered frames with fewer steps (see VolumeRenderer.accumulate)"""
+        return (spimagine.config.__ACCUMULATE_FRAMES__ > 0
+                and self.renderer.can_accumulate(self._render_method()))
+
+    def _n_passes(self):
+        """the number of passes of the progressive render of a view"""
+        if self.transform.isIso:
+            # the passes after the first only accumulate the ambient occlusion of its surface
+            # (see VolumeRenderer.set_occ_accumulate and refine)
+            return self.renderer.occ_accumulate
+        if self._accumulating():
+            return spimagine.config.__ACCUMULATE_FRAMES__
+        return max(1, self.NSubrenderSteps)
+
+    def _current_part(self):
+        n = self._n_passes()
+        return (self.renderedSteps * _next_golden(n)) % n
+
+    def _refine(self, budget=np.inf):
+        """renders further passes of the current view (accumulated on the device) for
+        up to budget seconds or until a pass does not change the image anymore,
+        the output is only fetched once afterwards"""
+        if not self.dataModel:
+            return
+
+        t = time.time()
+        n = self._n_passes()
+        while self.renderedSteps < n:
+            if self._accumulating():
+                change = self.renderer.accumulate(frame=self.renderedSteps,
+                                                  steps=spimagine.config.__ACCUMULATE_STEPS__)
+            else:
+                change = self.renderer.refine(self._render_method(), numParts=n, currentPart=self._current_part())
+            self.renderedSteps += 1
+            if change < spimagine.config.__PROGRESSIVE_TOLERANCE__:
+                logger.debug("converged after %s of %s passes", self.renderedSteps, n)
+                self.renderedSteps = n
+            if time.time() - t > budget:
+                break
+
+        result = self.renderer.result
+        result.prefetch("output", "output_alpha")
+        self.output, self.output_alpha = result.output, result.output_alpha
+        self._outputChanged = True
+
+    def _render_layers(self):
+        """updates the changed layers besides the volume (i.e. the slice texture)"""
+        if self._dirtyLayers & LAYER_SLICE:
+            self._render_slice()
+        self._dirtyLayers = 0
+
+    def _render_slice(self):
+        if self.dataModel and self.transform.isSlice:
+            if self.transform.sliceDim == 0:
+                out = self.dataModel[self.transform.dataPos][:, :, self.transform.slicePos]
+            elif self.transform.sliceDim == 1:
+                out = self.dataModel[self.transform.dataPos][:, self.transform.slicePos, :]
+            elif self.transform.sliceDim == 2:
+                out = self.dataModel[self.transform.dataPos][self.transform.slicePos, :, :]
+
+            min_out, max_out = np.amin(out), np.amax(out)
+            if max_out > min_out:
+                self.sliceOutput = (1. * (out - min_out) / (max_out - min_out))
             else:
-                renderMethod = "max_project"
-
-            self.renderer.render(method=renderMethod, return_alpha=True, numParts=self.NSubrenderSteps, currentPart=(
-                                                                                                                        self.renderedSteps * _next_golden(
-                                                                                                                            self.NSubrenderSteps)) % self.NSubrenderSteps)
-            self.output, self.output_alpha = self.renderer.output, self.renderer.output_alpha
-
-            if self.transform.isSlice:
-                if self.transform.sliceDim == 0:
-                    out = self.dataModel[self.transform.dataPos][:, :, self.transform.slicePos]
-                elif self.transform.sliceDim == 1:
-                    out = self.dataModel[self.transform.dataPos][:, self.transform.slicePos, :]
-                elif self.transform.sliceDim == 2:
-                    out = self.dataModel[self.transform.dataPos][self.transform.slicePos, :, :]
-
-                min_out, max_out = np.amin(out), np.amax(out)
-                if max_out > min_out:
-                    self.sliceOutput = (1. * (out - min_out) / (max_out - min_out))
-                else:
-                    self.sliceOutput = np.zeros_like(out)
+                self.sliceOutput = np.zeros_like(out)
+            self._sliceChanged = True
 
     # def getFrame(self):
     #     self.render()
@@ -665,7 +776,11 @@ class GLWidget(QtOpenGL.QGLWidget):
         if ext != ".png":
             fName = name + ".png"
 
+        # all passes
+        self.renderedSteps = 0
         self.render()
+        self.renderedSteps = 1
+        self._refine()
         self.paintGL()
         glFlush()
         im = self.grabFrameBuffer(withAlpha=with_alpha)
@@ -676,16 +791,69 @@ class GLWidget(QtOpenGL.QGLWidget):
         #     self.render()
         #     self.renderUpdate = False
         #     self.updateGL()
-        if self.renderedSteps < self.NSubrenderSteps:
-            # print ((self.renderedSteps*7)%self.NSubrenderSteps)
+        if self.renderedSteps < self._n_passes():
             s = time.time()
-            self.render()
-            logger.debug("time to render:  %.2f" % (1000. * (time.time() - s)))
-            self.renderedSteps += 1
+            if self.renderedSteps == 0:
+                # the first pass is shown right away
+                self.render()
+                self.renderedSteps += 1
+            else:
+                # the following ones are accumulated and shown once per frame
+                self._refine(budget=1. / spimagine.config.__TARGET_FPS__)
+            dt = time.time() - s
+            logger.debug("time to render:  %.2f" % (1000. * dt))
+
+            # adapt the quality of the following interaction frames to the frame rate
+            if self._isInteracting and spimagine.config.__ADAPTIVE_QUALITY__:
+                if self.frameController.add_frame(dt):
+                    self._apply_interaction_quality()
             self.updateGL()
+            self.renderUpdate = False
+        elif self.renderUpdate:
+            # e.g. only the slice moved or the box was toggled
+            self._render_layers()
+            self.updateGL()
+            self.renderUpdate = False
+        elif self.dataModel and self.renderer.select_level(allow_upload=True):
+            # the view is still, so upload a finer pyramid level
+            self.refresh(LAYER_VOLUME)
+
+    def set_render_quality(self, resolution=1., steps=1.):
+        """sets the render resolution and number of steps as fraction of the defaults"""
+        width = max(16, int(resolution*spimagine.config.__DEFAULT_TEXTURE_WIDTH__))
+        if (width, width) != (self.renderer.width, self.renderer.height):
+            self.renderer.resize((width, width))
+        self.renderer.set_max_steps(steps*spimagine.config.__DEFAULTMAXSTEPS__)
+
+    def startInteraction(self):
+        """called on every rotation/translation/zoom, renders with reduced quality
+        until there was no interaction for __INTERACTION_LOD_DELAY__ ms"""
+        if not spimagine.config.__INTERACTION_LOD__:
+            return
+        if not self._isInteracting:
+            logger.debug("interaction started, reducing render quality")
+            self._isInteracting = True
+            self._apply_interaction_quality()
+        self.interactionTimer.start()
+
+    def _apply_interaction_quality(self):
+        if spimagine.config.__ADAPTIVE_QUALITY__:
+            ctrl = self.frameController
+            self.set_render_quality(ctrl.resolution, ctrl.steps)
+            self._renderQualityChanged.emit(ctrl.level, ctrl.resolution, ctrl.steps)
+        else:
+            scale = spimagine.config.__INTERACTION_LOD_SCALE__
+            self.set_render_quality(scale, scale)
+
+    def onInteractionEnd(self):
+        logger.debug("interaction ended, rendering at full quality")
+        self._isInteracting = False
+        self.set_render_quality()
+        self.refresh()
 
     def wheelEvent(self, event):
         """ self.transform.zoom should be within [1,2]"""
+        self.startInteraction()
         newZoom = self.transform.zoom * 1.2 ** (event.angleDelta().y() / 1000.)
         newZoom = np.clip(newZoom, .4, 3)
         self.transform.setZoom(newZoom)
@@ -759,6 +927,9 @@ class GLWidget(QtOpenGL.QGLWidget):
             self.transform.addTranslate(dx, dy, foo)
             self._x0, self._y0 = x, y
 
+        if event.buttons() in (QtCore.Qt.LeftButton, QtCore.Qt.RightButton):
+            self.startInteraction()
+
         self.refresh()
 
     def resizeEvent(self, event):
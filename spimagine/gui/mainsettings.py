@@ -92,11 +92,17 @@ class MainSettingsPanel(QtWidgets.QWidget):
         gridBox.addWidget(self.playInterval)
 
         gridBox.addWidget(QtWidgets.QLabel("subrender steps:\t"))
-        self.editSubsteps = QtWidgets.QLineEdit("1")
+        self.editSubsteps = QtWidgets.QLineEdit(str(spimagine.config.__PROGRESSIVE_PASSES__))
         self.editSubsteps.setValidator(QtGui.QIntValidator(bottom=1))
         self.editSubsteps.returnPressed.connect(self.substepsChanged)
         gridBox.addWidget(self.editSubsteps)
 
+        gridBox.addWidget(QtWidgets.QLabel("interaction quality:\t"))
+        self.labelQuality = QtWidgets.QLabel("")
+        self.labelQuality.setToolTip("resolution / ray steps while rotating (adapted to the frame rate)")
+        self.setRenderQuality(0, 1., 1.)
+        gridBox.addWidget(self.labelQuality)
+
         gridBox.addWidget(QtWidgets.QLabel("Egg3D:\t"))
         self.checkEgg = createImageCheckbox(self, absPath("images/egg.png"),
                                             absPath("images/egg_inactive.png"),
@@ -192,6 +198,9 @@ class MainSettingsPanel(QtWidgets.QWidget):
     def playIntervalChanged(self):
         self._playIntervalChanged.emit(int(self.playInterval.text()))
 
+    def setRenderQuality(self, level, resolution, steps):
+        self.labelQuality.setText("%d%% / %d%%"%(100*resolution, 100*steps))
+
     def substepsChanged(self):
         print("changed substeps to ", int(self.editSubsteps.text()))
         self._substepsChanged.emit(int(self.editSubsteps.text()))
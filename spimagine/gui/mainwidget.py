@@ -376,6 +376,7 @@ class MainWidget(QtWidgets.QWidget):
             stateToBool(self.glWidget.set_background_mode_black,invert = True))
 
         self.settingsView._substepsChanged.connect(self.substepsChanged)
+        self.glWidget._renderQualityChanged.connect(self.settingsView.setRenderQuality)
 
         self.checkIsoView.stateChanged.connect(
             stateToBool(self.glWidget.transform.setIso))
@@ -466,7 +467,6 @@ class MainWidget(QtWidgets.QWidget):
 
     def onColormapChanged(self,index):
         self.glWidget.set_colormap(self.volSettingsView.colormaps[index])
-        self.glWidget.refresh()
 
         self.sliceWidget.glSliceWidget.set_colormap(self.volSettingsView.colormaps[index])
         self.sliceWidget.glSliceWidget.refresh()
@@ -475,8 +475,6 @@ class MainWidget(QtWidgets.QWidget):
     def onRgbColorChanged(self,r,g,b):
         self.glWidget.set_colormap_rgb([r,g,b])
 
-        self.glWidget.refresh()
-
         self.sliceWidget.glSliceWidget.set_colormap_rgb([r,g,b])
         self.sliceWidget.glSliceWidget.refresh()
 
@@ -679,19 +677,25 @@ class MainWidget(QtWidgets.QWidget):
             if self.glWidget.dataModel:
                 write3dTiff(self.glWidget.dataModel[self.transform.dataPos].astype(np.float32),path)
 
-    def onPlayTimer(self):
+    def _playStep(self, pos, playDir):
+        """the next position and play direction while playing"""
+        if pos == self.glWidget.dataModel.sizeT()-1:
+            playDir = 1-2*self.loopBounce
+        if pos == 0:
+            playDir = 1
 
-        if self.glWidget.dataModel:
+        return (pos+playDir)%self.glWidget.dataModel.sizeT(), playDir
 
+    def onPlayTimer(self):
 
-            if self.glWidget.dataModel.pos == self.glWidget.dataModel.sizeT()-1:
-                self.playDir = 1-2*self.loopBounce
-            if self.glWidget.dataModel.pos == 0:
-                self.playDir = 1
+        if self.glWidget.dataModel:
 
-            newpos = (self.glWidget.dataModel.pos+self.playDir)%self.glWidget.dataModel.sizeT()
+            newpos, self.playDir = self._playStep(self.glWidget.dataModel.pos, self.playDir)
             self.transform.setPos(newpos)
 
+            # upload the following timepoint while this one is rendered
+            self.glWidget.prefetchPos(self._playStep(newpos, self.playDir)[0])
+
 
     def contextMenuEvent(self,event):
          # create context menu
@@ -760,6 +764,7 @@ class MainWidget(QtWidgets.QWidget):
     def onRotateTimer(self):
         axis = [0,0,0]
         axis[spimagine.config.__DEFAULT_SPIN_AXIS__] = 1
+        self.glWidget.startInteraction()
         self.transform.addRotation(-.02,*axis)
         self.glWidget.render()
         self.glWidget.updateGL()
@@ -28,25 +28,16 @@ logger = logging.getLogger(__name__)
 # logger.setLevel(logging.DEBUG)
 
 
-def _rescale(x, upper, lower=0.):
+def _rescale_params(x, upper, lower=0.):
+    """(scale, offset) that map the values of x onto [lower, upper]"""
     if upper<lower:
         raise ValueError("upper<lower! (%s < %s)"%(upper, lower))
 
-    ma, mi = np.amax(x), np.amin(x)
+    ma, mi = float(np.amax(x)), float(np.amin(x))
     if ma == mi:
-        x = lower * np.ones(x.shape)
-    else:
-        try:
-            import numexpr
-            lower_32, upper_32 = np.float32(lower), np.float32(upper)
-            mi_32, ma_32 = np.float32(mi), np.float32(ma)
-            x = x.astype(np.float32, copy = False)
-            x = numexpr.evaluate("lower_32+(upper_32 -lower_32)* (x - mi_32) / (ma_32 - mi_32)")
-        except ImportError:
-            logger.debug("could not find numexpr")
-            x = lower+(upper-lower) * (x.astype(np.float32) - mi) / (ma - mi)
-
-    return x
+        return (0., float(lower))
+    scale = (upper-lower)/(ma-mi)
+    return (scale, lower-scale*mi)
 
 
 def absPath(myPath):
@@ -201,13 +192,14 @@ def volshow(data, autoscale=True,
     else:
         if not isinstance(data, np.ndarray):
             data = np.array(data)
-        if autoscale:
-            data = _rescale(data, 10000,0)
 
-        if not data.dtype.type in VolumeRenderer.dtypes:
+        if not data.dtype.type in VolumeRenderer.dtypes+VolumeRenderer.raw_dtypes:
             data = data.astype(np.float32, copy=False)
 
-        m = DataModel(NumpyData(data))
+        # the data is converted and rescaled on the device
+        valueScale = _rescale_params(data, 10000, 0) if autoscale else (1., 0.)
+
+        m = DataModel(NumpyData(data, valueScale=valueScale))
 
     logger.debug("create model: %s s " % (time() - t))
     t = time()
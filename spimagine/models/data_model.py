@@ -68,6 +68,8 @@ class GenericData(object):
         self.stackSize = None
         self.stackUnits = None
         self.name = name
+        # the values are rendered as scale*value+offset
+        self.valueScale = (1., 0.)
 
     # def setStackSize(self, stackSize):
     #     self.stackSize  = list(stackSize)
@@ -405,8 +407,9 @@ class TiffMultipleFiles(GenericData):
 
 
 class NumpyData(GenericData):
-    def __init__(self, data, stackUnits=[1., 1., 1.], copy = False):
+    def __init__(self, data, stackUnits=[1., 1., 1.], copy = False, valueScale=(1., 0.)):
         GenericData.__init__(self, "NumpyData")
+        self.valueScale = valueScale
         if copy:
             self.data = data.copy()
         else:
@@ -719,6 +722,10 @@ class DataModel(QtCore.QObject):
         if self.dataContainer:
             return self.dataContainer.stackUnits
 
+    def valueScale(self):
+        """(scale, offset) of the rendered values scale*value+offset"""
+        return getattr(self.dataContainer, "valueScale", (1., 0.))
+
     def setPos(self, pos):
         if pos < 0 or pos >= self.sizeT():
             raise IndexError("setPos(pos): %i outside of [0,%i]!" % (pos, self.sizeT() - 1))
@@ -751,6 +758,16 @@ class DataModel(QtCore.QObject):
         self.prefetch(pos)
         return newdata
 
+    def loaded(self, pos):
+        """the data at pos if it is already loaded (e.g. by the prefetching thread), else None"""
+        if not hasattr(self, "data"):
+            return None
+
+        self._rwLock.lockForRead()
+        data = self.data.get(pos)
+        self._rwLock.unlock()
+        return data
+
     def neighborhood(self, pos):
         # FIXME mod stackSize!
         return np.arange(pos, pos + self.prefetchSize + 1) % self.sizeT()
@@ -17,8 +17,21 @@ from spimagine.utils.quaternion import Quaternion
 
 import numpy as np
 
+import spimagine
 from spimagine.models.keyframe_model import TransformData
 
+# the layers of the 3d view a change affects (see TransformModel._layersChanged):
+# the ray cast volume, the slice texture (extracted from the data) and the
+# box and mesh overlays (that are only drawn again)
+LAYER_VOLUME = 1
+LAYER_SLICE = 2
+LAYER_BOX = 4
+LAYER_MESH = 8
+LAYER_ALL = LAYER_VOLUME | LAYER_SLICE | LAYER_BOX | LAYER_MESH
+
+# moving the camera
+LAYERS_VIEW = LAYER_VOLUME | LAYER_BOX | LAYER_MESH
+
 
 class TransformModel(QtCore.QObject):
     _maxChanged = QtCore.pyqtSignal(float)
@@ -44,6 +57,11 @@ class TransformModel(QtCore.QObject):
 
     _alphaPowChanged = QtCore.pyqtSignal(float)
 
+    _samplingRateChanged = QtCore.pyqtSignal(float)
+
+    # emitted with the layers (e.g. LAYER_VOLUME | LAYER_BOX) a change affects
+    _layersChanged = QtCore.pyqtSignal(int)
+
     def __init__(self):
         super(TransformModel, self).__init__()
         self.reset()
@@ -70,6 +88,10 @@ class TransformModel(QtCore.QObject):
 
         return not is_equal
 
+    def _changed(self, layers=LAYER_ALL):
+        self._layersChanged.emit(layers)
+        self._transformChanged.emit()
+
     def setModel(self, dataModel):
         self.dataModel = dataModel
 
@@ -96,6 +118,8 @@ class TransformModel(QtCore.QObject):
         self.eye_dist_cam = 0
         if not hasattr(self, "isSlice"):
             self.setShowSlice(False)
+        if not hasattr(self, "samplingRate"):
+            self.setSamplingRate(spimagine.config.__SAMPLING_RATE__)
 
         if not stackUnits:
             stackUnits = [.1, .1, .1]
@@ -106,26 +130,26 @@ class TransformModel(QtCore.QObject):
         logger.debug("setting Iso %s" % isIso)
         if self._update_value("isIso", isIso):
             self._isoChanged.emit(isIso)
-            self._transformChanged.emit()
+            self._changed(LAYER_VOLUME)
 
     def setInterpolate(self, is_interpolate):
         logger.debug("setting interpolation %s" % is_interpolate)
         if self._update_value("is_interpolate", is_interpolate):
             self._interpChanged.emit(is_interpolate)
-            self._transformChanged.emit()
+            self._changed(LAYER_VOLUME)
 
 
     def setOccStrength(self, occ_strength=.15):
         if self._update_value("occ_strength", occ_strength):
-            self._transformChanged.emit()
+            self._changed(LAYER_VOLUME)
 
     def setOccRadius(self, val=21):
         if self._update_value("occ_radius", val):
-            self._transformChanged.emit()
+            self._changed(LAYER_VOLUME)
 
     def setOccNPoints(self, val=31):
         if self._update_value("occ_n_points", val):
-            self._transformChanged.emit()
+            self._changed(LAYER_VOLUME)
 
     def center(self):
         self.quatRot = Quaternion()
@@ -136,35 +160,35 @@ class TransformModel(QtCore.QObject):
         self.setTranslate(0, 0, 0)
 
         self.update()
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def setTranslate(self, x, y, z):
         newtrans = np.array([x, y, z])
 
         if self._update_value("translate", newtrans):
             self._translateChanged.emit(x, y, z)
-            self._transformChanged.emit()
+            self._changed(LAYERS_VIEW)
 
     def addTranslate(self, dx, dy, dz):
         self.translate = self.translate + np.array([dx, dy, dz])
         self._translateChanged.emit(*self.translate)
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def setBounds(self, x1, x2, y1, y2, z1, z2):
         self.bounds = np.array([x1, x2, y1, y2, z1, z2])
         self._boundsChanged.emit(x1, x2, y1, y2, z1, z2)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME | LAYER_BOX)
 
     def setShowSlice(self, isSlice=True):
         self.isSlice = isSlice
-        self._transformChanged.emit()
+        self._changed(LAYER_SLICE)
 
     def setSliceDim(self, dim):
         logger.debug("setSliceDim(%s)", dim)
         if dim >= 0 and dim < 3:
             self.sliceDim = dim
             self._sliceDimChanged.emit(dim)
-            self._transformChanged.emit()
+            self._changed(LAYER_SLICE)
         else:
             raise ValueError("dim should be in [0,1,2]!")
 
@@ -172,26 +196,33 @@ class TransformModel(QtCore.QObject):
         logger.debug("setSlicePos(%s)", pos)
         self.slicePos = pos
         self._slicePosChanged.emit(pos)
-        self._transformChanged.emit()
+        self._changed(LAYER_SLICE)
 
     def setPos(self, pos):
         logger.debug("setPos(%s)", pos)
         self.dataPos = pos
         self.dataModel.setPos(pos)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME | LAYER_SLICE)
 
     def setGamma(self, gamma):
         logger.debug("setGamma(%s)", gamma)
 
         self.gamma = gamma
         self._gammaChanged.emit(self.gamma)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME)
 
     def setAlphaPow(self, alphaPow):
         logger.debug("setAlphaPow(%s)", alphaPow)
         self.alphaPow = alphaPow
         self._alphaPowChanged.emit(self.alphaPow)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME)
+
+    def setSamplingRate(self, samplingRate):
+        """the samples per voxel along the rays (0: a fixed number of steps per ray)"""
+        logger.debug("setSamplingRate(%s)", samplingRate)
+        if self._update_value("samplingRate", samplingRate):
+            self._samplingRateChanged.emit(self.samplingRate)
+            self._changed(LAYER_VOLUME)
 
     def setValueScale(self, minVal, maxVal):
         logger.debug("set scale to %s,%s" % (minVal, maxVal))
@@ -204,7 +235,7 @@ class TransformModel(QtCore.QObject):
         logger.debug("set min to %s" % (self.minVal))
 
         self._minChanged.emit(self.minVal)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME)
 
     def setMax(self, maxVal):
         self.maxVal = maxVal
@@ -212,23 +243,23 @@ class TransformModel(QtCore.QObject):
         logger.debug("set max to %s" % (self.maxVal))
 
         self._maxChanged.emit(self.maxVal)
-        self._transformChanged.emit()
+        self._changed(LAYER_VOLUME)
 
     def setStackUnits(self, px, py, pz):
         self.stackUnits = px, py, pz
         self._stackUnitsChanged.emit(px, py, pz)
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def setBox(self, isBox=True):
         self.isBox = isBox
         self._boxChanged.emit(isBox)
-        self._transformChanged.emit()
+        self._changed(LAYER_BOX)
 
     def setZoom(self, zoom=1.):
         # self.zoom = np.clip(zoom,.5,2)
         self.zoom = np.clip(zoom, .3, 2)
         self.update()
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def addRotation(self, angle, x, y, z, from_left = True):
         q = Quaternion(np.cos(angle), np.sin(angle) * x, np.sin(angle) * y, np.sin(angle) * z)
@@ -245,19 +276,19 @@ class TransformModel(QtCore.QObject):
         logger.debug("set quaternion to %s", quat.data)
         self.quatRot = Quaternion.copy(quat)
         self._rotationChanged.emit()
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def setEyeDistProj(self, eye_dist_proj=0):
         self.eye_dist_proj = eye_dist_proj
         self.update()
         print(self.eye_dist_proj)
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def setEyeDistCam(self, eye_dist_cam=0.):
         self.eye_dist_cam = eye_dist_cam
         print(self.eye_dist_cam)
         self.update()
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def update(self):
         if self.isPerspective:
@@ -278,7 +309,7 @@ class TransformModel(QtCore.QObject):
 
         self.update()
         self._perspectiveChanged.emit(isPerspective)
-        self._transformChanged.emit()
+        self._changed(LAYERS_VIEW)
 
     def getProjection(self):
         return self.projection
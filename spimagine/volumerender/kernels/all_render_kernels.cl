@@ -6,10 +6,6 @@
   mweigert@mpi-cbg.de
  */
 
-#ifndef maxSteps
-#define maxSteps 505
-#endif
-
 #ifdef QUALIFIER_CONSTANT_TO_GLOBAL
 #define __QUALIFIER_CONSTANT __global
 #else
@@ -25,5 +21,13 @@
 
 #include<iso_kernel.cl>
 
+#include<channel_kernel.cl>
+
+#include<emission_kernel.cl>
+
+#include<composite.cl>
+
+#include<convert_kernel.cl>
+
 
 
@@ -0,0 +1,92 @@
+/*
+
+  min/max brick grid for empty space skipping
+
+  the volume is divided into bricks of brick_size^3 voxels and for each brick
+  the minimum and maximum value (including a one voxel apron, such that linear
+  interpolation inside a brick never reads values outside of that range) is stored
+  as float2 in a buffer of shape (Nz_bricks, Ny_bricks, Nx_bricks)
+
+  mweigert@mpi-cbg.de
+ */
+
+#ifndef BRICK_UTILS_H
+#define BRICK_UTILS_H
+
+#include<utils.cl>
+
+
+__kernel void brick_minmax(VOLUME_ARG(volume),
+						   __global float2 *d_output,
+						   int brick_size,
+						   int isShortType)
+{
+  const volume_sampler_t sampler = CLK_NORMALIZED_COORDS_FALSE |
+	CLK_ADDRESS_CLAMP_TO_EDGE | CLK_FILTER_NEAREST;
+
+  int i = get_global_id(0);
+  int j = get_global_id(1);
+  int k = get_global_id(2);
+
+  const int4 dim = get_volume_dim(volume);
+  int Nx = dim.x;
+  int Ny = dim.y;
+  int Nz = dim.z;
+
+  int x0 = max(i*brick_size-1,0), x1 = min((i+1)*brick_size+1,Nx);
+  int y0 = max(j*brick_size-1,0), y1 = min((j+1)*brick_size+1,Ny);
+  int z0 = max(k*brick_size-1,0), z1 = min((k+1)*brick_size+1,Nz);
+
+  float minVal = INFINITY;
+  float maxVal = -INFINITY;
+
+  for (int z = z0; z < z1; ++z){
+	for (int y = y0; y < y1; ++y){
+	  for (int x = x0; x < x1; ++x){
+		float val = read_voxel(volume, sampler, (int4)(x,y,z,0), isShortType);
+		minVal = fmin(minVal,val);
+		maxVal = fmax(maxVal,val);
+	  }
+	}
+  }
+
+  d_output[i+get_global_size(0)*(j+get_global_size(1)*k)] = (float2)(minVal,maxVal);
+
+}
+
+
+// returns the brick index for the position pos (in normalized texture coordinates)
+inline int4 brick_index(float4 pos, int4 volume_dim, int brick_size){
+  int4 Nb = (volume_dim+brick_size-1)/brick_size;
+  int4 ind = convert_int4_rtn(pos*convert_float4(volume_dim)/brick_size);
+  return clamp(ind,(int4)(0),Nb-1);
+}
+
+inline float2 brick_value(__global const float2 *brick_minmax, int4 ind, int4 volume_dim, int brick_size){
+  int4 Nb = (volume_dim+brick_size-1)/brick_size;
+  return brick_minmax[ind.x+Nb.x*(ind.y+Nb.y*ind.z)];
+}
+
+// the number of steps delta_pos (>=1) after which the ray starting at pos
+// has left the brick ind
+// the outer bricks are treated as extending to infinity (as the sampler clamps to edge)
+inline int brick_exit_steps(float4 pos, float4 delta_pos, int4 ind, int4 volume_dim, int brick_size){
+  int4 Nb = (volume_dim+brick_size-1)/brick_size;
+
+  float4 p = pos*convert_float4(volume_dim);
+  float4 dp = delta_pos*convert_float4(volume_dim);
+
+  float4 lo = convert_float4(ind*brick_size);
+  float4 hi = convert_float4((ind+1)*brick_size);
+
+  lo = select(lo,(float4)(-INFINITY),ind==0);
+  hi = select(hi,(float4)(INFINITY),ind==Nb-1);
+
+  float4 t = select(select((float4)(INFINITY),(lo-p)/dp,dp<0.f),(hi-p)/dp,dp>0.f);
+
+  float t_exit = fmin(fmin(t.x,t.y),t.z);
+
+  return (t_exit < 1.e8f)?max((int)(t_exit)+1,1):(1<<24);
+}
+
+#endif
@@ -0,0 +1,133 @@
+/*
+
+  max projection of multi channel (2-4) volumes in a single pass
+
+  every channel is mapped with its own min/max/gamma and color and the colored
+  projections are added up to an rgb image
+
+  channel_params = [min_0..3, max_0..3, gamma_0..3, r_0, g_0, b_0, ..., r_3, g_3, b_3]
+
+ */
+
+#include<utils.cl>
+
+__kernel void
+max_project_channels(__global float *d_output,
+                  __global float *d_alpha_output,
+                  uint Nx, uint Ny,
+                  float boxMin_x,
+                  float boxMax_x,
+                  float boxMin_y,
+                  float boxMax_y,
+                  float boxMin_z,
+                  float boxMax_z,
+                  float alpha_pow,
+                  int numSteps,
+                  int nChannels,
+                  __constant float* channel_params,
+                  __QUALIFIER_CONSTANT float* invP,
+                  __QUALIFIER_CONSTANT float* invM,
+                  VOLUME_ARG(volume),
+                  int isShortType
+				 )
+{
+  const volume_sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
+	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
+
+  uint x = get_global_id(0);
+  uint y = get_global_id(1);
+
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += 3*Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+
+  float u = (x / (float) Nx)*2.0f-1.0f;
+  float v = (y / (float) Ny)*2.0f-1.0f;
+
+  float4 boxMin = (float4)(boxMin_x,boxMin_y,boxMin_z,1.f);
+  float4 boxMax = (float4)(boxMax_x,boxMax_y,boxMax_z,1.f);
+
+  // calculate eye ray in world space
+  float4 orig0, orig;
+  float4 direc;
+  float4 temp;
+  float4 back,front;
+
+  front = (float4)(u,v,-1,1);
+  back = (float4)(u,v,1,1);
+
+  orig0 = mult(invP,front);
+  orig0 *= 1.f/orig0.w;
+
+  orig = mult(invM,orig0);
+  orig *= 1.f/orig.w;
+
+  temp = mult(invP,back);
+  temp *= 1.f/temp.w;
+
+  direc = mult(invM,normalize(temp-orig0));
+  direc.w = 0.0f;
+
+  // find intersection with box
+  float tnear, tfar;
+  int hit = intersectBox(orig,direc, boxMin, boxMax, &tnear, &tfar);
+
+  if (!hit) {
+  	if ((x < Nx) && (y < Ny)) {
+	  d_output[3*(x+Nx*y)] = 0.f;
+	  d_output[3*(x+Nx*y)+1] = 0.f;
+	  d_output[3*(x+Nx*y)+2] = 0.f;
+	  d_alpha_output[x+Nx*y] = -1.f;
+  	}
+  	return;
+  }
+  // clamp to near plane
+  if (tnear < 0.0f) tnear = 0.0f;
+
+  const float4 minVals = vload4(0,channel_params);
+  const float4 maxVals = vload4(1,channel_params);
+  const float4 gammas = vload4(2,channel_params);
+
+  // the unused channels stay zero
+  const float4 mask = (float4)(1.f, 1.f, nChannels>2?1.f:0.f, nChannels>3?1.f:0.f);
+  const float4 scale = mask/fmax(maxVals-minVals,1.e-10f);
+
+  const float dt = fabs(tfar-tnear)/(numSteps-1.f);
+
+  float4 delta_pos = .5f*dt*direc;
+  float4 pos = 0.5f *(1.f + orig + tnear*direc);
+
+  float4 colVals = (float4)(0.f);
+
+  // the transmittance of the channels together
+  float cumsum = 1.f;
+
+  for (int i = 0; (i < numSteps) && (cumsum>0.01f); ++i){
+	float4 newVals = read_volume4(volume, volumeSampler, pos, isShortType, nChannels);
+	newVals = clamp((newVals-minVals)*scale,0.f,1.f);
+
+	colVals = fmax(colVals,cumsum*newVals);
+
+	if (alpha_pow>0)
+	  cumsum *= (1.f-alpha_pow*alpha_pow*fmax(fmax(newVals.x,newVals.y),fmax(newVals.z,newVals.w)));
+
+	pos += delta_pos;
+  }
+
+  colVals = pow(colVals,gammas);
+
+  float3 rgb = colVals.x*vload3(0,channel_params+12)
+	+colVals.y*vload3(1,channel_params+12)
+	+colVals.z*vload3(2,channel_params+12)
+	+colVals.w*vload3(3,channel_params+12);
+
+  rgb = clamp(rgb,0.f,1.f);
+
+  if ((x < Nx) && (y < Ny)){
+	vstore3(rgb,x+Nx*y,d_output);
+	d_alpha_output[x+Nx*y] = 1.f;
+  }
+}
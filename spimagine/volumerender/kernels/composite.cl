@@ -0,0 +1,178 @@
+/*
+
+  compositing of partial renderings
+
+  when a volume is too big for the device, it is rendered in slabs along z and
+  the result of every slab is merged into the accumulation buffers by these kernels
+
+  as the slabs are rendered in order of increasing z, every new slab lies either
+  completely in front of or completely behind the already composited ones
+  (depending on the sign of the ray direction along z)
+
+ */
+
+#ifndef COMPOSITE_H
+#define COMPOSITE_H
+
+#include<utils.cl>
+
+
+// the ray direction in model coordinates
+inline float4 ray_direction(uint x, uint y, uint Nx, uint Ny,
+							__QUALIFIER_CONSTANT float* invP,
+							__QUALIFIER_CONSTANT float* invM){
+
+  float u = (x / (float) Nx)*2.0f-1.0f;
+  float v = (y / (float) Ny)*2.0f-1.0f;
+
+  float4 front = (float4)(u,v,-1,1);
+  float4 back = (float4)(u,v,1,1);
+
+  float4 orig0 = mult(invP,front);
+  orig0 *= 1.f/orig0.w;
+
+  float4 temp = mult(invP,back);
+  temp *= 1.f/temp.w;
+
+  float4 direc = mult(invM,normalize(temp-orig0));
+  direc.w = 0.0f;
+  return direc;
+}
+
+// values <= 0 mean that the ray didn't hit the volume
+inline float composite_hit_alpha(float acc_alpha, float alpha){
+  return (acc_alpha<=0.f)?alpha:((alpha<=0.f)?acc_alpha:fmin(acc_alpha,alpha));
+}
+
+
+__kernel void composite_max(__global float *acc_output,
+							__global float *acc_alpha,
+							__global const float *d_output,
+							__global const float *d_alpha,
+							int isFirst)
+{
+  uint i = get_global_id(0)+get_global_size(0)*get_global_id(1);
+
+  if (isFirst){
+	acc_output[i] = d_output[i];
+	acc_alpha[i] = d_alpha[i];
+  }
+  else{
+	acc_output[i] = fmax(acc_output[i],d_output[i]);
+	acc_alpha[i] = composite_hit_alpha(acc_alpha[i],d_alpha[i]);
+  }
+}
+
+// front to back compositing of the attenuated max projection (alpha_pow > 0)
+// d_output already has gamma applied, so the transmittance has to be as well
+__kernel void composite_alpha(__global float *acc_output,
+							  __global float *acc_alpha,
+							  __global float *acc_trans,
+							  __global const float *d_output,
+							  __global const float *d_alpha,
+							  __global const float *d_trans,
+							  float gamma,
+							  int isFirst,
+							  __QUALIFIER_CONSTANT float* invP,
+							  __QUALIFIER_CONSTANT float* invM)
+{
+  uint x = get_global_id(0);
+  uint y = get_global_id(1);
+  uint Nx = get_global_size(0);
+  uint Ny = get_global_size(1);
+  uint i = x+Nx*y;
+
+  if (isFirst){
+	acc_output[i] = d_output[i];
+	acc_alpha[i] = d_alpha[i];
+	acc_trans[i] = d_trans[i];
+	return;
+  }
+
+  float4 direc = ray_direction(x,y,Nx,Ny,invP,invM);
+
+  float acc = acc_output[i];
+  float trans = acc_trans[i];
+
+  if (direc.z>=0.f)
+	// the new slab is behind
+	acc_output[i] = fmax(acc,pow(trans,gamma)*d_output[i]);
+  else
+	// the new slab is in front
+	acc_output[i] = fmax(d_output[i],pow(d_trans[i],gamma)*acc);
+
+  acc_trans[i] = trans*d_trans[i];
+  acc_alpha[i] = composite_hit_alpha(acc_alpha[i],d_alpha[i]);
+}
+
+// front to back compositing of the (premultiplied) rgb colors d_output and
+// opacities d_alpha of emission_absorption
+__kernel void composite_emission(__global float *acc_output,
+								 __global float *acc_alpha,
+								 __global const float *d_output,
+								 __global const float *d_alpha,
+								 int isFirst,
+								 __QUALIFIER_CONSTANT float* invP,
+								 __QUALIFIER_CONSTANT float* invM)
+{
+  uint x = get_global_id(0);
+  uint y = get_global_id(1);
+  uint Nx = get_global_size(0);
+  uint Ny = get_global_size(1);
+  uint i = x+Nx*y;
+
+  const float3 col = vload3(i,d_output);
+  const float alpha = d_alpha[i];
+
+  if (isFirst){
+	vstore3(col,i,acc_output);
+	acc_alpha[i] = alpha;
+	return;
+  }
+
+  float4 direc = ray_direction(x,y,Nx,Ny,invP,invM);
+
+  float3 acc = vload3(i,acc_output);
+  const float accAlpha = acc_alpha[i];
+
+  if (direc.z>=0.f)
+	// the new slab is behind
+	acc += (1.f-accAlpha)*col;
+  else
+	// the new slab is in front
+	acc = col+(1.f-alpha)*acc;
+
+  vstore3(acc,i,acc_output);
+  acc_alpha[i] = accAlpha+(1.f-accAlpha)*alpha;
+}
+
+// keeps the iso surface hit with the smallest depth
+// normal_scale_z corrects the z component of the normals for the slab scaling
+__kernel void composite_iso(__global float *acc_output,
+							__global float *acc_alpha,
+							__global float *acc_depth,
+							__global float *acc_normals,
+							__global const float *d_output,
+							__global const float *d_alpha,
+							__global const float *d_depth,
+							__global const float *d_normals,
+							float normal_scale_z,
+							int isFirst)
+{
+  uint i = get_global_id(0)+get_global_size(0)*get_global_id(1);
+
+  if (isFirst || (d_depth[i]<acc_depth[i])){
+	float4 normal = (float4)(d_normals[3*i],d_normals[3*i+1],normal_scale_z*d_normals[3*i+2],0.f);
+	if (length(normal)>0.f)
+	  normal = normalize(normal);
+
+	acc_output[i] = d_output[i];
+	acc_alpha[i] = d_alpha[i];
+	acc_depth[i] = d_depth[i];
+	acc_normals[3*i] = normal.x;
+	acc_normals[3*i+1] = normal.y;
+	acc_normals[3*i+2] = normal.z;
+  }
+}
+
+#endif
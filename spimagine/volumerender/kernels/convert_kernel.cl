@@ -0,0 +1,98 @@
+/*
+
+  conversion of raw uploaded data into the render and storage types
+
+  dst[dst_offset+i] = convert(scale*src[i]+offset)
+
+  there is one kernel convert_<src type>_<dst type> for every combination, the
+  integer targets saturate, half data is read and written with vload_half/vstore_half
+  (that need no fp16 support of the device) and clamped to the range of half
+
+  quantize_bricks encodes float data as quantized volume (see volume_access.cl)
+
+ */
+
+#ifndef CONVERT_KERNEL_H
+#define CONVERT_KERNEL_H
+
+#include<utils.cl>
+
+#define HALF_MAX_VALUE 65504.f
+
+#define STORE_float(dst,i,x) dst[i] = (x)
+#define STORE_ushort(dst,i,x) dst[i] = convert_ushort_sat(x)
+#define STORE_uchar(dst,i,x) dst[i] = convert_uchar_sat(x)
+#define STORE_half(dst,i,x) vstore_half(clamp(x,-HALF_MAX_VALUE,HALF_MAX_VALUE),i,dst)
+
+#define LOAD_SRC(src,i) ((float)src[i])
+#define LOAD_HALF(src,i) vload_half(i,src)
+
+#define CONVERT_KERNEL(SRC, DST, LOAD)                                    \
+__kernel void convert_##SRC##_##DST(__global const SRC *src,             \
+                                     __global DST *dst,                   \
+                                     const int dst_offset,                \
+                                     const float scale,                   \
+                                     const float offset)                  \
+{                                                                         \
+  int i = get_global_id(0);                                               \
+  STORE_##DST(dst, dst_offset+i, scale*LOAD(src,i)+offset);               \
+}
+
+#define CONVERT_KERNELS(SRC, LOAD)              \
+  CONVERT_KERNEL(SRC, float, LOAD)              \
+  CONVERT_KERNEL(SRC, ushort, LOAD)             \
+  CONVERT_KERNEL(SRC, uchar, LOAD)              \
+  CONVERT_KERNEL(SRC, half, LOAD)
+
+CONVERT_KERNELS(char, LOAD_SRC)
+CONVERT_KERNELS(uchar, LOAD_SRC)
+CONVERT_KERNELS(short, LOAD_SRC)
+CONVERT_KERNELS(ushort, LOAD_SRC)
+CONVERT_KERNELS(int, LOAD_SRC)
+CONVERT_KERNELS(uint, LOAD_SRC)
+CONVERT_KERNELS(long, LOAD_SRC)
+CONVERT_KERNELS(ulong, LOAD_SRC)
+CONVERT_KERNELS(float, LOAD_SRC)
+CONVERT_KERNELS(half, LOAD_HALF)
+
+
+// quantizes the slices [z0,z0+nz) (z0 and nz multiples of VOLUME_QUANT_BRICK, unless
+// at the end) of a quantized volume of size (Nx,Ny,Nz) from the float data src of these
+// slices, one work item per brick
+__kernel void quantize_bricks(__global const float *src,
+							  __global uchar *dst,
+							  const int Nx, const int Ny, const int Nz,
+							  const int z0, const int nz)
+{
+  const int4 dim = (int4)(Nx,Ny,Nz,1);
+  const int4 b = (int4)(get_global_id(0),get_global_id(1),get_global_id(2),0);
+
+  const int x0 = b.x*VOLUME_QUANT_BRICK, x1 = min(x0+VOLUME_QUANT_BRICK,Nx);
+  const int y0 = b.y*VOLUME_QUANT_BRICK, y1 = min(y0+VOLUME_QUANT_BRICK,Ny);
+  const int zs0 = b.z*VOLUME_QUANT_BRICK, zs1 = min(zs0+VOLUME_QUANT_BRICK,nz);
+
+  float minVal = INFINITY, maxVal = -INFINITY;
+
+  for (int z = zs0; z < zs1; ++z)
+	for (int y = y0; y < y1; ++y)
+	  for (int x = x0; x < x1; ++x){
+		const float val = src[x+Nx*(y+Ny*z)];
+		minVal = fmin(minVal,val);
+		maxVal = fmax(maxVal,val);
+	  }
+
+  const float scale = (maxVal-minVal)/255.f;
+
+  for (int z = zs0; z < zs1; ++z)
+	for (int y = y0; y < y1; ++y)
+	  for (int x = x0; x < x1; ++x){
+		const float q = scale>0.f?(src[x+Nx*(y+Ny*z)]-minVal)/scale:0.f;
+		dst[x+Nx*(y+Ny*(z+z0))] = convert_uchar_sat_rte(q);
+	  }
+
+  const int4 nb = quant_bricks(dim);
+  __global float2 *table = (__global float2 *)(dst+quant_table_offset(dim));
+  table[b.x+nb.x*(b.y+nb.y*(b.z+z0/VOLUME_QUANT_BRICK))] = (float2)(scale,minVal);
+}
+
+#endif
@@ -2,61 +2,113 @@
 
 
 // scalar functions
+//
+// tiled over work groups of CONV_TILE x CONV_TILE pixels that first load their rows/columns
+// (plus the halo of Nh/2 pixels) into local memory, so the global size has to be
+// a multiple of CONV_TILE in x and y (the image size is Nx,Ny), Nh/2 is clamped to CONV_MAX_HALF
+
+#define CONV_TILE 16
+#define CONV_MAX_HALF 16
+
+// the weights of the window offsets -r..r into weights[0..2r]
+inline void conv_weights(__local float *weights, const int r, const int Nh){
+  const int lid = get_local_id(0)+CONV_TILE*get_local_id(1);
+  if (lid<=2*r)
+	weights[lid] = native_exp(-10.f*(lid-r)*(lid-r)/Nh/Nh);
+}
 
 __kernel void conv_x(__global float * input,
 						__global float * output,
+					 const int Nx, const int Ny,
 						  const int Nh){
 
-  int i = get_global_id(0);
-  int j = get_global_id(1);
-  
-  int Nx = get_global_size(0);
+  __local float tile[CONV_TILE][CONV_TILE+2*CONV_MAX_HALF];
+  __local float weights[2*CONV_MAX_HALF+1];
 
-  float res = 0.f;
-  float sum_val= 0.f;
-  int start = i-Nh/2;
+  const int i = get_global_id(0);
+  const int j = get_global_id(1);
+  const int lx = get_local_id(0);
+  const int ly = get_local_id(1);
 
-  const int h_start = ((i-Nh/2)<0)?Nh/2-i:0;
-  const int h_end = ((i+Nh/2)>=Nx)?Nh-(i+Nh/2-Nx+1):Nh;
+  const int r = min(Nh/2,CONV_MAX_HALF);
 
-  for (int ht = h_start; ht< h_end; ++ht){
-      float val = native_exp((float)(-10.f*(ht-Nh/2.f)*(ht-Nh/2.f)/Nh/Nh));
-      sum_val += val;
-      res += val*input[start+ht+j*Nx];
-  }
+  // the view index, if a batch of views is processed over (Nx,Ny,nViews)
+  const int offset = Nx*Ny*get_global_id(2);
+  input += offset;
+  output += offset;
+
+  const int x0 = get_group_id(0)*CONV_TILE-r;
+  const int jc = min(j,Ny-1);
+
+  for (int k = lx; k < CONV_TILE+2*r; k += CONV_TILE)
+	tile[ly][k] = input[clamp(x0+k,0,Nx-1)+jc*Nx];
 
+  conv_weights(weights, r, Nh);
 
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if ((i>=Nx) || (j>=Ny))
+	return;
+
+  // the window is cut (and renormalized) at the image borders
+  const int h_start = max(-r,-i);
+  const int h_end = min(r,Nx-1-i);
+
+  float res = 0.f;
+  float sum_val= 0.f;
+
+  for (int h = h_start; h<= h_end; ++h){
+	sum_val += weights[h+r];
+	res += weights[h+r]*tile[ly][lx+r+h];
+  }
 
-	
   output[i+j*Nx] = res/sum_val;
 }
 
 __kernel void conv_y(__global float * input,
 						__global float * output,
+					 const int Nx, const int Ny,
 						  const int Nh){
 
-  int i = get_global_id(0);
-  int j = get_global_id(1);
-  
-  int Nx = get_global_size(0);
-  int Ny = get_global_size(1);
+  __local float tile[CONV_TILE+2*CONV_MAX_HALF][CONV_TILE];
+  __local float weights[2*CONV_MAX_HALF+1];
 
-  float res = 0.f;
-  float sum_val= 0.f;
+  const int i = get_global_id(0);
+  const int j = get_global_id(1);
+  const int lx = get_local_id(0);
+  const int ly = get_local_id(1);
 
-  int start = j-Nh/2;
+  const int r = min(Nh/2,CONV_MAX_HALF);
 
-  const int h_start = ((j-Nh/2)<0)?Nh/2-j:0;
-  const int h_end = ((j+Nh/2)>=Ny)?Nh-(j+Nh/2-Ny+1):Nh;
+  // the view index, if a batch of views is processed over (Nx,Ny,nViews)
+  const int offset = Nx*Ny*get_global_id(2);
+  input += offset;
+  output += offset;
 
-  
-  for (int ht = h_start; ht< h_end; ++ht){
-       float val = native_exp((float)(-10.f*(ht-Nh/2.f)*(ht-Nh/2.f)/Nh/Nh));
-      sum_val += val;
-      res += val*input[i+(start+ht)*Nx];
+  const int y0 = get_group_id(1)*CONV_TILE-r;
+  const int ic = min(i,Nx-1);
+
+  for (int k = ly; k < CONV_TILE+2*r; k += CONV_TILE)
+	tile[k][lx] = input[ic+clamp(y0+k,0,Ny-1)*Nx];
+
+  conv_weights(weights, r, Nh);
+
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  if ((i>=Nx) || (j>=Ny))
+	return;
+
+  const int h_start = max(-r,-j);
+  const int h_end = min(r,Ny-1-j);
+
+  float res = 0.f;
+  float sum_val= 0.f;
+
+  for (int h = h_start; h<= h_end; ++h){
+	sum_val += weights[h+r];
+	res += weights[h+r]*tile[ly+r+h][lx];
   }
 
-	
   output[i+j*Nx] = res/sum_val;
 }
 
@@ -71,6 +123,11 @@ __kernel void conv_vec_x(__global float * input,
 
   int Nx = get_global_size(0);
 
+  // the view index, if a batch of views is processed over (Nx,Ny,nViews)
+  const int offset = 3*Nx*get_global_size(1)*get_global_id(2);
+  input += offset;
+  output += offset;
+
   float res_x = 0.f;
   float res_y = 0.f;
   float res_z = 0.f;
@@ -108,6 +165,11 @@ __kernel void conv_vec_y(__global float * input,
   int Nx = get_global_size(0);
   int Ny = get_global_size(1);
 
+  // the view index, if a batch of views is processed over (Nx,Ny,nViews)
+  const int offset = 3*Nx*Ny*get_global_id(2);
+  input += offset;
+  output += offset;
+
   float res_x = 0.f;
   float res_y = 0.f;
   float res_z = 0.f;
@@ -0,0 +1,164 @@
+/*
+
+  front to back emission-absorption rendering with a pre-integrated transfer function
+
+  tf_table[i_back*tf_size+i_front] = (mean r, mean g, mean b, mean extinction) of the
+  transfer function between the normalized front and back values of a ray segment
+  (see transfer_function.py), so the step size only changes the accuracy of the
+  sampled values and not the opacity of thin features
+
+  rays are stopped as soon as they are (almost) opaque
+
+ */
+
+#include<utils.cl>
+#include<brick_utils.cl>
+
+// the opacity above which rays are terminated
+#define OPAQUE_ALPHA 0.99f
+
+inline float4 tf_lookup(__global const float4 *tf_table, int tf_size, float sf, float sb){
+  const float2 p = (float2)(sf,sb)*(tf_size-1);
+  const int2 i0 = min(convert_int2(p),tf_size-2);
+  const float2 f = p-convert_float2(i0);
+
+  const float4 c00 = tf_table[i0.x+tf_size*i0.y];
+  const float4 c10 = tf_table[i0.x+1+tf_size*i0.y];
+  const float4 c01 = tf_table[i0.x+tf_size*(i0.y+1)];
+  const float4 c11 = tf_table[i0.x+1+tf_size*(i0.y+1)];
+
+  return mix(mix(c00,c10,f.x),mix(c01,c11,f.x),f.y);
+}
+
+__kernel void
+emission_absorption(__global float *d_output,
+                  __global float *d_alpha_output,
+                  uint Nx, uint Ny,
+                  float boxMin_x,
+                  float boxMax_x,
+                  float boxMin_y,
+                  float boxMax_y,
+                  float boxMin_z,
+                  float boxMax_z,
+                  float minVal,
+                  float maxVal,
+                  float emptyVal,
+                  int numSteps,
+                  __global const float4 *tf_table,
+                  int tf_size,
+                  __QUALIFIER_CONSTANT float* invP,
+                  __QUALIFIER_CONSTANT float* invM,
+                  VOLUME_ARG(volume),
+                  int isShortType,
+                  __global const float2 *brick_minmax,
+                  int brick_size
+				 )
+{
+  const volume_sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
+	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
+
+  uint x = get_global_id(0);
+  uint y = get_global_id(1);
+
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += 3*Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+
+  float u = (x / (float) Nx)*2.0f-1.0f;
+  float v = (y / (float) Ny)*2.0f-1.0f;
+
+  float4 boxMin = (float4)(boxMin_x,boxMin_y,boxMin_z,1.f);
+  float4 boxMax = (float4)(boxMax_x,boxMax_y,boxMax_z,1.f);
+
+  // calculate eye ray in world space
+  float4 orig0, orig;
+  float4 direc;
+  float4 temp;
+  float4 back,front;
+
+  front = (float4)(u,v,-1,1);
+  back = (float4)(u,v,1,1);
+
+  orig0 = mult(invP,front);
+  orig0 *= 1.f/orig0.w;
+
+  orig = mult(invM,orig0);
+  orig *= 1.f/orig.w;
+
+  temp = mult(invP,back);
+  temp *= 1.f/temp.w;
+
+  direc = mult(invM,normalize(temp-orig0));
+  direc.w = 0.0f;
+
+  // find intersection with box
+  float tnear, tfar;
+  int hit = intersectBox(orig,direc, boxMin, boxMax, &tnear, &tfar);
+
+  if (!hit) {
+  	if ((x < Nx) && (y < Ny)) {
+	  vstore3((float3)(0.f),x+Nx*y,d_output);
+	  d_alpha_output[x+Nx*y] = 0.f;
+  	}
+  	return;
+  }
+  // clamp to near plane
+  if (tnear < 0.0f) tnear = 0.0f;
+
+  const float dt = fabs(tfar-tnear)/(numSteps-1.f);
+
+  // the length of a step in box units
+  const float segLength = dt*length(direc.xyz);
+
+  float4 delta_pos = .5f*dt*direc;
+  float4 pos = 0.5f *(1.f + orig + tnear*direc);
+
+  const int4 volume_dim = get_volume_dim(volume);
+  const float scale = 1.f/fmax(maxVal-minVal,1.e-10f);
+
+  float sf = clamp((read_image(volume, volumeSampler, pos, isShortType)-minVal)*scale,0.f,1.f);
+
+  float3 colVal = (float3)(0.f);
+  float alphaVal = 0.f;
+
+  int i = 1;
+
+  while ((i < numSteps) && (alphaVal < OPAQUE_ALPHA)){
+	int k = numSteps-i;
+
+	if (brick_size>0){
+	  int4 ind = brick_index(pos, volume_dim, brick_size);
+	  k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+
+	  // bricks with only transparent values neither emit nor absorb
+	  if (brick_value(brick_minmax, ind, volume_dim, brick_size).y <= emptyVal){
+		pos += k*delta_pos;
+		i += k;
+		sf = clamp((read_image(volume, volumeSampler, pos, isShortType)-minVal)*scale,0.f,1.f);
+		continue;
+	  }
+	}
+
+	for (int j = 0; (j < k) && (alphaVal < OPAQUE_ALPHA); ++j){
+	  pos += delta_pos;
+	  float sb = clamp((read_image(volume, volumeSampler, pos, isShortType)-minVal)*scale,0.f,1.f);
+
+	  float4 seg = tf_lookup(tf_table, tf_size, sf, sb);
+	  float alpha = 1.f-exp(-segLength*seg.w);
+
+	  colVal += (1.f-alphaVal)*alpha*seg.xyz;
+	  alphaVal += (1.f-alphaVal)*alpha;
+
+	  sf = sb;
+	}
+	i += k;
+  }
+
+  if ((x < Nx) && (y < Ny)){
+	vstore3(clamp(colVal,0.f,1.f),x+Nx*y,d_output);
+	d_alpha_output[x+Nx*y] = alphaVal;
+  }
+}
@@ -9,10 +9,66 @@
 
 
 #include<utils.cl>
+#include<brick_utils.cl>
 
 #include<convolve_2d.cl>
 #include<occlusion.cl>
 
+// the number of bisection steps that refine the hit between two ray samples
+#ifndef ISO_BISECT_STEPS
+#define ISO_BISECT_STEPS 8
+#endif
+
+
+// the central difference gradient (per voxel) of every voxel of the volume
+// that can be precomputed once per dataset instead of computed at every hit
+__kernel void iso_gradient(VOLUME_ARG(volume),
+						   int isShortType,
+						   __global float4 *d_output)
+{
+  const volume_sampler_t sampler = CLK_NORMALIZED_COORDS_FALSE |
+	CLK_ADDRESS_CLAMP_TO_EDGE | CLK_FILTER_NEAREST;
+
+  int4 ipos = (int4)(get_global_id(0),get_global_id(1),get_global_id(2),0);
+
+  const int4 dim = get_volume_dim(volume);
+
+  float4 grad;
+  grad.x = read_voxel(volume, sampler, ipos+(int4)(1,0,0,0), isShortType)-
+	read_voxel(volume, sampler, ipos-(int4)(1,0,0,0), isShortType);
+  grad.y = read_voxel(volume, sampler, ipos+(int4)(0,1,0,0), isShortType)-
+	read_voxel(volume, sampler, ipos-(int4)(0,1,0,0), isShortType);
+  grad.z = read_voxel(volume, sampler, ipos+(int4)(0,0,1,0), isShortType)-
+	read_voxel(volume, sampler, ipos-(int4)(0,0,1,0), isShortType);
+  grad.w = 0.f;
+
+  d_output[ipos.x+dim.x*(ipos.y+dim.y*ipos.z)] = .5f*grad;
+}
+
+inline float4 gradient_voxel(__global const float4 *gradient, int4 dim, int4 ind){
+  ind = clamp(ind,(int4)(0),dim-1);
+  return gradient[ind.x+dim.x*(ind.y+dim.y*ind.z)];
+}
+
+// the gradient volume at normalized coordinates (trilinear, clamp to edge)
+inline float4 gradient_read(__global const float4 *gradient, int4 dim, float4 pos){
+  float4 p = pos*convert_float4(dim)-.5f;
+  float4 p0 = floor(p);
+  float4 f = p-p0;
+  int4 i0 = convert_int4(p0);
+
+  float4 c00 = mix(gradient_voxel(gradient, dim, i0),
+				   gradient_voxel(gradient, dim, i0+(int4)(1,0,0,0)),f.x);
+  float4 c10 = mix(gradient_voxel(gradient, dim, i0+(int4)(0,1,0,0)),
+				   gradient_voxel(gradient, dim, i0+(int4)(1,1,0,0)),f.x);
+  float4 c01 = mix(gradient_voxel(gradient, dim, i0+(int4)(0,0,1,0)),
+				   gradient_voxel(gradient, dim, i0+(int4)(1,0,1,0)),f.x);
+  float4 c11 = mix(gradient_voxel(gradient, dim, i0+(int4)(0,1,1,0)),
+				   gradient_voxel(gradient, dim, i0+(int4)(1,1,1,0)),f.x);
+
+  return mix(mix(c00,c10,f.y),mix(c01,c11,f.y),f.z);
+}
+
 
 __kernel void iso_surface(
 						  __global float *d_output,
@@ -28,17 +84,31 @@ __kernel void iso_surface(
 						  float boxMax_z,
 						  float isoVal,
 						  float gamma,
+						  int numSteps,
 						  __QUALIFIER_CONSTANT float* invP,
 						  __QUALIFIER_CONSTANT float* invM,
-						  __read_only image3d_t volume,
-						  int isShortType)
+						  VOLUME_ARG(volume),
+						  int isShortType,
+						  __global const float2 *brick_minmax,
+						  int brick_size,
+						  __global const float4 *gradient,
+						  int useGradient)
 {
-  const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
+  const volume_sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
 
   uint x = get_global_id(0);
   uint y = get_global_id(1);
 
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+  d_depth_output += Nx*Ny*iv;
+  d_normals_output += 3*Nx*Ny*iv;
+
   float u = (x / (float) Nx)*2.0f-1.0f;
   float v = (y / (float) Ny)*2.0f-1.0f;
 
@@ -94,7 +164,7 @@ __kernel void iso_surface(
   float alphaVal = 0;
 
 
-  float dt = 1.f*(tfar-tnear)/(maxSteps-1.f);
+  float dt = 1.f*(tfar-tnear)/(numSteps-1.f);
 
   //uint entropy = (uint)( 6779514*length(orig) + 6257327*length(direc) );
   //orig += dt*random(entropy+x,entropy+y)*direc;
@@ -103,30 +173,49 @@ __kernel void iso_surface(
   float4 delta_pos = .5f*dt*direc;
   float4 pos = 0.5f *(1.f + orig + tnear*direc);
 
-  float newVal = read_imagef(volume, volumeSampler, pos).x;
+  float newVal = read_volumef(volume, volumeSampler, pos);
   int isGreater = newVal>isoVal;
   int hitIso = 0;
 
   float t_hit = INFINITY;
 
 
+  const int4 volume_dim = get_volume_dim(volume);
+
   int i = 1;
 
+  pos += delta_pos;
+
   //search for the intersection
-  for(i=1; i<maxSteps; i++) {
-  	pos += delta_pos;
-	t_hit = tnear +i*dt;
+  while (i<numSteps) {
+	int k = numSteps-i;
+
+	if (brick_size>0){
+	  int4 ind = brick_index(pos, volume_dim, brick_size);
+	  k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+	  float2 minmax = brick_value(brick_minmax, ind, volume_dim, brick_size);
+
+	  // skip the brick if its value range does not include isoVal
+	  if (isGreater?(minmax.x>isoVal):(minmax.y<=isoVal)){
+		pos += k*delta_pos;
+		i += k;
+		continue;
+	  }
+	}
 
-    //newVal = read_imagef(volume, volumeSampler, pos).x;
-	newVal = read_image(volume, volumeSampler, pos, isShortType);
+	for (int j = 0; j < k; ++j){
+	  newVal = read_image(volume, volumeSampler, pos, isShortType);
 
+	  if ((newVal>isoVal) != isGreater){
+		hitIso = 1;
+		break;
+	  }
+	  pos += delta_pos;
+	  i++;
+	}
 
-    if ((newVal>isoVal) != isGreater){
-	  hitIso = 1;
-	  
+	if (hitIso)
 	  break;
-	}
-	
   }
 
   if (!hitIso){
@@ -139,28 +228,22 @@ __kernel void iso_surface(
   	  return;
   }
 
-
-
-  //if intersection found bisect, TODO!
-  const int maxBisect = 10;
-  hitIso = 0;
-
-  float4 delta_pos2 = delta_pos/maxBisect;
-  float dt2 = dt/maxBisect;
-
-  pos = 0.5f *(1.f + orig + tnear*direc)+(i-1)*delta_pos;
-
-  int j = 1;
-  for(j=1; j<=maxBisect; j++) {
-  	newVal = read_image(volume, volumeSampler, pos, isShortType);
-    pos += delta_pos2;
-	t_hit += dt2;
-	if ((newVal>isoVal) != isGreater){
-	  hitIso = 1;
-	  break;
-	}
+  // the iso value is crossed between the samples i-1 and i, so bisect that interval
+  float4 pos0 = pos-delta_pos;
+  float s0 = 0.f, s1 = 1.f;
+
+  for (int j = 0; j < ISO_BISECT_STEPS; ++j){
+	float s = .5f*(s0+s1);
+	newVal = read_image(volume, volumeSampler, pos0+s*delta_pos, isShortType);
+	if ((newVal>isoVal) != isGreater)
+	  s1 = s;
+	else
+	  s0 = s;
   }
 
+  pos = pos0+.5f*(s0+s1)*delta_pos;
+  t_hit = tnear+(i-1+.5f*(s0+s1))*dt;
+
   // compute the normals and shading
 
   // phong shading
@@ -172,29 +255,25 @@ __kernel void iso_surface(
   light = mult(invM,light);
   light = normalize(light);
 
-  // the normal
+  // the normal from the gradient (per voxel), scaled to normalized coordinates
   float4 normal;
   float4 reflect;
-  float h = dt;
-
-  h*= pow(gamma,2);
 
-  // robust 2nd order
-  normal.x = 2.f*read_image(volume,volumeSampler,pos+(float4)(h,0,0,0), isShortType)-
-  	2.f*read_image(volume,volumeSampler,pos+(float4)(-h,0,0,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(2.f*h,0,0,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(-2.f*h,0,0,0), isShortType);
-
-  normal.y = 2.f*read_image(volume,volumeSampler,pos+(float4)(0,h,0,0), isShortType)-
-  	2.f*read_image(volume,volumeSampler,pos+(float4)(0,-h,0,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(0,2.f*h,0,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,-2.f*h,0,0), isShortType);
-
-  normal.z = read_image(volume,volumeSampler,pos+(float4)(0,0,h,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,0,-h,0), isShortType)+
-	read_image(volume,volumeSampler,pos+(float4)(0,0,2.f*h,0), isShortType)-
-  	read_image(volume,volumeSampler,pos+(float4)(0,0,-2.f*h,0), isShortType);
+  if (useGradient)
+	normal = gradient_read(gradient, volume_dim, pos);
+  else {
+	// central differences with a step of one voxel
+	const float4 h = 1.f/convert_float4(volume_dim);
+
+	normal.x = read_image(volume,volumeSampler,pos+(float4)(h.x,0,0,0), isShortType)-
+	  read_image(volume,volumeSampler,pos-(float4)(h.x,0,0,0), isShortType);
+	normal.y = read_image(volume,volumeSampler,pos+(float4)(0,h.y,0,0), isShortType)-
+	  read_image(volume,volumeSampler,pos-(float4)(0,h.y,0,0), isShortType);
+	normal.z = read_image(volume,volumeSampler,pos+(float4)(0,0,h.z,0), isShortType)-
+	  read_image(volume,volumeSampler,pos-(float4)(0,0,h.z,0), isShortType);
+  }
 
+  normal *= convert_float4(volume_dim);
   normal.w = 0;
 
   //flip normal if we are comming from values greater than isoVal...
@@ -517,6 +596,16 @@ __kernel void shading(
   uint x = get_global_id(0);
   uint y = get_global_id(1);
 
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+  input_normals += 3*Nx*Ny*iv;
+  input_depth += Nx*Ny*iv;
+  input_occlusion += Nx*Ny*iv;
+
   float u = (x / (float) Nx)*2.0f-1.0f;
   float v = (y / (float) Ny)*2.0f-1.0f;
 
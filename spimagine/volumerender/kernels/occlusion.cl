@@ -38,47 +38,126 @@ __kernel void occlusion_depth(__global float *d_output,
 
 }
 
+// the occlusion of Nx x Ny pixels, computed from the depth of every scale-th pixel
+// of the (Nx_depth,Ny_depth) depth image (scale = 2 for half resolution)
+//
+// offsets are number_points precomputed sample positions in the unit disk that are
+// rotated by a random angle per pixel (and seed), radius is given in pixels of the depth image
+//
+// offset_x/offset_y is the position of the image in a larger (tiled) image,
+// so that the sampling pattern does not depend on the tiling
 __kernel void occlusion(__global float *d_output,
 						  uint Nx, uint Ny,
 						  uint radius,
 						  uint number_points,
 						  __global float *input_depth,
-						  __global float *input_normal
+						  uint Nx_depth, uint Ny_depth,
+						  int scale,
+						  __QUALIFIER_CONSTANT float *offsets,
+						  int offset_x, int offset_y,
+						  uint seed
 						){
 
   int x = get_global_id(0);
   int y = get_global_id(1);
 
-  float depth0 = input_depth[x+y*Nx];
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  d_output += Nx*Ny*iv;
+  input_depth += Nx_depth*Ny_depth*iv;
+
+  const int xd = min(scale*x,(int)Nx_depth-1);
+  const int yd = min(scale*y,(int)Ny_depth-1);
+
+  float depth0 = input_depth[xd+yd*Nx_depth];
+
+  // the rotation of the sample pattern at this pixel
+  const float phi = MPI_2*hash_uniform(xd+offset_x,yd+offset_y,seed);
+  const float c = radius*cos(phi);
+  const float s = radius*sin(phi);
 
   float occ = 0.f;
 
   for(uint i = 0;i<number_points;++i){
+	const float px = offsets[2*i];
+	const float py = offsets[2*i+1];
 
-    //sample point uniformly
-    // float r = radius*native_sqrt((float)(random(x+rand_int(i,i*i,0,1000),y+rand_int(i*i,i,294,97701))));
+    int x2 = clamp((int)(xd+c*px-s*py),(int)0,(int)Nx_depth-1);
+    int y2 = clamp((int)(yd+s*px+c*py),(int)0,(int)Ny_depth-1);
 
-	//sample point non-uniformly
+    float depth = input_depth[x2+y2*Nx_depth];
 
-	float r = radius*(float)(random(x+rand_int(i,i*i,0,1000),y+rand_int(i*i,i,294,97701)));
+    occ += (depth<depth0?1.f:0.f);
+  }
 
-    float phi = MPI_2*random(x+rand_int(i*i,i,0,1997),y+rand_int(i,i*i,569,17633));
+  d_output[x+Nx*y]  = occ/number_points;
 
-    int x2 = clamp((int)(x+r*cos(phi)),(int)0,(int)Nx-1);
-    int y2 = clamp((int)(y+r*sin(phi)),(int)0,(int)Ny-1);
+}
 
-    float depth = input_depth[x2+y2*Nx];
+// upsamples the (half resolution) occlusion input of size (Nx_low,Ny_low) to Nx x Ny,
+// the low resolution pixels are weighted by their depth difference to the pixel,
+// so the occlusion does not bleed over depth edges
+__kernel void occlusion_upsample(__global float *d_output,
+								 uint Nx, uint Ny,
+								 __global const float *input,
+								 uint Nx_low, uint Ny_low,
+								 __global const float *input_depth
+								 ){
 
-    occ += (depth<depth0?1.f:0.f);
+  int x = get_global_id(0);
+  int y = get_global_id(1);
 
-	// if ((x==200)&&(y==200)){
-	//   printf("%d \n",i);
-	// }
-	
+  const uint iv = get_global_id(2);
+  d_output += Nx*Ny*iv;
+  input += Nx_low*Ny_low*iv;
+  input_depth += Nx*Ny*iv;
+
+  const float depth0 = input_depth[x+Nx*y];
+  const float sigma = isinf(depth0)?1.f:.01f*fabs(depth0)+1.e-6f;
+
+  const float2 p = .5f*(float2)(x,y);
+  const int2 i0 = convert_int2(floor(p));
+  const float2 f = p-convert_float2(i0);
+
+  float res = 0.f;
+  float sum_weights = 0.f;
+
+  // the fallback if all neighbours are far away in depth
+  float res_nearest = 0.f;
+  float diff_nearest = INFINITY;
+
+  for (int dy = 0; dy <= 1; ++dy){
+	for (int dx = 0; dx <= 1; ++dx){
+	  const int xl = min(i0.x+dx,(int)Nx_low-1);
+	  const int yl = min(i0.y+dy,(int)Ny_low-1);
+
+	  const float depth = input_depth[min(2*xl,(int)Nx-1)+Nx*min(2*yl,(int)Ny-1)];
+	  const float diff = (isinf(depth)&&isinf(depth0))?0.f:fabs(depth-depth0);
+
+	  const float val = input[xl+Nx_low*yl];
+
+	  const float w = (dx?f.x:1.f-f.x)*(dy?f.y:1.f-f.y)*native_exp(-diff/sigma);
+
+	  res += w*val;
+	  sum_weights += w;
+
+	  if (diff<diff_nearest){
+		diff_nearest = diff;
+		res_nearest = val;
+	  }
+	}
   }
 
-  d_output[x+Nx*y]  = occ/number_points;
+  d_output[x+Nx*y] = (sum_weights>1.e-6f)?res/sum_weights:res_nearest;
+}
+
+// accumulates the occlusion of several frames, acc = (1-weight)*acc+weight*input
+__kernel void occlusion_accumulate(__global float *acc,
+								   __global const float *input,
+								   float weight){
 
+  const size_t i = get_global_id(0)+get_global_size(0)*(get_global_id(1)+get_global_size(1)*get_global_id(2));
+  acc[i] = mix(acc[i],input[i],weight);
 }
 
 
@@ -37,6 +37,18 @@ inline float rand_int(uint x, uint y, int start, int end)
 
 }
 
+// a cheap hash of the pixel position and seed to [0,1), e.g. to jitter the
+// ray starts of neighbouring pixels independently
+inline float hash_uniform(uint x, uint y, uint seed){
+  uint h = (x*73856093u)^(y*19349663u)^(seed*83492791u);
+  h = (h^61u)^(h>>16);
+  h *= 9u;
+  h ^= h>>4;
+  h *= 0x27d4eb2du;
+  h ^= h>>15;
+  return h*(1.f/4294967296.f);
+}
+
 
 int intersectBox(float4 r_o, float4 r_d, float4 boxmin, float4 boxmax, float *tnear, float *tfar)
 {
@@ -72,6 +84,6 @@ float4 mult(__QUALIFIER_CONSTANT float* M, float4 v){
 
 
 
-#define read_image(volume,sampler, pos,isShortType) (isShortType?1.f*read_imageui(volume, sampler, pos).x:read_imagef(volume, sampler, pos).x)
+#include<volume_access.cl>
 
 #endif
@@ -0,0 +1,141 @@
+/*
+
+  access to the volume data, either as image3d_t (default) or, if VOLUME_BUFFER
+  is defined, as a plain global buffer for devices without (usable) 3d image support
+
+  kernels declare the volume argument with VOLUME_ARG(volume) and read it with
+
+  read_volumef(volume, sampler, pos)             float data at normalized coordinates
+  read_volumeui(volume, sampler, pos)            integer data at normalized coordinates
+  read_image(volume, sampler, pos, isShortType)  either of both
+  read_voxel(volume, sampler, ipos, isShortType) at integer coordinates (nearest)
+  read_volume4(volume, sampler, pos, isShortType, nChannels)  all channels of a multi channel volume
+  get_volume_dim(volume)                         (Nx,Ny,Nz,1)
+
+  in buffer mode the volume argument is (buffer, Nx, Ny, Nz, dtype) with
+  dtype 0 = float32, 1 = uint16, 2 = uint8, 3 = float16, 4 = quantized uint8,
+  samplers are ignored and the interpolation is given by SAMPLER_FILTER (always
+  clamping to edge)
+
+  quantized volumes store every voxel as uint8 q, followed (at the next multiple
+  of 8 bytes) by a float2 (scale, offset) per brick of VOLUME_QUANT_BRICK^3 voxels,
+  the value of a voxel is offset+scale*q of its brick (so interpolation, that is
+  done after decoding, is exact across brick borders)
+
+  multi channel volumes are RG/RGBA images or buffers with the channels stored
+  one after another, channels beyond nChannels are undefined
+
+ */
+
+#ifndef VOLUME_ACCESS_H
+#define VOLUME_ACCESS_H
+
+#ifndef SAMPLER_FILTER
+#define SAMPLER_FILTER CLK_FILTER_LINEAR
+#endif
+
+#define VOLUME_QUANT_BRICK 8
+
+// the number of bricks of a quantized volume
+inline int4 quant_bricks(int4 dim){
+  return (dim+VOLUME_QUANT_BRICK-1)/VOLUME_QUANT_BRICK;
+}
+
+// the byte offset of the brick table of a quantized volume
+inline size_t quant_table_offset(int4 dim){
+  return ((size_t)dim.x*dim.y*dim.z+7)/8*8;
+}
+
+#ifdef VOLUME_BUFFER
+
+#define VOLUME_ARG(v) __global const void *v, int v##_Nx, int v##_Ny, int v##_Nz, int v##_dtype
+
+typedef int volume_sampler_t;
+
+#define get_volume_dim(v) ((int4)(v##_Nx,v##_Ny,v##_Nz,1))
+
+#define read_volumef(v, sampler, pos) buffer_read(v, get_volume_dim(v), v##_dtype, pos)
+#define read_volumeui(v, sampler, pos) buffer_read(v, get_volume_dim(v), v##_dtype, pos)
+#define read_image(v, sampler, pos, isShortType) buffer_read(v, get_volume_dim(v), v##_dtype, pos)
+#define read_voxel(v, sampler, ipos, isShortType) buffer_voxel(v, get_volume_dim(v), v##_dtype, ipos)
+#define read_volume4(v, sampler, pos, isShortType, nChannels) buffer_read4(v, get_volume_dim(v), v##_dtype, nChannels, pos)
+
+
+inline float buffer_voxel(__global const void *v, int4 dim, int dtype, int4 ind){
+  ind = clamp(ind,(int4)(0),dim-1);
+  int i = ind.x+dim.x*(ind.y+dim.y*ind.z);
+
+  if (dtype==1)
+	return (float)((__global const ushort *)v)[i];
+  else if (dtype==2)
+	return (float)((__global const uchar *)v)[i];
+  else if (dtype==3)
+	return vload_half(i, (__global const half *)v);
+  else if (dtype==4){
+	const int4 nb = quant_bricks(dim);
+	const int4 b = ind/VOLUME_QUANT_BRICK;
+	const float2 so = ((__global const float2 *)((__global const uchar *)v+quant_table_offset(dim)))
+	  [b.x+nb.x*(b.y+nb.y*b.z)];
+	return so.y+so.x*((__global const uchar *)v)[i];
+  }
+  else
+	return ((__global const float *)v)[i];
+}
+
+// same as read_imagef with normalized coordinates and clamp to edge
+inline float buffer_read(__global const void *v, int4 dim, int dtype, float4 pos){
+
+  float4 p = pos*convert_float4(dim);
+
+  if (SAMPLER_FILTER==CLK_FILTER_NEAREST)
+	return buffer_voxel(v, dim, dtype, convert_int4_rtn(p));
+
+  p -= .5f;
+  float4 p0 = floor(p);
+  float4 f = p-p0;
+  int4 i0 = convert_int4(p0);
+
+  float c000 = buffer_voxel(v, dim, dtype, i0);
+  float c100 = buffer_voxel(v, dim, dtype, i0+(int4)(1,0,0,0));
+  float c010 = buffer_voxel(v, dim, dtype, i0+(int4)(0,1,0,0));
+  float c110 = buffer_voxel(v, dim, dtype, i0+(int4)(1,1,0,0));
+  float c001 = buffer_voxel(v, dim, dtype, i0+(int4)(0,0,1,0));
+  float c101 = buffer_voxel(v, dim, dtype, i0+(int4)(1,0,1,0));
+  float c011 = buffer_voxel(v, dim, dtype, i0+(int4)(0,1,1,0));
+  float c111 = buffer_voxel(v, dim, dtype, i0+(int4)(1,1,1,0));
+
+  float c00 = mix(c000,c100,f.x);
+  float c10 = mix(c010,c110,f.x);
+  float c01 = mix(c001,c101,f.x);
+  float c11 = mix(c011,c111,f.x);
+
+  return mix(mix(c00,c10,f.y),mix(c01,c11,f.y),f.z);
+}
+
+inline float4 buffer_read4(__global const void *v, int4 dim, int dtype, int nChannels, float4 pos){
+  const size_t channelBytes = (size_t)dim.x*dim.y*dim.z*(dtype==0?4:(dtype==1||dtype==3?2:1));
+
+  float res[4] = {0.f, 0.f, 0.f, 0.f};
+  for (int c = 0; c < min(nChannels,4); ++c)
+	res[c] = buffer_read((__global const uchar *)v+c*channelBytes, dim, dtype, pos);
+
+  return (float4)(res[0],res[1],res[2],res[3]);
+}
+
+#else
+
+#define VOLUME_ARG(v) __read_only image3d_t v
+
+typedef sampler_t volume_sampler_t;
+
+#define get_volume_dim(v) ((int4)(get_image_dim(v).xyz,1))
+
+#define read_volumef(v, sampler, pos) read_imagef(v, sampler, pos).x
+#define read_volumeui(v, sampler, pos) (1.f*read_imageui(v, sampler, pos).x)
+#define read_image(v, sampler, pos, isShortType) (isShortType?1.f*read_imageui(v, sampler, pos).x:read_imagef(v, sampler, pos).x)
+#define read_voxel(v, sampler, ipos, isShortType) read_image(v, sampler, ipos, isShortType)
+#define read_volume4(v, sampler, pos, isShortType, nChannels) (isShortType?convert_float4(read_imageui(v, sampler, pos)):read_imagef(v, sampler, pos))
+
+#endif
+
+#endif
@@ -11,16 +11,28 @@
 
 
 #include<utils.cl>
+#include<brick_utils.cl>
 
 
 #define LOOPUNROLL 16
 
+// the number of steps (at most numSteps) along a ray of length len (in units of direc)
+// that sample the volume sampling_rate times per voxel
+inline int adaptive_steps(const float4 direc, const float len, const int4 volume_dim,
+						  const float sampling_rate, const int numSteps){
+  // (direc.w == 0)
+  const float4 direcVoxels = .5f*direc*convert_float4(volume_dim);
+  return clamp((int)ceil(len*sampling_rate*length(direcVoxels)),1,numSteps);
+}
+
 
 // the basic max_project ray casting
 __kernel void
 max_project_float(__global float *d_output,
                   __global float *d_alpha_output,
                   __global float *d_depth_output,
+                  __global float *d_trans_output,
+                  __global float *d_raw_output,
                   uint Nx, uint Ny,
                   float boxMin_x,
                   float boxMax_x,
@@ -32,19 +44,34 @@ max_project_float(__global float *d_output,
                   float maxVal,
                   float gamma,
                   float alpha_pow,
+                  int numSteps,
+                  float sampling_rate,
                   int numParts,
                   int currentPart,
+                  float jitter,
                   __QUALIFIER_CONSTANT float* invP,
                   __QUALIFIER_CONSTANT float* invM,
-                  __read_only image3d_t volume
+                  VOLUME_ARG(volume),
+                  __global const float2 *brick_minmax,
+                  int brick_size
 				 )
 {
-  const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
+  const volume_sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
 
   uint x = get_global_id(0);
   uint y = get_global_id(1);
 
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+  d_depth_output += Nx*Ny*iv;
+  d_trans_output += Nx*Ny*iv;
+  d_raw_output += Nx*Ny*iv;
+
   float u = (x / (float) Nx)*2.0f-1.0f;
   float v = (y / (float) Ny)*2.0f-1.0f;
 
@@ -86,6 +113,9 @@ max_project_float(__global float *d_output,
   	if ((x < Nx) && (y < Ny)) {
   	  d_output[x+Nx*y] = 0.f;
 	  d_alpha_output[x+Nx*y] = -1.f;
+	  d_depth_output[x+Nx*y] = INFINITY;
+	  d_trans_output[x+Nx*y] = 1.f;
+	  d_raw_output[x+Nx*y] = -1.f;
   	}
   	return;
   }
@@ -97,13 +127,24 @@ max_project_float(__global float *d_output,
   float colVal = 0;
   float alphaVal = 0;
 
-  const int reducedSteps = maxSteps/numParts;
+  const int4 volume_dim = get_volume_dim(volume);
+
+  // with sampling_rate > 0 the step length follows the voxel size (along the ray),
+  // otherwise every ray is divided into numSteps steps
+  const int reducedSteps = (sampling_rate>0)?
+	max(adaptive_steps(direc, fabs(tfar-tnear), volume_dim, sampling_rate, numSteps)/numParts,1):
+	numSteps/numParts;
 
-  const float dt = fabs(tfar-tnear)/((reducedSteps/LOOPUNROLL)*LOOPUNROLL);
+  const float dt = (sampling_rate>0)?fabs(tfar-tnear)/reducedSteps:
+	fabs(tfar-tnear)/(max(reducedSteps/LOOPUNROLL,1)*LOOPUNROLL);
 
-  //apply the shift if mulitpass
+  // the parts sample the ray interleaved, shifted per pixel (and per frame by
+  // jitter >= 0) so that the first parts show noise instead of banding
+  const float pixelOffset = hash_uniform(x,y,0)+fmax(jitter,0.f);
+  const float partOffset = ((numParts>1) || (jitter>=0))?
+	(currentPart+pixelOffset-floor(pixelOffset))/numParts:0.f;
 
-  orig += currentPart*dt*direc;
+  orig += partOffset*dt*direc;
 
   //  dither the original
   // uint entropy = (uint)( 6779514*length(orig) + 6257327*length(direc) );
@@ -116,45 +157,82 @@ max_project_float(__global float *d_output,
 
   int maxInd = 0;
 
+  const int nSteps = (sampling_rate>0)?reducedSteps+1:(reducedSteps/LOOPUNROLL+1)*LOOPUNROLL;
+
+  // values not greater than emptyVal don't contribute to the projection
+  const float emptyVal = (maxVal == 0)?0.f:((maxVal>minVal)?minVal:-INFINITY);
+
+  // the transmittance left after the ray has passed the volume
+  float trans = 1.f;
+
+  // the maximum before the display mapping (the data value for alpha_pow == 0),
+  // rays that miss the box get -1
+  float rawVal = 0.f;
+
+  int i = 0;
 
   if (alpha_pow==0){
-  	for(int i=0; i<=reducedSteps/LOOPUNROLL; ++i){
-  	  for (int j = 0; j < LOOPUNROLL; ++j){
-		newVal = read_imagef(volume, volumeSampler, pos).x;
-		maxInd = newVal>colVal?i*LOOPUNROLL+j:maxInd;
+	while (i < nSteps){
+	  int k = nSteps-i;
+
+	  if (brick_size>0){
+		int4 ind = brick_index(pos, volume_dim, brick_size);
+		k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+
+		// skip the brick if it cannot increase the current maximum
+		if (brick_value(brick_minmax, ind, volume_dim, brick_size).y <= fmax(colVal,emptyVal)){
+		  pos += k*delta_pos;
+		  i += k;
+		  continue;
+		}
+	  }
+
+	  for (int j = 0; j < k; ++j){
+		newVal = read_volumef(volume, volumeSampler, pos);
+		maxInd = newVal>colVal?i+j:maxInd;
 		colVal = fmax(colVal,newVal);
 
-
-  		// colVal = fmax(colVal,read_imagef(volume, volumeSampler, pos).x);
 		pos += delta_pos;
-  	  }
-  	}
+	  }
+	  i += k;
+	}
+	rawVal = colVal;
   	colVal = (maxVal == 0)?colVal:(colVal-minVal)/(maxVal-minVal);
   	alphaVal = colVal;
 
   }
   else	{
     float cumsum = 1.f;
-  	for(int i=0; i<=reducedSteps/LOOPUNROLL; ++i){
-  	  for (int j = 0; j < LOOPUNROLL; ++j){
-  		newVal = read_imagef(volume, volumeSampler, pos).x;
+	while ((i < nSteps) && (cumsum>0.01f)){
+	  int k = nSteps-i;
+
+	  if (brick_size>0){
+		int4 ind = brick_index(pos, volume_dim, brick_size);
+		k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+
+		// empty bricks neither contribute nor attenuate
+		if (brick_value(brick_minmax, ind, volume_dim, brick_size).y <= emptyVal){
+		  pos += k*delta_pos;
+		  i += k;
+		  continue;
+		}
+	  }
+
+	  for (int j = 0; j < k; ++j){
+  		newVal = read_volumef(volume, volumeSampler, pos);
   		newVal = (maxVal == 0)?newVal:(newVal-minVal)/(maxVal-minVal);
-  		maxInd = cumsum*newVal>colVal?i*LOOPUNROLL+j:maxInd;
+  		maxInd = cumsum*newVal>colVal?i+j:maxInd;
   		colVal = fmax(colVal,cumsum*newVal);
-  		//colVal = fmax(colVal,newVal);
 
   		cumsum  *= (1.f-alpha_pow*alpha_pow*clamp(newVal,0.f,1.f));
   		pos += delta_pos;
   		if (cumsum<=0.01f)
   		  break;
-
-          //if((x==400)&&(y==400))
-          //   printf("cumsum (it %d): %.5f\n",j,alpha_pow);
-
-
   	  }
+	  i += k;
   	}
-
+	trans = cumsum;
+	rawVal = colVal;
   }
 
 
@@ -173,12 +251,17 @@ max_project_float(__global float *d_output,
 	if (currentPart==0){
 	  d_output[x+Nx*y] = colVal;
 	  d_alpha_output[x+Nx*y] = alphaVal;
-
-
+	  d_trans_output[x+Nx*y] = trans;
 	}
 	else{
 	  d_output[x+Nx*y] = fmax(colVal,d_output[x+Nx*y]);
 	  d_alpha_output[x+Nx*y] = fmax(alphaVal,d_alpha_output[x+Nx*y]);
+	  d_trans_output[x+Nx*y] = fmin(trans,d_trans_output[x+Nx*y]);
+	}
+	// the depth of the maximum over all parts
+	if ((currentPart==0) || (rawVal>d_raw_output[x+Nx*y])){
+	  d_raw_output[x+Nx*y] = rawVal;
+	  d_depth_output[x+Nx*y] = tnear+(partOffset+maxInd)*dt;
 	}
 
   }
@@ -191,6 +274,8 @@ __kernel void
 max_project_short(__global float *d_output,
                 __global float *d_alpha_output,
                   __global float *d_depth_output,
+                  __global float *d_trans_output,
+                  __global float *d_raw_output,
                   uint Nx,
                   uint Ny,
                   float boxMin_x,
@@ -203,21 +288,36 @@ max_project_short(__global float *d_output,
                   float maxVal,
                   float gamma,
                   float alpha_pow,
+                  int numSteps,
+                  float sampling_rate,
                   int numParts,
                   int currentPart,
+                  float jitter,
                   __QUALIFIER_CONSTANT float* invP,
                   __QUALIFIER_CONSTANT float* invM,
-                  __read_only image3d_t volume
+                  VOLUME_ARG(volume),
+                  __global const float2 *brick_minmax,
+                  int brick_size
                   )
 
 {
 
-  const sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
+  const volume_sampler_t volumeSampler =   CLK_NORMALIZED_COORDS_TRUE |
 	CLK_ADDRESS_CLAMP_TO_EDGE | SAMPLER_FILTER;
 
   uint x = get_global_id(0);
   uint y = get_global_id(1);
 
+  // the view index, if a batch of views is rendered over (Nx,Ny,nViews)
+  const uint iv = get_global_id(2);
+  invP += 16*iv;
+  invM += 16*iv;
+  d_output += Nx*Ny*iv;
+  d_alpha_output += Nx*Ny*iv;
+  d_depth_output += Nx*Ny*iv;
+  d_trans_output += Nx*Ny*iv;
+  d_raw_output += Nx*Ny*iv;
+
   float u = (x / (float) Nx)*2.0f-1.0f;
   float v = (y / (float) Ny)*2.0f-1.0f;
 
@@ -259,6 +359,9 @@ max_project_short(__global float *d_output,
   	if ((x < Nx) && (y < Ny)) {
   	  d_output[x+Nx*y] = 0.f;
 	  d_alpha_output[x+Nx*y] = 0.f;
+	  d_depth_output[x+Nx*y] = INFINITY;
+	  d_trans_output[x+Nx*y] = 1.f;
+	  d_raw_output[x+Nx*y] = -1.f;
   	}
   	return;
   }
@@ -270,13 +373,24 @@ max_project_short(__global float *d_output,
   float colVal = 0;
   float alphaVal = 0;
 
-  const int reducedSteps = maxSteps/numParts;
+  const int4 volume_dim = get_volume_dim(volume);
+
+  // with sampling_rate > 0 the step length follows the voxel size (along the ray),
+  // otherwise every ray is divided into numSteps steps
+  const int reducedSteps = (sampling_rate>0)?
+	max(adaptive_steps(direc, fabs(tfar-tnear), volume_dim, sampling_rate, numSteps)/numParts,1):
+	numSteps/numParts;
 
-  const float dt = fabs(tfar-tnear)/((reducedSteps/LOOPUNROLL)*LOOPUNROLL);
+  const float dt = (sampling_rate>0)?fabs(tfar-tnear)/reducedSteps:
+	fabs(tfar-tnear)/(max(reducedSteps/LOOPUNROLL,1)*LOOPUNROLL);
 
-  //apply the shift if mulitpass
+  // the parts sample the ray interleaved, shifted per pixel (and per frame by
+  // jitter >= 0) so that the first parts show noise instead of banding
+  const float pixelOffset = hash_uniform(x,y,0)+fmax(jitter,0.f);
+  const float partOffset = ((numParts>1) || (jitter>=0))?
+	(currentPart+pixelOffset-floor(pixelOffset))/numParts:0.f;
 
-  orig += currentPart*dt*direc;
+  orig += partOffset*dt*direc;
 
   //  dither the original
   // uint entropy = (uint)( 6779514*length(orig) + 6257327*length(direc) );
@@ -287,34 +401,83 @@ max_project_short(__global float *d_output,
 
   float newVal = 0.f;
 
+  int maxInd = 0;
+
+  const int nSteps = (sampling_rate>0)?reducedSteps+1:(reducedSteps/LOOPUNROLL+1)*LOOPUNROLL;
+
+  // values not greater than emptyVal don't contribute to the projection
+  const float emptyVal = (maxVal == 0)?0.f:((maxVal>minVal)?minVal:-INFINITY);
+
+  // the transmittance left after the ray has passed the volume
+  float trans = 1.f;
+
+  // the maximum before the display mapping (the data value for alpha_pow == 0),
+  // rays that miss the box get -1
+  float rawVal = 0.f;
 
+  int i = 0;
 
   if (alpha_pow==0){
-  	for(int i=0; i<=reducedSteps/LOOPUNROLL; ++i){
-  	  for (int j = 0; j < LOOPUNROLL; ++j){
-  		colVal = fmax(colVal,1.f*read_imageui(volume, volumeSampler, pos).x);
+	while (i < nSteps){
+	  int k = nSteps-i;
+
+	  if (brick_size>0){
+		int4 ind = brick_index(pos, volume_dim, brick_size);
+		k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+
+		// skip the brick if it cannot increase the current maximum
+		if (brick_value(brick_minmax, ind, volume_dim, brick_size).y <= fmax(colVal,emptyVal)){
+		  pos += k*delta_pos;
+		  i += k;
+		  continue;
+		}
+	  }
+
+	  for (int j = 0; j < k; ++j){
+		newVal = read_volumeui(volume, volumeSampler, pos);
+		maxInd = newVal>colVal?i+j:maxInd;
+		colVal = fmax(colVal,newVal);
 		pos += delta_pos;
   	  }
+	  i += k;
   	}
+	rawVal = colVal;
   	colVal = (maxVal == 0)?colVal:(colVal-minVal)/(maxVal-minVal);
   	alphaVal = colVal;
 
   }
   else	{
   	float cumsum = 1.f;
-  	for(int i=0; i<=reducedSteps/LOOPUNROLL; ++i){
-  	  for (int j = 0; j < LOOPUNROLL; ++j){
-  		newVal = 1.f*read_imageui(volume, volumeSampler, pos).x;
+	while ((i < nSteps) && (cumsum>0.01f)){
+	  int k = nSteps-i;
+
+	  if (brick_size>0){
+		int4 ind = brick_index(pos, volume_dim, brick_size);
+		k = min(k,brick_exit_steps(pos, delta_pos, ind, volume_dim, brick_size));
+
+		// empty bricks neither contribute nor attenuate
+		if (brick_value(brick_minmax, ind, volume_dim, brick_size).y <= emptyVal){
+		  pos += k*delta_pos;
+		  i += k;
+		  continue;
+		}
+	  }
+
+	  for (int j = 0; j < k; ++j){
+  		newVal = read_volumeui(volume, volumeSampler, pos);
   		newVal = (maxVal == 0)?newVal:(newVal-minVal)/(maxVal-minVal);
+  		maxInd = cumsum*newVal>colVal?i+j:maxInd;
   		colVal = fmax(colVal,cumsum*newVal);
-        //colVal = fmax(colVal,newVal);
 
-  		cumsum  *= (1.f-.1f*alpha_pow*alpha_pow*newVal);
+  		cumsum  *= (1.f-.1f*alpha_pow*alpha_pow*clamp(newVal,0.f,1.f));
   		pos += delta_pos;
   		if (cumsum<=0.01f)
   		  break;
       }
+	  i += k;
   	}
+	trans = cumsum;
+	rawVal = colVal;
   }
 
  // if ((x==250) &&(y==250))
@@ -333,13 +496,103 @@ max_project_short(__global float *d_output,
 	if (currentPart==0){
 	  d_output[x+Nx*y] = colVal;
 	  d_alpha_output[x+Nx*y] = alphaVal;
+	  d_trans_output[x+Nx*y] = trans;
 	}
 	else{
 	  d_output[x+Nx*y] = fmax(colVal,d_output[x+Nx*y]);
 	  d_alpha_output[x+Nx*y] = fmax(alphaVal,d_alpha_output[x+Nx*y]);
+	  d_trans_output[x+Nx*y] = fmin(trans,d_trans_output[x+Nx*y]);
+	}
+	// the depth of the maximum over all parts
+	if ((currentPart==0) || (rawVal>d_raw_output[x+Nx*y])){
+	  d_raw_output[x+Nx*y] = rawVal;
+	  d_depth_output[x+Nx*y] = tnear+(partOffset+maxInd)*dt;
 	}
 
   }
 
 
 }
+
+
+// applies minVal, maxVal and gamma to the raw maxima d_raw_output of a
+// max_project_* run with alpha_pow == 0, i.e. gives the same d_output as
+// running it again with the new values but without marching the rays
+__kernel void
+max_project_remap(__global float *d_output,
+                  __global const float *d_raw_output,
+                  float minVal,
+                  float maxVal,
+                  float gamma)
+{
+  uint i = get_global_id(0)+get_global_size(0)*(get_global_id(1)+get_global_size(1)*get_global_id(2));
+
+  float colVal = d_raw_output[i];
+
+  if (colVal<0.f){
+	d_output[i] = 0.f;
+	return;
+  }
+
+  colVal = (maxVal == 0)?colVal:(colVal-minVal)/(maxVal-minVal);
+  d_output[i] = clamp(pow(colVal,gamma),0.f,1.f);
+}
+
+
+// the running maximum of the frames (of alpha_pow == 0 max projections), i.e. given
+// d_accum holds the output, raw maximum and its depth of the maximum of the first n
+// frames (as three planes of Nx*Ny), it and d_output/d_raw/d_depth get the ones of
+// the first n+1 frames
+__kernel void
+accumulate_max(__global float *d_accum,
+               __global float *d_output,
+               __global float *d_raw,
+               __global float *d_depth,
+               int n)
+{
+  const uint N = get_global_size(0)*get_global_size(1);
+  uint i = get_global_id(0)+get_global_size(0)*get_global_id(1);
+
+  if ((n==0) || (d_raw[i]>d_accum[i+N])){
+	d_accum[i] = d_output[i];
+	d_accum[i+N] = d_raw[i];
+	d_accum[i+2*N] = d_depth[i];
+  }
+  else{
+	d_output[i] = d_accum[i];
+	d_raw[i] = d_accum[i+N];
+	d_depth[i] = d_accum[i+2*N];
+  }
+}
+
+
+#define MAX_DIFF_GROUP 64
+
+// the largest absolute difference of a and b (of n elements), e.g. how much a
+// refinement pass changed the output, every work group (of MAX_DIFF_GROUP items)
+// writes the maximum of its elements to d_max[group]
+__kernel void
+max_abs_diff(__global const float *a,
+             __global const float *b,
+             __global float *d_max,
+             int n)
+{
+  __local float part[MAX_DIFF_GROUP];
+  const uint lid = get_local_id(0);
+
+  float val = 0.f;
+  for (uint i = get_global_id(0); i<n; i += get_global_size(0))
+    val = fmax(val,fabs(a[i]-b[i]));
+
+  part[lid] = val;
+  barrier(CLK_LOCAL_MEM_FENCE);
+
+  for (uint s = MAX_DIFF_GROUP/2; s>0; s >>= 1){
+    if (lid<s)
+      part[lid] = fmax(part[lid],part[lid+s]);
+    barrier(CLK_LOCAL_MEM_FENCE);
+  }
+
+  if (lid==0)
+    d_max[get_group_id(0)] = part[0];
+}
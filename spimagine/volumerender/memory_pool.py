@@ -0,0 +1,150 @@
+"""
+a pool of device buffers and images that reuses released allocations
+
+allocations are keyed by (kind, shape, dtype, channels), released objects are kept
+(up to a byte budget, the oldest ones are freed first) and handed out again by the
+next allocation with the same key, so switching datasets or resizing windows back
+and forth does not allocate (and fragment) device memory again and again
+
+usage:
+
+pool = memory_pool()  # the shared pool of the current device
+
+buf = pool.array((512,512), np.float32)
+img = pool.image((100,512,512), np.uint16)
+...
+pool.release(buf, img)  # both must not be used anymore afterwards
+
+print(pool.stats())
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pyopencl as cl
+from gputools import OCLArray, OCLImage, get_device
+
+import spimagine
+
+logger = logging.getLogger(__name__)
+
+# the pools per device context
+_pools = {}
+
+
+def _empty_image(shape, dtype, num_channels):
+    if np.dtype(dtype)!=np.float16:
+        return OCLImage.empty(shape, dtype=dtype, num_channels=num_channels)
+
+    # OCLImage.empty does not know half floats
+    order = {1: cl.channel_order.R, 2: cl.channel_order.RG, 4: cl.channel_order.RGBA}[num_channels]
+    img = OCLImage(get_device().context, cl.mem_flags.READ_WRITE,
+                   cl.ImageFormat(order, cl.channel_type.HALF_FLOAT), shape=shape[::-1])
+    img.dtype = np.float16
+    img.num_channels = num_channels
+    return img
+
+
+class MemoryPool(object):
+    """ hands out OCLArrays and OCLImages, reusing the released ones of the same
+    kind, shape, dtype and number of channels
+    """
+
+    def __init__(self, max_free_bytes=0):
+        # the released objects, oldest first: id -> (key, object, nbytes)
+        self._free = OrderedDict()
+        self.free_bytes = 0
+        self.n_allocated = 0
+        self.n_reused = 0
+        self.n_released = 0
+        self.set_max_free_bytes(max_free_bytes)
+
+    def set_max_free_bytes(self, max_free_bytes):
+        """the released objects are kept as long as they need at most max_free_bytes"""
+        self.max_free_bytes = max(0, int(max_free_bytes))
+        self._evict()
+
+    def array(self, shape, dtype=np.float32):
+        """an (uninitialized) OCLArray"""
+        key = ("array", tuple(shape), np.dtype(dtype).str, 1)
+        buf = self._take(key)
+        if buf is None:
+            buf = self._new(key, OCLArray.empty(tuple(shape), dtype=dtype))
+        return buf
+
+    def zeros(self, shape, dtype=np.float32):
+        """an OCLArray filled with zeros"""
+        buf = self.array(shape, dtype)
+        buf.fill(0)
+        return buf
+
+    def image(self, shape, dtype=np.float32, num_channels=1):
+        """an (uninitialized) OCLImage of the numpy shape (Nz,Ny,Nx) or (Ny,Nx)"""
+        key = ("image", tuple(shape), np.dtype(dtype).str, num_channels)
+        img = self._take(key)
+        if img is None:
+            img = self._new(key, _empty_image(tuple(shape), dtype, num_channels))
+        return img
+
+    def release(self, *objs):
+        """returns objects (that were handed out by this pool) for reuse,
+        None and foreign objects are ignored"""
+        for obj in objs:
+            key = getattr(obj, "_poolKey", None)
+            if key is None or id(obj) in self._free:
+                continue
+            nbytes = self._nbytes(key)
+            self._free[id(obj)] = (key, obj, nbytes)
+            self.free_bytes += nbytes
+            self.n_released += 1
+        self._evict()
+
+    def clear(self):
+        """frees all released objects"""
+        self._free.clear()
+        self.free_bytes = 0
+
+    def stats(self):
+        return dict(allocated=self.n_allocated, reused=self.n_reused, released=self.n_released,
+                    free=len(self._free), free_bytes=self.free_bytes,
+                    max_free_bytes=self.max_free_bytes)
+
+    def _nbytes(self, key):
+        _, shape, dtype, num_channels = key
+        return int(np.prod(shape))*np.dtype(dtype).itemsize*num_channels
+
+    def _new(self, key, obj):
+        obj._poolKey = key
+        self.n_allocated += 1
+        logger.debug("allocating %s", key)
+        return obj
+
+    def _take(self, key):
+        for i, (k, obj, nbytes) in self._free.items():
+            if k==key:
+                del self._free[i]
+                self.free_bytes -= nbytes
+                self.n_reused += 1
+                return obj
+        return None
+
+    def _evict(self):
+        while self.free_bytes>self.max_free_bytes and len(self._free)>0:
+            _, (key, _, nbytes) = self._free.popitem(last=False)
+            self.free_bytes -= nbytes
+            logger.debug("freeing %s", key)
+
+
+def memory_pool(dev=None):
+    """the memory pool shared by all users of the device dev (default: the current device)"""
+    if dev is None:
+        dev = get_device()
+
+    key = dev.context.int_ptr
+    if not key in _pools:
+        _pools[key] = MemoryPool(2**20*spimagine.config.__MEMORY_POOL_MB__)
+    return _pools[key]
@@ -0,0 +1,155 @@
+"""
+a cache for the compiled OpenCL programs
+
+programs are shared in process per (device, build options, source) and their
+binaries are stored on disk keyed by device, driver version, build options and
+a hash of the sources (including all kernels in the same folder, as they might
+be included), so that new renderers/windows and restarts skip the compilation
+
+usage:
+
+prog = build_program("kernels/all_render_kernels.cl", build_options = ["-D", "FLAG"])
+prog.run_kernel(...)
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import hashlib
+import tempfile
+from glob import glob
+
+import pyopencl
+from gputools import OCLProgram, get_device
+
+import spimagine
+
+logger = logging.getLogger(__name__)
+
+# the programs built in this process, by (context, options, source hash)
+_programs = {}
+
+# the keys of the builds that failed, so they are not tried again
+_failed = {}
+
+
+class _BinaryProgram(OCLProgram):
+    """an OCLProgram created from a device binary instead of the source"""
+
+    def __init__(self, binary, build_options=[], dev=None):
+        if dev is None:
+            dev = get_device()
+        self._dev = dev
+        self._kernel_dict = {}
+        pyopencl.Program.__init__(self, self._dev.context, [self._dev.device], [binary])
+        self.build(options=build_options)
+
+
+def _source_hash(file_name):
+    """hash of the source file and all kernels next to it (that might be included)"""
+    dirname = os.path.dirname(os.path.abspath(file_name))
+    fnames = [os.path.abspath(file_name)]+sorted(glob(os.path.join(dirname, "*.cl")))
+    h = hashlib.sha1()
+    for fname in fnames:
+        with open(fname, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _device_id(dev):
+    device = dev.device
+    return "%s|%s|%s|%s" % (device.platform.name, device.name,
+                            device.version, device.driver_version)
+
+
+def cache_dir():
+    return os.path.expanduser(spimagine.config.__PROGRAM_CACHE_DIR__)
+
+
+def _cache_file(dev, build_options, src_hash):
+    key = "%s|%s|%s" % (_device_id(dev), " ".join(build_options), src_hash)
+    return os.path.join(cache_dir(), "%s.bin" % hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def _load_binary(fname, build_options, dev):
+    if not os.path.exists(fname):
+        return None
+    try:
+        with open(fname, "rb") as f:
+            prog = _BinaryProgram(f.read(), build_options, dev)
+        logger.debug("loaded program binary %s", fname)
+        return prog
+    except Exception as e:
+        # e.g. a corrupt file or a binary the driver does not accept anymore
+        logger.warning("could not load program binary %s (%s)", fname, e)
+        return None
+
+
+def _save_binary(prog, fname, dev):
+    try:
+        binary = prog.get_info(pyopencl.program_info.BINARIES)[prog.devices.index(dev.device)]
+        dirname = os.path.dirname(fname)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # write to a temporary file first, so other processes never read half written binaries
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, "wb") as f:
+            f.write(binary)
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmpname, fname)
+        logger.debug("saved program binary %s", fname)
+    except Exception as e:
+        logger.warning("could not save program binary %s (%s)", fname, e)
+
+
+def build_program(file_name, build_options=[], dev=None):
+    """returns the OCLProgram of file_name built with build_options
+
+    the program is shared with all previous calls with the same arguments and
+    if possible loaded from the disk cache, failed builds raise the same
+    error again without trying to build again
+    """
+    if dev is None:
+        dev = get_device()
+
+    build_options = list(build_options)
+    src_hash = _source_hash(file_name)
+    key = (dev.context.int_ptr, tuple(build_options), src_hash)
+
+    if key in _programs:
+        return _programs[key]
+
+    if key in _failed:
+        raise _failed[key]
+
+    prog = None
+    fname = None
+
+    if spimagine.config.__PROGRAM_CACHE__:
+        fname = _cache_file(dev, build_options, src_hash)
+        prog = _load_binary(fname, build_options, dev)
+
+    if prog is None:
+        logger.debug("building %s with options %s", file_name, build_options)
+        try:
+            prog = OCLProgram(file_name, build_options=build_options, dev=dev)
+        except Exception as e:
+            _failed[key] = e
+            raise
+        if fname is not None:
+            _save_binary(prog, fname, dev)
+
+    _programs[key] = prog
+    return prog
+
+
+def clear_cache(disk=True):
+    """removes all programs from the in process and (if disk is True) the disk cache"""
+    _programs.clear()
+    _failed.clear()
+    if disk:
+        for fname in glob(os.path.join(cache_dir(), "*.bin")):
+            os.remove(fname)
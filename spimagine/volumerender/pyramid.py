@@ -0,0 +1,104 @@
+"""
+a multi resolution pyramid of a volume, built by block-mean downsampling
+
+level 0 is the original data, every following level is downsampled by a factor
+of 2 along all axes whose physical voxel size is not already much coarser than
+the others (so e.g. an anisotropic z axis is only downsampled once x and y
+have caught up)
+
+usage:
+
+p = VolumePyramid(data, stackUnits = (1.,1.,4.))
+
+for level in range(len(p)):
+    print(p.shape(level), p[level].dtype)
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import numpy as np
+from six.moves import range
+
+logger = logging.getLogger(__name__)
+
+
+def block_mean(data, factors):
+    """downsamples data by taking the mean over blocks of size factors
+    (one factor per axis), incomplete blocks at the border are averaged over
+    the existing voxels only
+    """
+    if len(factors)!=data.ndim:
+        raise ValueError("need one factor per dimension (got %s for ndim = %s)"%(factors, data.ndim))
+
+    res = data
+    for ax, f in enumerate(factors):
+        if f==1:
+            continue
+        n = res.shape[ax]
+        starts = np.arange(0, n, f)
+        counts = np.diff(np.append(starts, n)).astype(np.float32)
+        res = np.add.reduceat(res, starts, axis=ax, dtype=np.float32)
+        res /= counts.reshape((-1,)+(1,)*(data.ndim-ax-1))
+
+    if np.issubdtype(data.dtype, np.integer):
+        res = np.round(res)
+
+    return res.astype(data.dtype, copy=False)
+
+
+def level_factors(shape, spacing):
+    """the downsampling factors (per axis) for the next level
+
+    shape and spacing have the same axis order (e.g. both zyx)
+    """
+    spacing = np.asarray(spacing, np.float64)
+    return tuple(2 if (n>1 and s<2.*np.amin(spacing)) else 1 for n, s in zip(shape, spacing))
+
+
+class VolumePyramid(object):
+    """ a resolution pyramid of a 3d volume
+
+    the levels go down to a size where the largest dimension is not bigger than
+    min_size, their shapes are known on construction but the data of a level is
+    only computed (from the next finer one) when it is accessed the first time
+    """
+
+    def __init__(self, data, stackUnits=(1., 1., 1.), min_size=32):
+        if data.ndim!=3:
+            raise ValueError("data should be 3d (got ndim = %s)"%data.ndim)
+
+        # stackUnits are (dx,dy,dz), data is (z,y,x)
+        spacing = np.array(stackUnits[::-1], np.float64)
+
+        self.levels = [data]
+        self.shapes = [data.shape]
+        self.spacings = [spacing]
+        # the downsampling factors from every level to the next one
+        self.factors = []
+
+        while max(self.shapes[-1])>min_size:
+            factors = level_factors(self.shapes[-1], spacing)
+            spacing = spacing*factors
+            self.shapes.append(tuple((n+f-1)//f for n, f in zip(self.shapes[-1], factors)))
+            self.spacings.append(spacing)
+            self.factors.append(factors)
+
+        logger.debug("pyramid with levels of shapes: %s"%self.shapes)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, level):
+        if level<0:
+            level += len(self)
+        while len(self.levels)<=level:
+            self.levels.append(block_mean(self.levels[-1], self.factors[len(self.levels)-1]))
+        return self.levels[level]
+
+    def shape(self, level):
+        return self.shapes[level]
+
+    def nbytes(self, level):
+        return int(np.prod(self.shapes[level]))*self.levels[0].dtype.itemsize
@@ -0,0 +1,84 @@
+"""
+the outputs of a single render call
+
+the images stay on the device until they are accessed for the first time, so only
+the outputs that are actually used are transferred to the host
+
+usage:
+
+res = rend.render()
+# start the transfers without waiting for them
+res.prefetch("output", "output_alpha")
+...
+out = res.output
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RenderResult(object):
+    """ holds the outputs (device buffers or host arrays) of a render call,
+    device buffers are copied to the host on first access
+
+    as the renderer reuses its device buffers, a result becomes invalid
+    with the next render call (outputs that were already fetched or
+    prefetched stay available)
+    """
+
+    def __init__(self, **outputs):
+        self._buffers = {}
+        self._arrays = {}
+        self._events = {}
+        self._isValid = True
+
+        for name, buf in outputs.items():
+            if isinstance(buf, np.ndarray):
+                self._arrays[name] = buf
+            else:
+                self._buffers[name] = buf
+
+    def names(self):
+        return sorted(list(self._buffers.keys())+list(self._arrays.keys()))
+
+    def prefetch(self, *names):
+        """enqueues the (non blocking) transfers of the given outputs (all if none given)"""
+        import pyopencl as cl
+
+        for name in (names or self.names()):
+            if name in self._arrays:
+                continue
+            if not self._isValid:
+                raise RuntimeError("'%s' was overwritten by a later render call"%name)
+            buf = self._buffers.pop(name)
+            self._arrays[name] = np.empty(buf.shape, buf.dtype)
+            self._events[name] = cl.enqueue_copy(buf.queue, self._arrays[name], buf.data,
+                                                 is_blocking=False)
+
+    def get(self, name):
+        if not name in self._arrays:
+            if not name in self._buffers:
+                raise KeyError("no output '%s' (available: %s)"%(name, self.names()))
+            self.prefetch(name)
+
+        if name in self._events:
+            self._events.pop(name).wait()
+
+        return self._arrays[name]
+
+    def invalidate(self):
+        """called by the renderer before its buffers are overwritten"""
+        self._isValid = False
+
+    def __getattr__(self, name):
+        if not name.startswith("_") and (name in self._buffers or name in self._arrays):
+            return self.get(name)
+        raise AttributeError(name)
+
+    def __contains__(self, name):
+        return name in self._buffers or name in self._arrays
@@ -0,0 +1,80 @@
+"""
+1d rgba transfer functions and their pre-integrated lookup tables for the
+emission-absorption rendering mode
+
+a transfer function is an array of shape (N,4) that maps the normalized
+value s in [0,1] (i.e. (value-minVal)/(maxVal-minVal)) to a color and an opacity,
+where the opacity is given for a segment of length reference_length (in units of
+the box [-1,1]^3)
+
+for a ray segment between the values sf (front) and sb (back) the table holds the
+extinction weighted mean color and the mean extinction coefficient of the transfer
+function between sf and sb, so the kernel gets the exact segment opacity
+1-exp(-length*extinction) for any step size and no features are missed between
+samples (Engel et al. "High-quality pre-integrated volume rendering", 2001)
+
+usage:
+
+tf = transfer_function_from_colormap(cmap, opacity = .05)
+table = preintegrate(tf)
+
+"""
+
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+
+# the segment length the opacities of a transfer function refer to
+reference_length = 2./256
+
+
+def transfer_function_from_colormap(cmap, opacity=.05, gamma=1.):
+    """a transfer function with the colors of cmap (N,3) and an opacity
+    rising from 0 to opacity as s**gamma"""
+    cmap = np.asarray(cmap, np.float32)
+    s = np.linspace(0, 1, len(cmap))
+    return np.concatenate([cmap, (opacity*s**gamma)[:, np.newaxis]], axis=-1).astype(np.float32)
+
+
+def extinction(tf):
+    """the extinction coefficients (per unit length) of the opacities of tf"""
+    alpha = np.clip(np.asarray(tf, np.float64)[:, 3], 0, .999)
+    return -np.log(1.-alpha)/reference_length
+
+
+def _resample(tf, size):
+    tf = np.asarray(tf, np.float64)
+    s0 = np.linspace(0, 1, len(tf))
+    s = np.linspace(0, 1, size)
+    return np.stack([np.interp(s, s0, tf[:, i]) for i in range(4)], axis=-1)
+
+
+def preintegrate(tf, size=256):
+    """the pre-integrated table of shape (size,size,4) with table[i_back,i_front] =
+    (mean r, mean g, mean b, mean extinction) between the front and back values"""
+    tf = _resample(tf, size)
+    tau = extinction(tf)
+    rgb = tf[:, :3]
+
+    # the integrals of the extinction and the extinction weighted colors
+    ds = 1./(size-1)
+    T = np.concatenate([[0], np.cumsum(.5*(tau[1:]+tau[:-1])*ds)])
+    K = np.concatenate([np.zeros((1, 3)),
+                        np.cumsum(.5*((tau*rgb.T).T[1:]+(tau*rgb.T).T[:-1])*ds, axis=0)])
+
+    sf = np.arange(size)[np.newaxis, :]
+    sb = np.arange(size)[:, np.newaxis]
+    dS = (sb-sf)*ds
+    isSame = (sb==sf)
+    dS_safe = np.where(isSame, 1., dS)
+
+    dT = T[sb]-T[sf]
+    meanTau = np.where(isSame, tau[sf], dT/dS_safe)
+
+    dT_safe = np.where(np.abs(dT)>1.e-10, dT, 1.)[..., np.newaxis]
+    meanRgb = np.where((np.abs(dT)>1.e-10)[..., np.newaxis],
+                       (K[sb]-K[sf])/dT_safe,
+                       .5*(rgb[sf]+rgb[sb]))
+
+    table = np.concatenate([meanRgb, meanTau[..., np.newaxis]], axis=-1)
+    return table.astype(np.float32)
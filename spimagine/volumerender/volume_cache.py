@@ -0,0 +1,187 @@
+"""
+a least recently used cache of device volumes with a byte budget
+
+used by the renderer to keep already uploaded timepoints on the device, so
+that revisiting them (e.g. when looping through a time-lapse) needs no transfer
+
+several caches (e.g. of all renderers on a device) can share one CacheBudget,
+then the least recently used volume of all of them is dropped first
+
+usage:
+
+cache = VolumeCache(max_bytes = 2**30)
+
+img = cache.get(key)
+if img is None:
+    img = upload(data)
+    cache.put(key, img, data.nbytes)
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import itertools
+import logging
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# the order in which entries were used last, over all caches
+_stamps = itertools.count()
+
+# the budgets per device context, see device_budget
+_budgets = {}
+
+
+class CacheBudget(object):
+    """ a byte budget shared by several VolumeCaches, as soon as their volumes
+    together need more than max_bytes the least recently used ones (of all caches)
+    are dropped
+    """
+
+    def __init__(self, max_bytes=0):
+        self._caches = weakref.WeakSet()
+        self.set_max_bytes(max_bytes)
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max(0, int(max_bytes))
+        self.evict()
+
+    def add(self, cache):
+        self._caches.add(cache)
+
+    @property
+    def nbytes(self):
+        return sum(cache.nbytes for cache in self._caches)
+
+    def evict(self):
+        while self.nbytes>self.max_bytes:
+            caches = [cache for cache in self._caches if len(cache)>0]
+            if len(caches)==0:
+                break
+            min(caches, key=lambda cache: cache._oldest_stamp())._drop_oldest()
+
+
+def device_budget(max_bytes, dev=None):
+    """the CacheBudget shared by all caches on the device dev (default: the current device),
+    max_bytes is only used if the budget does not exist yet"""
+    if dev is None:
+        from gputools import get_device
+        dev = get_device()
+
+    key = dev.context.int_ptr
+    if not key in _budgets:
+        _budgets[key] = CacheBudget(max_bytes)
+    return _budgets[key]
+
+
+class VolumeCache(object):
+    """ maps keys to device volumes, the least recently used ones are dropped
+    as soon as the volumes together need more than max_bytes
+
+    if budget (a CacheBudget) is given, max_bytes is the one of the budget
+    and all caches that share it stay within it together
+
+    on_evict (if given) is called with every volume that is dropped or removed
+    """
+
+    def __init__(self, max_bytes=0, on_evict=None, budget=None):
+        # key -> (volume, nbytes, stamp of the last use)
+        self._entries = OrderedDict()
+        self.on_evict = on_evict
+        self.budget = budget
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        if budget is None:
+            self.set_max_bytes(max_bytes)
+        else:
+            budget.add(self)
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self.budget is None else self.budget.max_bytes
+
+    def set_max_bytes(self, max_bytes):
+        """the byte budget (of the shared budget, if the cache has one)"""
+        if self.budget is None:
+            self._max_bytes = max(0, int(max_bytes))
+            self._evict()
+        else:
+            self.budget.set_max_bytes(max_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def owns(self, value):
+        """whether value is one of the cached volumes"""
+        return any(v is value for v, _, _ in self._entries.values())
+
+    def get(self, key):
+        """the volume stored for key (marking it as recently used) or None"""
+        if not key in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        value, nbytes, _ = self._entries.pop(key)
+        self._entries[key] = (value, nbytes, next(_stamps))
+        return value
+
+    def put(self, key, value, nbytes):
+        """stores value (that needs nbytes of device memory) for key and drops
+        the least recently used volumes to stay within max_bytes
+
+        returns False (and stores nothing) if value alone is bigger than max_bytes
+        """
+        self.remove(key)
+
+        if nbytes>self.max_bytes:
+            return False
+
+        self._entries[key] = (value, nbytes, next(_stamps))
+        self.nbytes += nbytes
+        self._evict()
+        return True
+
+    def remove(self, key):
+        if key in self._entries:
+            value, nbytes, _ = self._entries.pop(key)
+            self.nbytes -= nbytes
+            self._dropped(value)
+
+    def clear(self):
+        values = [v for v, _, _ in self._entries.values()]
+        self._entries.clear()
+        self.nbytes = 0
+        for value in values:
+            self._dropped(value)
+
+    def _dropped(self, value):
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+    def _oldest_stamp(self):
+        return next(iter(self._entries.values()))[2]
+
+    def _drop_oldest(self):
+        key, (value, nbytes, _) = self._entries.popitem(last=False)
+        self.nbytes -= nbytes
+        logger.debug("dropping %s from the volume cache", key)
+        self._dropped(value)
+
+    def _evict(self):
+        if self.budget is not None:
+            self.budget.evict()
+            return
+
+        while self.nbytes>self.max_bytes and len(self._entries)>0:
+            self._drop_oldest()
+
+    def stats(self):
+        return dict(entries=len(self), nbytes=self.nbytes, max_bytes=self.max_bytes,
+                    hits=self.hits, misses=self.misses)
@@ -19,6 +19,9 @@ rend.set_modelView(dot(mat4_translate(0,0,-7),mat4_scale(.7,.7,.7)))
 
 out = rend.render()
 
+multi channel data of shape (C,Nz,Ny,Nx) with 2-4 channels is projected in a
+single pass into an rgb image (see set_channel for the per channel settings)
+
 
 
 author: Martin Weigert
@@ -40,8 +43,16 @@ import numpy as np
 from scipy.linalg import inv
 from time import time
 import sys
+import pyopencl as cl
+import pyopencl.array as cl_array
 from gputools import init_device, get_device, OCLProgram, OCLArray, OCLImage
 from spimagine.utils.transform_matrices import *
+from spimagine.volumerender.pyramid import VolumePyramid
+from spimagine.volumerender.render_result import RenderResult
+from spimagine.volumerender.program_cache import build_program
+from spimagine.volumerender.transfer_function import preintegrate, transfer_function_from_colormap
+from spimagine.volumerender.volume_cache import VolumeCache, device_budget
+from spimagine.volumerender.memory_pool import memory_pool
 import spimagine
 
 
@@ -56,6 +67,65 @@ def absPath(myPath):
         return os.path.join(base_path, myPath)
 
 
+def _cl_type(dtype):
+    """the OpenCL type of a numpy type (see kernels/convert_kernel.cl)"""
+    return {"i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort",
+            "i4": "int", "u4": "uint", "i8": "long", "u8": "ulong",
+            "f2": "half", "f4": "float"}[np.dtype(dtype).str[1:]]
+
+
+# whether the devices (by context) can read half float images, see _supports_half_images
+_halfImages = {}
+
+_half_test_kernel = """
+__kernel void half_test(__read_only image3d_t img, __global float *out){
+  const sampler_t sampler = CLK_NORMALIZED_COORDS_FALSE|CLK_ADDRESS_CLAMP_TO_EDGE|CLK_FILTER_NEAREST;
+  const int i = get_global_id(0);
+  out[i] = read_imagef(img, sampler, (int4)(i,0,0,0)).x;
+}
+"""
+
+
+def _supports_half_images():
+    """whether the device can read single channel half float 3d images
+
+    some drivers list the format but read wrong values, so it is tested once per device
+    """
+    dev = get_device()
+    key = dev.context.int_ptr
+    if not key in _halfImages:
+        try:
+            vals = np.linspace(-2, 2, 8).astype(np.float32)
+            img = memory_pool().image((1, 1, len(vals)), np.float16)
+            cl.enqueue_copy(dev.queue, img, vals.astype(np.float16).reshape(1, 1, -1),
+                            origin=(0, 0, 0), region=img.shape)
+            out = OCLArray.empty(len(vals), np.float32)
+            prog = cl.Program(dev.context, _half_test_kernel).build()
+            prog.half_test(dev.queue, (len(vals),), None, img, out.data)
+            _halfImages[key] = np.allclose(out.get(), vals)
+            memory_pool().release(img)
+        except Exception as e:
+            logger.debug("no half float images: %s"%e)
+            _halfImages[key] = False
+    return _halfImages[key]
+
+
+def _array_key(arr):
+    """identifies the memory of arr (numpy views of the same data give the same key)"""
+    return (arr.__array_interface__["data"][0], arr.shape, arr.strides, arr.dtype.str)
+
+
+# the work group size of max_abs_diff (MAX_DIFF_GROUP in volume_kernel.cl) and the number of groups
+_MAX_DIFF_GROUP = 64
+_MAX_DIFF_GROUPS = 64
+
+
+def _golden_offset(frame):
+    """the ray start offset (in steps) of the frame, the golden ratio sequence
+    covers [0,1) evenly for any number of frames"""
+    return (frame*(np.sqrt(5)-1.)/2.) % 1.
+
+
 class VolumeRenderer:
     """ renders a data volume by ray casting/max projection
 
@@ -66,9 +136,31 @@ class VolumeRenderer:
                rend.set_modelView(rotMatX(.7))
     """
     dtypes = [np.float32, np.uint16, np.uint8]
+
+    # data of these types is uploaded as is and converted into one of dtypes on the device
+    raw_dtypes = [np.int8, np.int16, np.int32, np.uint32, np.int64, np.uint64,
+                  np.float16, np.float64, np.bool_]
+
+    # the maximal size of the chunks (in bytes) that are converted at once
+    convert_chunk_bytes = 2**26
+
+    # how float32 volumes are stored on the device (see set_storage)
+    storages = ("native", "half", "quantized")
+
+    # the brick size of quantized volumes (VOLUME_QUANT_BRICK in kernels/volume_access.cl)
+    quant_brick = 8
+
     interpolation_defines = {"linear": ["-D", "SAMPLER_FILTER=CLK_FILTER_LINEAR"],
                              "nearest": ["-D", "SAMPLER_FILTER=CLK_FILTER_NEAREST"]}
 
+    methods = ("max_project", "iso_surface", "emission_absorption")
+
+    # the default colors of the channels of multi channel data
+    channel_colors = ((0., 1., 0.), (1., 0., 1.), (0., .5, 1.), (1., 1., 0.))
+
+    # the work group size of the blur kernels (CONV_TILE in kernels/convolve_2d.cl)
+    conv_tile = 16
+
     def __init__(self, size=None, interpolation='linear'):
         """ e.g. size = (300,300)"""
 
@@ -99,10 +191,46 @@ class VolumeRenderer:
                 print(e)
                 print("could not find any OpenCL device ... sorry")
 
+        # the frame buffers and volumes are allocated from the shared device memory pool
+        self.pool = memory_pool()
+        # the brick buffer argument of volumes without bricks (see _compute_bricks)
+        self._brickDummy = None
+
         self.memMax = .7*get_device().get_info("MAX_MEM_ALLOC_SIZE")
 
         # self.memMax = 2.*get_device().get_info("MAX_MEM_ALLOC_SIZE")
 
+        # if True, finer pyramid levels are only uploaded by select_level(allow_upload = True)
+        self.defer_level_upload = False
+
+        # if True, volumes bigger than memMax are rendered at full resolution slab by slab
+        self.out_of_core = False
+
+        # the number of views that are rendered at once (see render_batch)
+        self._nViews = 1
+
+        # whether render_batch has swapped in its buffers and matrices
+        self._inBatch = False
+
+        self.set_value_scale()
+
+        # the number of channels of the data, data with 2-4 channels is rendered in rgb
+        self.nChannels = 1
+
+        # the position of the rendered tile in the full image (see render_tiled)
+        self._tileOffset = (0, 0)
+
+        # the second device volume and the pending upload of prefetch_data
+        self._backImg, self._backFormat = None, None
+        self._prefetched = None
+        self._uploadQueue = None
+
+        # the already uploaded timepoints (see update_data), within a budget
+        # shared by all renderers on the device
+        self.volumeCache = VolumeCache(on_evict=self._release_volume,
+                                       budget=device_budget(self._default_cache_size()))
+
+        self.set_storage()
         self.rebuild_program(interpolation = interpolation)
 
         self.invMBuf = OCLArray.empty(16, dtype=np.float32)
@@ -125,8 +253,15 @@ class VolumeRenderer:
         self.set_occ_strength(.1)
         self.set_occ_radius(21)
         self.set_occ_n_points(30)
+        self.set_occ_half_res()
+        self.set_occ_accumulate()
 
         self.set_alpha_pow()
+        self.set_max_steps()
+        self.set_sampling_rate()
+        self.set_transfer_function()
+        self.set_brick_size()
+        self.set_gradient_volume()
         self.set_box_boundaries()
         self.set_units()
 
@@ -134,11 +269,30 @@ class VolumeRenderer:
         self.set_projection()
 
 
-    def rebuild_program(self, interpolation = "linear"):
-        build_options_basic = ["-I", "%s" % absPath("kernels/"),
-                               "-D", "maxSteps=%s" % spimagine.config.__DEFAULTMAXSTEPS__,
+    def rebuild_program(self, interpolation = "linear", use_buffer = None):
+        """
+        if use_buffer is True, the kernels read the volume from a plain buffer instead
+        of an image3d_t (by default only if the device has no image support)
+        """
+        self._useBufferArg = use_buffer
+        if use_buffer is None:
+            use_buffer = spimagine.config.__USE_VOLUME_BUFFER__ or not get_device().get_info("IMAGE_SUPPORT")
+
+        # quantized volumes (and half volumes without half float images) can only be read from buffers
+        if not use_buffer and (self.storage=="quantized" or
+                               (self.storage=="half" and not _supports_half_images())):
+            logger.info("%s volumes are read from buffers"%self.storage)
+            use_buffer = True
+
+        isChanged = use_buffer!=getattr(self, "use_buffer", use_buffer)
+        self.use_buffer = use_buffer
+        self.interpolation = interpolation
 
-                               ]
+        build_options_basic = ["-I", "%s" % absPath("kernels/")]
+
+        if self.use_buffer:
+            logger.info("reading the volume from buffers instead of images")
+            build_options_basic += ["-D", "VOLUME_BUFFER"]
 
         if spimagine.config.__QUALIFIER_CONSTANT_TO_GLOBAL__:
             build_options_basic += ["-D", "QUALIFIER_CONSTANT_TO_GLOBAL"]
@@ -150,7 +304,7 @@ class VolumeRenderer:
                 "interpolation = '%s' not defined ,valid: %s" % (interpolation, list(VolumeRenderer.interpolation_defines.keys())))
 
         try:
-            self.proc = OCLProgram(absPath("kernels/all_render_kernels.cl"),
+            self.proc = build_program(absPath("kernels/all_render_kernels.cl"),
                                build_options=
                                build_options_basic+
                                ["-cl-finite-math-only",
@@ -159,10 +313,13 @@ class VolumeRenderer:
                                 "-cl-mad-enable"])
         except Exception as e:
             logger.debug(str(e))
-            self.proc = OCLProgram(absPath("kernels/all_render_kernels.cl"),
+            self.proc = build_program(absPath("kernels/all_render_kernels.cl"),
                                    build_options=
                                    build_options_basic)
-        self.proc
+
+        # the volume has to be uploaded again in the other format
+        if isChanged and hasattr(self, "_data"):
+            self.update_data(self._data)
 
     def set_dtype(self, dtype=None):
         if hasattr(self, "dtype") and dtype is self.dtype:
@@ -182,34 +339,85 @@ class VolumeRenderer:
         self.width, self.height = size
         self.reset_buffer()
 
+    def _frame_buffers(self):
+        """all buffers that depend on the render size"""
+        bufs = [getattr(self, name, None) for name in ("buf", "buf_alpha", "buf_depth", "buf_normals",
+                                                       "buf_tmp", "buf_tmp_vec", "buf_occlusion",
+                                                       "buf_occlusion_low", "buf_occlusion_acc",
+                                                       "buf_rgb", "buf_raw", "buf_accum")]
+        return (bufs+list(getattr(self, "_batchBufs", None) or [])
+                +list(getattr(self, "_acc", None) or []))
+
     def reset_buffer(self):
-        self.buf = OCLArray.empty((self.height, self.width), dtype=np.float32)
-        self.buf_alpha = OCLArray.empty((self.height, self.width), dtype=np.float32)
-        self.buf_depth = OCLArray.empty((self.height, self.width), dtype=np.float32)
-        self.buf_normals = OCLArray.empty((self.height, self.width, 3), dtype=np.float32)
-        self.buf_tmp = OCLArray.empty((self.height, self.width), dtype=np.float32)
-        self.buf_tmp_vec = OCLArray.empty((self.height, self.width, 3), dtype=np.float32)
-
-        self.buf_occlusion = OCLArray.empty((self.height, self.width), dtype=np.float32)
-
-        self.output = np.zeros((self.height, self.width), dtype=np.float32)
-        self.output_alpha = np.zeros((self.height, self.width), dtype=np.float32)
-        self.output_depth = np.zeros((self.height, self.width), dtype=np.float32)
-
-    def _get_downsampled_data_slices(self, data):
-        """in case data is bigger then gpu texture memory, we should downsample it
-        if so returns the slice of data to be rendered
-        else returns None (no downsampling)
-        """
-        # Nstep = int(np.ceil(np.sqrt(1.*data.nbytes/self.memMax)))
-        Nstep = int(np.ceil((1.*data.nbytes/self.memMax)**(1./3)))
+        # the old buffers are reused for the next resize to the same size
+        self.pool.release(*self._frame_buffers())
 
-        slices = [slice(0, d, Nstep) for d in data.shape]
-        if Nstep>1:
-            logger.info("downsample image by factor of  %s"%Nstep)
-            return slices
-        else:
-            return None
+        self.buf = self.pool.array((self.height, self.width), dtype=np.float32)
+        self.buf_alpha = self.pool.array((self.height, self.width), dtype=np.float32)
+        self.buf_depth = self.pool.array((self.height, self.width), dtype=np.float32)
+        self.buf_normals = self.pool.array((self.height, self.width, 3), dtype=np.float32)
+        self.buf_tmp = self.pool.array((self.height, self.width), dtype=np.float32)
+        self.buf_tmp_vec = self.pool.array((self.height, self.width, 3), dtype=np.float32)
+
+        # the maxima of max_project before minVal, maxVal and gamma are applied
+        self.buf_raw = self.pool.array((self.height, self.width), dtype=np.float32)
+        self._rawState = None
+
+        # the accumulated jittered frames of accumulate (allocated when needed)
+        self.buf_accum = None
+
+        self.buf_occlusion = self.pool.array((self.height, self.width), dtype=np.float32)
+        self.buf_occlusion_low = self.pool.array(((self.height+1)//2, (self.width+1)//2), dtype=np.float32)
+
+        # the accumulated occlusion of the last frames (allocated when needed)
+        self.buf_occlusion_acc = None
+        self._occKey = None
+        # the view whose iso surface is in buf_depth/buf_normals (see refine)
+        self._isoKey = None
+
+        # the buffers for render_batch
+        self._batchBufs = None
+
+        # the composited slabs of out of core volumes (allocated when needed, see _render_slabs)
+        self._acc = None
+
+        # the rgb output of multi channel volumes and emission_absorption (allocated when needed)
+        self.buf_rgb = None
+
+        # the channel parameters on the device and the ones last written to it (see _channel_params)
+        self.channelParamsBuf = None
+        self._channelParams = None
+
+        self._set_result(output=np.zeros((self.height, self.width), dtype=np.float32),
+                         output_alpha=np.zeros((self.height, self.width), dtype=np.float32),
+                         output_depth=np.zeros((self.height, self.width), dtype=np.float32))
+
+    def _set_result(self, **outputs):
+        if hasattr(self, "result"):
+            self.result.invalidate()
+        self.result = RenderResult(**outputs)
+
+    # the outputs of the last render call (only copied from the device when accessed)
+
+    @property
+    def output(self):
+        return self.result.output
+
+    @property
+    def output_alpha(self):
+        return self.result.output_alpha
+
+    @property
+    def output_depth(self):
+        return self.result.output_depth
+
+    @property
+    def output_normals(self):
+        return self.result.output_normals
+
+    @property
+    def output_occlusion(self):
+        return self.result.output_occlusion
 
     def set_max_val(self, maxVal=0.):
         self.maxVal = maxVal
@@ -227,41 +435,288 @@ class VolumeRenderer:
         self.occ_radius = rad
 
     def set_occ_n_points(self, n_points=31):
+        # (called for every frame by the viewer)
+        if n_points==getattr(self, "occ_n_points", None):
+            return
         self.occ_n_points = n_points
+        # the sample positions in the unit disk (a golden angle spiral, denser at the center)
+        i = np.arange(n_points)
+        r, phi = (i+.5)/n_points, i*np.pi*(3.-np.sqrt(5.))
+        offsets = np.stack([r*np.cos(phi), r*np.sin(phi)], axis=-1).reshape(-1).astype(np.float32)
+        self.pool.release(getattr(self, "occOffsetBuf", None))
+        self.occOffsetBuf = self.pool.array(offsets.shape, np.float32)
+        self.occOffsetBuf.write_array(offsets)
+
+    def set_occ_half_res(self, half_res=None):
+        """if True, the occlusion is computed at half the resolution and upsampled
+        with respect to the depth (default: ao_half_resolution from the config)"""
+        if half_res is None:
+            half_res = spimagine.config.__AO_HALF_RESOLUTION__
+        self.occ_half_res = bool(half_res)
+
+    def set_occ_accumulate(self, n_frames=None):
+        """if n_frames>1, the occlusion of up to n_frames renders of the same view (each
+        with a different sampling pattern) is averaged, after that the accumulated
+        occlusion is reused until the view changes (default: ao_accumulate_frames from the config)"""
+        if n_frames is None:
+            n_frames = spimagine.config.__AO_ACCUMULATE_FRAMES__
+        self.occ_accumulate = max(1, int(n_frames))
+        self._occKey = None
 
     def set_alpha_pow(self, alphaPow=0.):
         self.alphaPow = alphaPow
 
+    def set_channel(self, channel, minVal=None, maxVal=None, gamma=None, color=None):
+        """sets the display range, gamma and (rgb) color of a channel of multi channel data"""
+        if not 0<=channel<4:
+            raise ValueError("channel should be in 0...3, not %s"%channel)
+        if minVal is not None:
+            self.channelMin[channel] = minVal
+        if maxVal is not None:
+            self.channelMax[channel] = maxVal
+        if gamma is not None:
+            self.channelGamma[channel] = gamma
+        if color is not None:
+            self.channelColors[channel] = color
+
+    def _reset_channels(self, data):
+        """the display ranges of the channels of data (C,Nz,Ny,Nx) to their min/max"""
+        self.channelMin = np.array([np.amin(d) for d in data]+[0.]*(4-len(data)), np.float32)
+        self.channelMax = np.array([np.amax(d) for d in data]+[1.]*(4-len(data)), np.float32)
+        self.channelGamma = np.ones(4, np.float32)
+        self.channelColors = np.array(VolumeRenderer.channel_colors, np.float32)
+
+    def set_transfer_function(self, tf=None):
+        """sets the rgba transfer function (N,4) of the emission_absorption mode,
+        the opacities refer to segments of length transfer_function.reference_length
+        (default: a grey ramp)"""
+        if tf is None:
+            tf = transfer_function_from_colormap(np.outer(np.linspace(0, 1, 256), np.ones(3)))
+        self.transfer_function = np.asarray(tf, np.float32)
+        self._tfTable = OCLArray.from_array(preintegrate(self.transfer_function))
+
+        # values below this (normalized) value are transparent, so bricks below can be skipped
+        isOpaque = self.transfer_function[:, 3]>0
+        if isOpaque[0]:
+            self._tfEmpty = -np.inf
+        else:
+            # the last transparent value before the first non transparent one
+            self._tfEmpty = 1.*(np.argmax(isOpaque)-1)/(len(isOpaque)-1) if np.any(isOpaque) else 1.
+
+    def set_max_steps(self, max_steps=None):
+        """the number of samples along each ray (default: max_steps from the config)"""
+        if max_steps is None:
+            max_steps = spimagine.config.__DEFAULTMAXSTEPS__
+        self.max_steps = max(2, int(max_steps))
+
+    def set_sampling_rate(self, sampling_rate=None):
+        """if sampling_rate>0, max_project samples every ray sampling_rate times per voxel
+        (at most max_steps times), otherwise every ray is divided into max_steps steps
+        (default: sampling_rate from the config)"""
+        if sampling_rate is None:
+            sampling_rate = spimagine.config.__SAMPLING_RATE__
+        self.sampling_rate = max(0., float(sampling_rate))
+
+    def set_brick_size(self, brick_size=16):
+        """the edge length (in voxels) of the bricks of the min/max grid that is used
+        to skip empty space during rendering (brick_size = 0 disables skipping)"""
+        self.brick_size = brick_size
+        if getattr(self, "_slabs", None) is not None:
+            self._setup_slabs()
+        elif hasattr(self, "dataImg"):
+            self._update_bricks()
+
+    def set_gradient_volume(self, use_gradient=None):
+        """if True, the gradients of the volume are computed once per dataset and the
+        iso surface normals are interpolated from them instead of computed from
+        central differences at every hit (default: iso_gradient_volume from the config)"""
+        if use_gradient is None:
+            use_gradient = spimagine.config.__ISO_GRADIENT_VOLUME__
+        self.use_gradient = bool(use_gradient)
+        self._reset_gradient()
+        # the kernel still needs a valid buffer argument
+        if getattr(self, "_gradientDummy", None) is None:
+            self._gradientDummy = self.pool.array((1, 4), np.float32)
+
+    def _gradient_buffer(self):
+        """the gradient volume of the current data image (or None if not used)"""
+        if not self.use_gradient or self._slabs is not None:
+            return None
+
+        if self._gradient is None or self._gradient[0] is not self.dataImg:
+            self._reset_gradient()
+            Nx, Ny, Nz = self._volume_shape(self.dataImg)
+            gradBuf = self.pool.array((Nz, Ny, Nx, 4), np.float32)
+            self.proc.run_kernel("iso_gradient", (Nx, Ny, Nz), None,
+                                 *(self._volume_args(self.dataImg)+
+                                   (np.int32(self.dtype in [np.uint16, np.uint8]),
+                                    gradBuf.data)))
+            self._gradient = (self.dataImg, gradBuf)
+
+        return self._gradient[1]
+
+    def _reset_gradient(self):
+        if getattr(self, "_gradient", None) is not None:
+            self.pool.release(self._gradient[1])
+        self._gradient = None
+
+    def _compute_bricks(self, img, brickBuf=None, brick_size=None):
+        """computes the min/max values of every brick of the volume image img
+        (with bricks of size brick_size, default: self.brick_size) into brickBuf
+        (or a new buffer from the pool, brickBuf is released then)"""
+        if brick_size is None:
+            brick_size = self.brick_size
+
+        if brick_size==0:
+            # the kernels still need a valid buffer argument
+            self._release_bricks(brickBuf)
+            if self._brickDummy is None:
+                self._brickDummy = self.pool.array((1, 1, 1, 2), np.float32)
+            return self._brickDummy
+
+        brickShape = tuple(int(np.ceil(1.*n/brick_size)) for n in self._volume_shape(img))
+        if brickBuf is None or brickBuf.shape!=brickShape[::-1]+(2,):
+            self._release_bricks(brickBuf)
+            brickBuf = self.pool.array(brickShape[::-1]+(2,), np.float32)
+
+        self.proc.run_kernel("brick_minmax", brickShape, None,
+                             *(self._volume_args(img)+
+                               (brickBuf.data,
+                                np.int32(brick_size),
+                                np.int32(self.dtype in [np.uint16, np.uint8]))))
+        return brickBuf
+
+    def _release_bricks(self, brickBuf):
+        if brickBuf is not self._brickDummy:
+            self.pool.release(brickBuf)
+
+    def _update_bricks(self):
+        self.brickBuf = self._compute_bricks(self.dataImg, getattr(self, "brickBuf", None))
+
+    def set_storage(self, storage=None):
+        """how float32 volumes are stored on the device (default: volume_storage from the config)
+
+        "native":     as float32 (exact)
+        "half":       as float16, relative error <= 2**-11 (volumes with values beyond the
+                      half range of +-65504 are stored as float32)
+        "quantized":  as uint8 with a scale and offset per brick of quant_brick**3 voxels,
+                      absolute error <= (brick max-brick min)/510 (always read from buffers)
+
+        so half and quantized volumes fit 2 and ~4 times as many voxels into memMax before
+        a pyramid level or slabs are needed, see storage_error for the actual error
+        """
+        if storage is None:
+            storage = spimagine.config.__VOLUME_STORAGE__
+        if not storage in self.storages:
+            raise ValueError("storage should be one of %s (got %s)"%(self.storages, storage))
+
+        isChanged = storage!=getattr(self, "storage", storage)
+        self.storage = storage
+
+        if hasattr(self, "use_buffer"):
+            useBuffer = self.use_buffer
+            self.rebuild_program(self.interpolation, use_buffer=self._useBufferArg)
+            # rebuild_program already uploaded it again if the volume access changed
+            if isChanged and useBuffer==self.use_buffer and hasattr(self, "_data"):
+                self.update_data(self._data)
+
+    def _storage_mode(self):
+        """the storage of the current volume (only single channel float32 volumes are
+        stored with reduced precision)"""
+        if self.dtype==np.float32 and self.nChannels==1:
+            if self.storage=="half" and not self._fits_half():
+                return "native"
+            return self.storage
+        return "native"
+
+    def _source_range(self, data):
+        """the value range of data as it is stored on the device (i.e. after the value scale)"""
+        scale, offset = self._valueScale
+        mi, ma = scale*float(np.amin(data))+offset, scale*float(np.amax(data))+offset
+        return min(mi, ma), max(mi, ma)
+
+    def _fits_half(self):
+        """whether the values of the current data are within the half float range"""
+        sourceRange = getattr(self, "_sourceRange", None)
+        # (comparisons with nan fail, so such data is not stored as half either)
+        return sourceRange is None or max(abs(sourceRange[0]), abs(sourceRange[1]))<=65504.
+
+    def storage_error(self):
+        """the maximal absolute error of the values stored in the current device volume"""
+        mode = self._storage_mode()
+        if mode=="half":
+            # relative to the source values (half subnormals have a spacing of 2**-24)
+            mi, ma = self._sourceRange
+            return max(max(abs(mi), abs(ma))*2.**-11, 2.**-25)
+        elif mode=="quantized":
+            Nx, Ny, Nz = self._volume_shape(self.dataImg)
+            nBricks = np.prod([(n+self.quant_brick-1)//self.quant_brick for n in (Nx, Ny, Nz)])
+            table = np.empty((nBricks, 2), np.float32)
+            cl.enqueue_copy(get_device().queue, table, self.dataImg.data,
+                            src_offset=(Nx*Ny*Nz+7)//8*8)
+            return .5*float(np.amax(table[:, 0]))
+        else:
+            return 0.
+
+    def value_range(self):
+        """the minimum and maximum value of the current device volume"""
+        if self.nChannels==1:
+            # the brick minima/maxima are computed on the device, so only those are transferred
+            brickBuf = self._compute_bricks(self.dataImg, brick_size=32)
+            bricks = brickBuf.get()
+            self._release_bricks(brickBuf)
+            return float(np.amin(bricks[..., 0])), float(np.amax(bricks[..., 1]))
+
+        im = self.dataImg
+        if isinstance(im, OCLArray):
+            tmp_buf = im
+        else:
+            tmp_buf = self.pool.array(im.shape+(im.num_channels,), im.dtype)
+            cl.enqueue_copy(get_device().queue, tmp_buf.data, im, offset=0,
+                            origin=(0, 0, 0), region=im.shape)
+        try:
+            return float(cl_array.min(tmp_buf).get()), float(cl_array.max(tmp_buf).get())
+        finally:
+            if not tmp_buf is im:
+                self.pool.release(tmp_buf)
+
+    def set_value_scale(self, scale=1., offset=0.):
+        """the values of the following uploads are rendered as scale*value+offset
+        (e.g. to normalize them), that is applied on the device while converting"""
+        self._valueScale = (float(scale), float(offset))
+
+    def _render_dtype(self, dtype):
+        """the type the data of type dtype is rendered with"""
+        if self._valueScale!=(1., 0.):
+            return np.float32
+        if dtype.type in self.dtypes:
+            return dtype.type
+        if dtype.type==np.bool_ and np.uint8 in self.dtypes:
+            return np.uint8
+        return np.float32
+
     def set_data(self, data, autoConvert=True, copyData=False):
+        """
+        data of other types than dtypes (e.g. raw_dtypes) is converted on the device
+        while uploading (see _write_volume)
+        """
         logger.debug("set_data")
 
         if not autoConvert and not data.dtype in self.dtypes:
             raise NotImplementedError("data type should be either %s not %s"%(self.dtypes, data.dtype))
 
-        if data.dtype.type in self.dtypes:
-            self.set_dtype(data.dtype.type)
-            _data = data
-        else:
-            print("converting type from %s to %s"%(data.dtype.type, self.dtype))
-            _data = data.astype(self.dtype, copy=False)
-
-        self.dataSlices = self._get_downsampled_data_slices(_data)
-
-        if self.dataSlices is not None:
-            self.set_shape(_data[self.dataSlices].shape[::-1])
-        else:
-            self.set_shape(_data.shape[::-1])
+        self.set_dtype(self._render_dtype(data.dtype))
 
         t = time()
-        self.update_data(_data, copyData=copyData)
+        self.update_data(data, copyData=copyData)
         logger.debug("update data: %s ms"%(1000.*(time()-t)))
         self.update_matrices()
 
     def set_shape(self, dataShape):
         if self.isGPU:
-            self.dataImg = OCLImage.empty(dataShape[::-1], dtype=self.dtype)
+            self.dataImg = self._empty_volume(dataShape[::-1])
         else:
-            raise NotImplementedError("TODO")
+            raise NotImplementedError("no OpenCL image support, use VolumeRendererNumpy instead")
             # self.dataImg = self.dev.createImage(dataShape,
             #     mem_flags = cl.mem_flags.READ_ONLY,
             #     channel_order = cl.channel_order.INTENSITY,
@@ -277,27 +732,649 @@ class VolumeRenderer:
             #         channel_order = cl.channel_order.INTENSITY,
             #         channel_type = cl_datatype_dict[self.dtype])
 
-    def update_data(self, data, copyData=False):
+    def _empty_volume(self, shape):
+        """a device image (or buffer if use_buffer is set) for a volume of shape (Nz,Ny,Nx)"""
+        mode = self._storage_mode()
+        if mode=="quantized":
+            # the voxels and the brick table (see kernels/volume_access.cl) in one buffer
+            nBricks = np.prod([(n+self.quant_brick-1)//self.quant_brick for n in shape])
+            buf = self.pool.array(((int(np.prod(shape))+7)//8*8+8*nBricks,), dtype=np.uint8)
+            buf.volumeShape = tuple(shape[::-1])
+            return buf
+        elif mode=="half":
+            # gputools has no half arrays, so the bits are stored as uint16
+            if self.use_buffer:
+                return self.pool.array(shape, dtype=np.uint16)
+            else:
+                return self.pool.image(shape, dtype=np.float16)
+        elif self.use_buffer:
+            return self.pool.array(shape, dtype=self.dtype)
+        else:
+            return self.pool.image(shape, dtype=self.dtype)
+
+    def _volume_shape(self, img):
+        """the shape (Nx,Ny,Nz) of a device volume"""
+        if self.use_buffer:
+            return getattr(img, "volumeShape", None) or tuple(img.shape[::-1][:3])
+        return img.shape
+
+    def _channel_volume(self, data):
+        """a device image (or buffer if use_buffer is set) for multi channel data (C,Nz,Ny,Nx)"""
+        if self.use_buffer:
+            buf = self.pool.array(data.shape, dtype=self.dtype)
+            buf.set(np.ascontiguousarray(data))
+            return buf
+
+        # there are only images with 1, 2 or 4 channels
+        nChannels = 2 if len(data)==2 else 4
+        arr = np.zeros(data.shape[1:]+(nChannels,), self.dtype)
+        arr[..., :len(data)] = np.moveaxis(data, 0, -1)
+        img = self.pool.image(arr.shape[:3], dtype=self.dtype, num_channels=nChannels)
+        cl.enqueue_copy(get_device().queue, img, arr, origin=(0, 0, 0), region=img.shape)
+        return img
+
+    def _device_nbytes(self, data):
+        """the device memory needed for data (after the conversion into dtype)"""
+        return self._device_size_nbytes(data.size)
+
+    def _device_size_nbytes(self, size):
+        """the device memory needed for a volume of size voxels"""
+        mode = self._storage_mode()
+        if mode=="half":
+            return 2*size
+        elif mode=="quantized":
+            return int(size*(1.+8./self.quant_brick**3))
+        return size*np.dtype(self.dtype).itemsize
+
+    def _host_converted(self, data):
+        """data converted into dtype (and scaled) on the host"""
+        scale, offset = self._valueScale
+        if (scale, offset)!=(1., 0.):
+            data = scale*data.astype(np.float32, copy=False)+np.float32(offset)
+        return data.astype(self.dtype, copy=False)
+
+    def _write_volume(self, img, data):
+        """uploads the volume data (Nz,Ny,Nx) into the device volume img
+
+        data of another type than dtype (or if a value scale is set) is uploaded as is and
+        converted on the device, in chunks of at most convert_chunk_bytes along z
+        """
+        if data.dtype==np.bool_:
+            data = data.view(np.uint8)
+
+        # the raw maxima of the old content are not valid anymore
+        self._rawState = None
+
+        mode = self._storage_mode()
+
+        if mode=="native" and data.dtype==self.dtype and self._valueScale==(1., 0.):
+            img.write_array(np.ascontiguousarray(data))
+            return
+
+        # doubles are not supported by all devices, so they are converted to floats on the host
+        srcType = np.float32 if data.dtype==np.float64 else data.dtype.type
+        # quantized volumes are encoded from float data per brick
+        dstName, dstType = {"half": ("half", np.uint16),
+                            "quantized": ("float", np.float32)}.get(mode, (_cl_type(self.dtype), self.dtype))
+        kernel = "convert_%s_%s"%(_cl_type(srcType), dstName)
+        scale, offset = self._valueScale
+
+        Nz, Ny, Nx = data.shape
+        nz = int(max(1, min(Nz, self.convert_chunk_bytes//max(1, data[0].nbytes))))
+        if mode=="quantized" and nz<Nz:
+            nz = max(self.quant_brick, nz//self.quant_brick*self.quant_brick)
+
+        # gputools has no half arrays, but the kernel only needs the bits
+        bufType = np.uint16 if srcType==np.float16 else srcType
+        src = self.pool.array((nz, Ny, Nx), bufType)
+        # buffer volumes are converted in place, else through a staging buffer
+        isDirect = self.use_buffer and mode!="quantized"
+        dst = None if isDirect else self.pool.array((nz, Ny, Nx), dstType)
+        queue = get_device().queue
+
+        try:
+            for z0 in range(0, Nz, nz):
+                chunk = np.ascontiguousarray(data[z0:z0+nz], dtype=srcType).view(bufType)
+                cl.enqueue_copy(queue, src.data, chunk)
+                if isDirect:
+                    self.proc.run_kernel(kernel, (chunk.size,), None,
+                                         src.data, img.data, np.int32(z0*Ny*Nx),
+                                         np.float32(scale), np.float32(offset))
+                    continue
+
+                self.proc.run_kernel(kernel, (chunk.size,), None,
+                                     src.data, dst.data, np.int32(0),
+                                     np.float32(scale), np.float32(offset))
+                if mode=="quantized":
+                    nBricks = tuple((n+self.quant_brick-1)//self.quant_brick for n in (Nx, Ny, len(chunk)))
+                    self.proc.run_kernel("quantize_bricks", nBricks, None,
+                                         dst.data, img.data,
+                                         np.int32(Nx), np.int32(Ny), np.int32(Nz),
+                                         np.int32(z0), np.int32(len(chunk)))
+                else:
+                    cl.enqueue_copy(queue, img, dst.data, offset=0,
+                                    origin=(0, 0, z0), region=(Nx, Ny, len(chunk)))
+        finally:
+            self.pool.release(src, dst)
+
+    def _volume_args(self, img):
+        """the kernel arguments for a device volume, see kernels/volume_access.cl"""
+        if self.use_buffer:
+            Nx, Ny, Nz = self._volume_shape(img)
+            dtypeCode = {"half": 3, "quantized": 4}.get(self._storage_mode(),
+                                                        {np.float32: 0, np.uint16: 1, np.uint8: 2}[self.dtype])
+            return (img.data, np.int32(Nx), np.int32(Ny), np.int32(Nz), np.int32(dtypeCode))
+        else:
+            return (img,)
+
+    def set_cache_size(self, max_bytes=None):
+        """the device memory (in bytes) for volumes that are kept for update_data(data, cacheKey),
+        that is shared by all renderers on the device (default: timepoint_cache_mb from the
+        config, -1 = half of the device memory minus twice the largest volume that is uploaded at once)"""
+        if max_bytes is None:
+            max_bytes = self._default_cache_size()
+        self.volumeCache.set_max_bytes(max_bytes)
+
+    def _default_cache_size(self):
+        max_bytes = 2**20*spimagine.config.__TIMEPOINT_CACHE_MB__
+        if max_bytes<0:
+            max_bytes = .5*get_device().get_info("GLOBAL_MEM_SIZE")-2*self.memMax
+        return max_bytes
+
+    def clear_volume_cache(self):
+        """drops all cached volumes (e.g. if the data source changed)"""
+        self.volumeCache.clear()
+
+    def _volumes(self):
+        """all device volumes of the current data"""
+        vols = list(getattr(self, "_levelImgs", {}).values())
+        vols += [img for img, _ in (getattr(self, "_slabImgs", None) or {}).values()]
+        return vols+[getattr(self, "dataImg", None), self._backImg]
+
+    def _release_volume(self, img):
+        """returns the device volume img to the memory pool, unless it is still used"""
+        if img is None or any(v is img for v in self._volumes()) or self.volumeCache.owns(img):
+            return
+        self.pool.release(img)
+
+    def update_data(self, data, copyData=False, cacheKey=None):
+        """
+        if cacheKey is given (e.g. (data model, timepoint)), the uploaded volume is kept on
+        the device and a later call with the same cacheKey (and shape and dtype) does not upload
+        it again, only single volumes (no pyramids, slabs or multi channel data) are cached
+        """
+        oldVolumes = self._volumes()
+        self._rawState = None
+        self._update_data(data, copyData=copyData, cacheKey=cacheKey)
+        # the volumes of the previous data are reused by the next upload of the same shape
+        for img in oldVolumes:
+            self._release_volume(img)
+
+    def _update_data(self, data, copyData=False, cacheKey=None):
         # do we really want to copy here?
 
-        if self.dataSlices is not None:
-            self._data = data[self.dataSlices].copy()
+        if copyData:
+            self._data = data.copy()
         else:
-            if copyData:
-                self._data = data.copy()
+            self._data = data
+
+        # half storage is only used if the values fit (see _storage_mode)
+        self._sourceRange = (self._source_range(self._data)
+                             if self.storage=="half" and self._data.ndim==3 else None)
+
+        # data of another type is converted while uploading
+        cacheKey = self._cache_key(cacheKey, self._data)
+
+        if self._swap_cached(cacheKey):
+            return
+
+        if self._swap_prefetched(data):
+            self._cache_volume(cacheKey)
+            return
+
+        # the device images of the already uploaded levels
+        self._levelImgs = {}
+        self._release_slabs()
+        self._reset_gradient()
+        self._occKey = None
+        self._isoKey = None
+
+        if self._data.ndim==4:
+            # multi channel data (C,Nz,Ny,Nx), that is always uploaded completely
+            if not 2<=len(self._data)<=4:
+                raise ValueError("only 2-4 channels are supported (data shape %s)"%str(self._data.shape))
+            if len(self._data)!=self.nChannels:
+                self._reset_channels(self._data)
+            self.nChannels = len(self._data)
+            self.dataShape = self._data.shape[1:][::-1]
+            self.pyramid = None
+            self.level = 0
+            self.dataImg = self._channel_volume(self._host_converted(self._data))
+            self._levelImgs[0] = self.dataImg
+            self.brickBuf = self._compute_bricks(self.dataImg, getattr(self, "brickBuf", None), brick_size=0)
+            return
+
+        self.nChannels = 1
+        self.dataShape = self._data.shape[::-1]
+
+        if self.out_of_core and self._device_nbytes(self._data)>self.memMax:
+            self.pyramid = None
+            self.level = 0
+            self._setup_slabs()
+            return
+
+        if self._device_nbytes(self._data)>self.memMax:
+            # (the coarser levels are only computed when they are used)
+            self.pyramid = VolumePyramid(self._data, stackUnits=self.stackUnits)
+        else:
+            self.pyramid = None
+
+        if self.pyramid is None:
+            self.set_level(0)
+            self._cache_volume(cacheKey)
+        elif self.defer_level_upload:
+            self.set_level(self._preview_level())
+        else:
+            self.set_level(self._target_level())
+
+    def _cache_key(self, cacheKey, data):
+        """the key of data in the volume cache (or None if cacheKey is None)"""
+        if cacheKey is None:
+            return None
+        return (cacheKey, data.shape, data.dtype.str, self.dtype, self._valueScale,
+                self._storage_mode(), self.use_buffer)
+
+    def _is_cacheable(self, data):
+        """whether data is uploaded as a single volume"""
+        return data.ndim==3 and self._device_nbytes(data)<=self.memMax
+
+    def _cache_volume(self, cacheKey):
+        if cacheKey is not None and self._is_cacheable(self._data):
+            self.volumeCache.put(cacheKey, self.dataImg, self._device_nbytes(self._data))
+
+    def _swap_cached(self, cacheKey):
+        """makes the cached volume the current one, returns False if there is none"""
+        if cacheKey is None or not self._is_cacheable(self._data):
+            return False
+
+        img = self.volumeCache.get(cacheKey)
+        if img is None:
+            return False
+
+        self.nChannels = 1
+        self.dataShape = self._data.shape[::-1]
+        self.pyramid = None
+        self.level = 0
+        self.dataImg = img
+        self._release_slabs()
+        self._levelImgs = {0: img}
+        self._reset_gradient()
+        self._occKey = None
+        self._isoKey = None
+        self._update_bricks()
+        return True
+
+    def _can_swap(self, data):
+        """whether data can replace the current volume by swapping the device volumes,
+        i.e. it is a single volume of the same shape and type that has no pyramid or slabs"""
+        return (hasattr(self, "dataImg") and data.ndim==3 and self.nChannels==1
+                and self._volume_shape(self.dataImg)==data.shape[::-1] and data.dtype==self.dtype
+                and self._valueScale==(1., 0.) and self._storage_mode()=="native"
+                and self.pyramid is None and self._slabs is None)
+
+    def _volume_format(self, data):
+        return (data.shape, self.dtype, self.use_buffer)
+
+    def prefetch_data(self, data, cacheKey=None):
+        """starts uploading data (e.g. the next time point) into a second device volume
+
+        the upload runs on its own queue while the current volume is rendered, if
+        update_data/set_data is called with the same data afterwards both volumes are
+        simply swapped. Only data that can be swapped (see _can_swap) and is not
+        cached already (for the same cacheKey as in update_data) is prefetched,
+        returns True if the upload was started
+        """
+        if not self._can_swap(data):
+            return False
+
+        if cacheKey is not None and self._cache_key(cacheKey, data) in self.volumeCache:
+            return False
+
+        arr = np.ascontiguousarray(data)
+
+        if self._backFormat!=self._volume_format(arr):
+            if self._prefetched is not None:
+                # the pending upload still writes into the old back volume
+                self._prefetched[3].wait()
+            oldImg, self._backImg = self._backImg, None
+            self._release_volume(oldImg)
+            self._backImg, self._backFormat = self._empty_volume(arr.shape), self._volume_format(arr)
+
+        if self._uploadQueue is None:
+            self._uploadQueue = cl.CommandQueue(get_device().context, get_device().device)
+
+        # the back volume might still be read by kernels that were enqueued before the last swap
+        waitFor = [cl.enqueue_marker(get_device().queue)]
+
+        if self.use_buffer:
+            event = cl.enqueue_copy(self._uploadQueue, self._backImg.data, arr,
+                                    is_blocking=False, wait_for=waitFor)
+        else:
+            event = cl.enqueue_copy(self._uploadQueue, self._backImg, arr,
+                                    origin=(0, 0, 0), region=self._backImg.shape,
+                                    is_blocking=False, wait_for=waitFor)
+
+        # data (whose memory is the key) and arr have to be kept alive until the swap
+        self._prefetched = (_array_key(data), data, arr, event)
+        return True
+
+    def _swap_prefetched(self, data):
+        """makes the prefetched volume the current one if it holds data"""
+        if self._prefetched is None:
+            return False
+
+        key, _, _, event = self._prefetched
+        self._prefetched = None
+        event.wait()
+
+        if key!=_array_key(data) or not self._can_swap(data) or self._backFormat!=self._volume_format(data):
+            return False
+
+        self.dataImg, self._backImg = self._backImg, self.dataImg
+        if self.volumeCache.owns(self._backImg):
+            # the next upload must not overwrite a cached volume
+            self._backImg, self._backFormat = None, None
+        self._release_slabs()
+        self._levelImgs = {0: self.dataImg}
+        self._reset_gradient()
+        self._occKey = None
+        self._isoKey = None
+        self._update_bricks()
+        return True
+
+    def set_out_of_core(self, out_of_core=True):
+        """if True, volumes bigger than memMax are split into slabs along z that are
+        rendered one after another at full resolution (instead of using a coarser
+        pyramid level)"""
+        self.out_of_core = out_of_core
+        if hasattr(self, "_data"):
+            self.update_data(self._data)
+
+    def _setup_slabs(self):
+        """splits the volume along z into slabs that each fit into memMax"""
+        self._release_slabs()
+        Nz = self._data.shape[0]
+        # one extra slice on each side is needed for the interpolation at the slab borders
+        nz = max(1, int(self.memMax//self._device_nbytes(self._data[0]))-2)
+        self._slabs = [(z0, min(z0+nz, Nz)) for z0 in range(0, Nz, nz)]
+
+        # if all slabs fit on the device they are uploaded only once, else they are streamed
+        total = sum(self._device_nbytes(self._data[slice(*self._slab_range(i))])
+                    for i in range(len(self._slabs)))
+        self._slabs_resident = total<=.5*get_device().get_info("GLOBAL_MEM_SIZE")
+
+        logger.info("rendering in %s slabs of %s slices (%s)"%(len(self._slabs), nz,
+                    "resident" if self._slabs_resident else "streamed"))
+
+        # (the brick buffers of the slabs belong to them, see _render_slabs)
+        self.brickBuf = self._compute_bricks(None, getattr(self, "brickBuf", None), brick_size=0)
+
+        if self._slabs_resident:
+            self.dataImg = self._slab_image(0)[0]
+        else:
+            # streamed slabs are only uploaded when rendered, the shared image of
+            # the first slab's shape is allocated already
+            shape = self._data[slice(*self._slab_range(0))].shape
+            self.dataImg = self._empty_volume(shape)
+            self._slabImgs[shape] = (self.dataImg, self.brickBuf)
+
+    def _release_slabs(self):
+        """forgets the slabs of the previous volume and returns their images
+        (unless still used) and brick buffers to the memory pool"""
+        slabImgs = getattr(self, "_slabImgs", None) or {}
+        self._slabs = None
+        self._slabImgs = {}
+        for img, brickBuf in slabImgs.values():
+            self._release_volume(img)
+            self._release_bricks(brickBuf)
+
+    def _slab_range(self, i):
+        """the z range of the data that is uploaded for slab i"""
+        z0, z1 = self._slabs[i]
+        return max(z0-1, 0), min(z1+1, self._data.shape[0])
+
+    def _slab_image(self, i):
+        """returns the device image and brick buffer of slab i"""
+        if self._slabs_resident and i in self._slabImgs:
+            return self._slabImgs[i]
+
+        slabData = self._data[slice(*self._slab_range(i))]
+
+        if self._slabs_resident:
+            img, brickBuf = self._empty_volume(slabData.shape), None
+        else:
+            # streamed slabs of the same shape share their device image
+            img, brickBuf = self._slabImgs.get(slabData.shape, (None, None))
+            if img is None:
+                img = self._empty_volume(slabData.shape)
+
+        self._write_volume(img, slabData)
+        brickBuf = self._compute_bricks(img, brickBuf)
+
+        self._slabImgs[i if self._slabs_resident else slabData.shape] = (img, brickBuf)
+        return img, brickBuf
+
+    def _slab_mat(self, i):
+        """maps the model coordinates [-1,1]^3 of slab i onto its part of the full volume"""
+        a, b = self._slab_range(i)
+        Nz = self._data.shape[0]
+        return np.dot(mat4_translate(0, 0, 1.*(a+b)/Nz-1.), mat4_scale(1, 1, 1.*(b-a)/Nz))
+
+    def _slab_box(self, i, boxBounds=None):
+        """the box boundaries of slab i in its own model coordinates
+        (or None if the slab lies outside of boxBounds, default: the current box)"""
+        if boxBounds is None:
+            boxBounds = self.boxBounds
+        z0, z1 = self._slabs[i]
+        a, b = self._slab_range(i)
+        Nz = self._data.shape[0]
+
+        zmin = max(2.*z0/Nz-1., boxBounds[4])
+        zmax = min(2.*z1/Nz-1., boxBounds[5])
+        if zmin>=zmax:
+            return None
+
+        c, h = 1.*(a+b)/Nz-1., 1.*(b-a)/Nz
+        return np.concatenate([boxBounds[:4], [(zmin-c)/h, (zmax-c)/h]])
+
+    def _render_slabs(self, method):
+        """renders all slabs one after another and composites them into
+        buf, buf_alpha (and buf_depth, buf_normals for iso_surface, or
+        buf_rgb instead of buf for emission_absorption)
+
+        slabs are processed with increasing z, so every slab lies completely in front
+        of or behind the already composited ones
+        """
+        if self._acc is None or self._acc[0].shape!=self.buf.shape:
+            self.pool.release(*(self._acc or []))
+            self._acc = [self.pool.array(b.shape, np.float32) for b in (self.buf, self.buf_alpha, self.buf_tmp,
+                                                                        self.buf_depth, self.buf_normals)]
+        acc_output, acc_alpha, acc_trans, acc_depth, acc_normals = self._acc
+        # (emission_absorption composites its rgb into acc_normals, which has the same shape)
+
+        boxBounds, dataImg, brickBuf = self.boxBounds, self.dataImg, self.brickBuf
+        M = np.dot(self.modelView, self._stack_scale_mat())
+        Nz = self._data.shape[0]
+        isFirst = True
+
+        for i in range(len(self._slabs)):
+            # (self.boxBounds is the box of the previous slab here)
+            slabBox = self._slab_box(i, boxBounds)
+            if slabBox is None:
+                continue
+
+            self.dataImg, self.brickBuf = self._slab_image(i)
+            self.boxBounds = slabBox
+            self._write_matrices(np.dot(M, self._slab_mat(i)))
+
+            if method=="max_project":
+                if self.alphaPow>0 and self.sampling_rate<=0:
+                    # the attenuation depends on the step size, so keep the sampling
+                    # density of the full volume (the sampling rate does already)
+                    z0, z1 = self._slabs[i]
+                    self._run_max_project(self.dtype, steps=1.*(z1-z0)/Nz)
+                else:
+                    self._run_max_project(self.dtype)
+                if self.alphaPow>0:
+                    self.proc.run_kernel("composite_alpha", (self.width, self.height), None,
+                                         acc_output.data, acc_alpha.data, acc_trans.data,
+                                         self.buf.data, self.buf_alpha.data, self.buf_tmp.data,
+                                         np.float32(self.gamma), np.int32(isFirst),
+                                         self.invPBuf.data, self.invMBuf.data)
+                else:
+                    self.proc.run_kernel("composite_max", (self.width, self.height), None,
+                                         acc_output.data, acc_alpha.data,
+                                         self.buf.data, self.buf_alpha.data,
+                                         np.int32(isFirst))
+            elif method=="emission_absorption":
+                # the pre-integrated opacity does not depend on the step size, so the
+                # steps only keep the sampling density of the full volume
+                z0, z1 = self._slabs[i]
+                self._run_emission_absorption(steps=1.*(z1-z0)/Nz)
+                self.proc.run_kernel("composite_emission", (self.width, self.height), None,
+                                     acc_normals.data, acc_alpha.data,
+                                     self.buf_rgb.data, self.buf_alpha.data,
+                                     np.int32(isFirst),
+                                     self.invPBuf.data, self.invMBuf.data)
             else:
-                self._data = data
+                a, b = self._slab_range(i)
+                self._run_iso_surface()
+                self.proc.run_kernel("composite_iso", (self.width, self.height), None,
+                                     acc_output.data, acc_alpha.data,
+                                     acc_depth.data, acc_normals.data,
+                                     self.buf.data, self.buf_alpha.data,
+                                     self.buf_depth.data, self.buf_normals.data,
+                                     np.float32(1.*Nz/(b-a)), np.int32(isFirst))
+            isFirst = False
+
+        # (streamed slabs share their image, which keeps the last rendered slab)
+        self.boxBounds, self.dataImg, self.brickBuf = boxBounds, dataImg, brickBuf
+        self.update_matrices()
+
+        if isFirst:
+            # no slab inside the box
+            self.buf.write_array(np.zeros(self.buf.shape, np.float32))
+            self.buf_alpha.write_array(np.zeros(self.buf.shape, np.float32))
+            self.buf_depth.write_array(np.full(self.buf.shape, np.inf, np.float32))
+            self.buf_normals.write_array(np.zeros(self.buf_normals.shape, np.float32))
+            if method=="emission_absorption":
+                self._rgb_buffer().write_array(np.zeros(self.buf_normals.shape, np.float32))
+            return
+
+        if method=="emission_absorption":
+            self.buf_rgb, acc_normals = acc_normals, self.buf_rgb
+        else:
+            self.buf, acc_output = acc_output, self.buf
+        self.buf_alpha, acc_alpha = acc_alpha, self.buf_alpha
+        if method=="iso_surface":
+            self.buf_depth, acc_depth = acc_depth, self.buf_depth
+            self.buf_normals, acc_normals = acc_normals, self.buf_normals
+        self._acc = [acc_output, acc_alpha, acc_trans, acc_depth, acc_normals]
+
+    def n_levels(self):
+        return 1 if self.pyramid is None else len(self.pyramid)
+
+    def _level_data(self, level):
+        return self._data if self.pyramid is None else self.pyramid[level]
+
+    def _level_shape(self, level):
+        return self._data.shape if self.pyramid is None else self.pyramid.shape(level)
+
+    def set_level(self, level):
+        """renders from the given pyramid level (uploading it if necessary)"""
+        if not level in self._levelImgs:
+            levelData = self._level_data(level)
+            if level>0:
+                logger.info("using pyramid level %s with shape %s"%(level, levelData.shape))
+            self.set_shape(levelData.shape[::-1])
+            self._write_volume(self.dataImg, levelData)
+            self._levelImgs[level] = self.dataImg
+
+        self.dataImg = self._levelImgs[level]
+        self.level = level
+        self._update_bricks()
+
+    def _preview_level(self):
+        """the finest level that is small enough to be uploaded instantly"""
+        for level in range(self.n_levels()):
+            if np.prod(self._level_shape(level))<=128**3:
+                return level
+        return self.n_levels()-1
+
+    def _memory_level(self):
+        """the finest level that fits into device memory"""
+        for level in range(self.n_levels()):
+            if self._device_size_nbytes(np.prod(self._level_shape(level)))<=self.memMax:
+                return level
+        return self.n_levels()-1
+
+    def _view_level(self):
+        """the coarsest level that has still at least one voxel per rendered pixel"""
+        if self.n_levels()==1:
+            return 0
+
+        corners = np.array([[x, y, z, 1.] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+        M = np.dot(self.projection, np.dot(self.modelView, self._stack_scale_mat()))
+        proj = np.dot(corners, M.T)
+
+        # the camera is inside the volume
+        if np.any(proj[:, 3]<=0):
+            return 0
+
+        proj = proj[:, :2]/proj[:, 3:]
+        pixels = .5*max(self.width, self.height)*np.amax(np.ptp(proj, axis=0))
+
+        for level in range(self.n_levels())[::-1]:
+            if max(self._level_shape(level))>=pixels:
+                return level
+        return 0
+
+    def _target_level(self):
+        return max(self._memory_level(), self._view_level())
+
+    def select_level(self, allow_upload=True):
+        """switches to the pyramid level best suited for the current view
+
+        if allow_upload is False, only levels that are already on the device are used
+        returns True if the level changed
+        """
+        if self.n_levels()==1:
+            return False
 
-        if self._data.dtype!=self.dtype:
-            self._data = self._data.astype(self.dtype, copy=False)
+        level = self._target_level()
 
-        self.dataImg.write_array(self._data)
+        if not allow_upload and not level in self._levelImgs:
+            # the finest already uploaded level that is still coarser than needed
+            coarser = [l for l in self._levelImgs if l>=level]
+            level = min(coarser) if len(coarser)>0 else self.level
+
+        if level!=self.level:
+            self.set_level(level)
+            return True
+        else:
+            return False
 
     def set_box_boundaries(self, boxBounds=[-1, 1, -1, 1, -1, 1]):
         self.boxBounds = np.array(boxBounds)
 
     def set_units(self, stackUnits=np.ones(3)):
-        self.stackUnits = np.array(stackUnits)
+        stackUnits = np.array(stackUnits)
+        isChanged = not hasattr(self, "stackUnits") or not np.array_equal(stackUnits, self.stackUnits)
+        self.stackUnits = stackUnits
+
+        # the pyramid levels depend on the anisotropy
+        if isChanged and getattr(self, "pyramid", None) is not None:
+            self.update_data(self._data)
 
     def set_projection(self, projection=mat4_perspective()):
         self.projection = projection
@@ -310,14 +1387,24 @@ class VolumeRenderer:
     def update_matrices(self):
         if hasattr(self, "dataImg"):
             mScale = self._stack_scale_mat()
-            invM = inv(np.dot(self.modelView, mScale))
-            self.invMBuf.write_array(invM.flatten().astype(np.float32))
-            invP = inv(self.projection)
-            self.invPBuf.write_array(invP.flatten().astype(np.float32))
+            self._write_matrices(np.dot(self.modelView, mScale))
+
+    def _write_matrices(self, M):
+        invM = inv(M)
+        self.invMBuf.write_array(invM.flatten().astype(np.float32))
+        invP = inv(self.projection)
+        self.invPBuf.write_array(invP.flatten().astype(np.float32))
+
+    def _global_size(self):
+        """the global size of the per pixel kernels, (Nx,Ny,nViews) for batches of views"""
+        if self._nViews>1:
+            return (self.width, self.height, self._nViews)
+        else:
+            return (self.width, self.height)
 
     def _stack_scale_mat(self):
         # scaling the data according to size and units
-        Nx, Ny, Nz = self.dataImg.shape
+        Nx, Ny, Nz = self.dataShape
         dx, dy, dz = self.stackUnits
 
         # mScale =  scaleMat(1.,1.*dx*Nx/dy/Ny,1.*dx*Nx/dz/Nz)
@@ -325,6 +1412,70 @@ class VolumeRenderer:
         return mat4_scale(1.*dx*Nx/maxDim, 1.*dy*Ny/maxDim, 1.*dz*Nz/maxDim)
 
     def _render_max_project(self, dtype=np.float32, numParts=1, currentPart=0):
+        if self._slabs is not None:
+            # slabs are always rendered completely
+            self._render_slabs("max_project")
+            self._rawState = None
+        elif self._inBatch:
+            # buf_raw is the batch buffer and the views are not the ones of _raw_key
+            self._run_max_project(dtype, numParts, currentPart)
+        elif self._can_remap(numParts, currentPart):
+            self._remap_max_project()
+        else:
+            self._run_max_project(dtype, numParts, currentPart)
+            self._update_raw_state(numParts, currentPart)
+
+        self._set_result(output=self.buf,
+                         output_alpha=self.buf_alpha,
+                         output_depth=self.buf_depth)
+
+    def _raw_key(self, numParts):
+        """everything but minVal, maxVal and gamma the raw maxima in buf_raw depend on"""
+        return (id(self.proc), self.dtype, self.alphaPow, self.max_steps, self.sampling_rate,
+                self.brick_size, numParts, self.width, self.height, tuple(self.boxBounds),
+                np.asarray(self.modelView).tobytes(), np.asarray(self.projection).tobytes(),
+                tuple(self.stackUnits), tuple(self.dataShape))
+
+    def _empty_val(self, minVal, maxVal):
+        """the value up to which the max_project kernels skip bricks (as in the kernels)"""
+        if maxVal==0:
+            return 0.
+        return minVal if maxVal>minVal else -np.inf
+
+    def _update_raw_state(self, numParts, currentPart):
+        emptyVal = self._empty_val(self.minVal, self.maxVal)
+        key = self._raw_key(numParts)
+
+        if currentPart==0 or self._rawState is None or self._rawState[0]!=key:
+            # (the volume is kept, so its id cannot be reused by another one)
+            self._rawState = (key, self.dataImg, set(), emptyVal)
+
+        # bricks not above emptyVal were skipped, so the maxima are only
+        # exact for values above the largest emptyVal of all parts
+        key, img, parts, rawEmptyVal = self._rawState
+        parts.add(currentPart)
+        self._rawState = (key, img, parts, max(rawEmptyVal, emptyVal))
+
+    def _can_remap(self, numParts, currentPart):
+        """whether buf_raw holds the part currentPart of the current view, so
+        max_project only has to apply minVal, maxVal and gamma"""
+        if self._rawState is None or self.alphaPow!=0:
+            return False
+
+        key, img, parts, rawEmptyVal = self._rawState
+        return (img is self.dataImg and key==self._raw_key(numParts) and currentPart in parts
+                and (self.brick_size==0 or self._empty_val(self.minVal, self.maxVal)>=rawEmptyVal))
+
+    def _remap_max_project(self):
+        self.proc.run_kernel("max_project_remap", self._global_size(), None,
+                             self.buf.data, self.buf_raw.data,
+                             np.float32(self.minVal),
+                             np.float32(self.maxVal),
+                             np.float32(self.gamma))
+
+    def _run_max_project(self, dtype=np.float32, numParts=1, currentPart=0, jitter=-1., steps=1.):
+        """jitter >= 0 shifts the (per pixel jittered) ray starts by that fraction of a step,
+        steps scales the number of steps (i.e. max_steps and sampling_rate)"""
         if dtype in [np.uint16, np.uint8]:
             method = "max_project_short"
         elif dtype==np.float32:
@@ -364,126 +1515,166 @@ class VolumeRenderer:
 
 
         self.proc.run_kernel(method,
-                             (self.width, self.height),
+                             self._global_size(),
                              None,
-                             self.buf.data, self.buf_alpha.data,
-                             self.buf_depth.data,
-                             np.int32(self.width), np.int32(self.height),
-                             np.float32(self.boxBounds[0]),
-                             np.float32(self.boxBounds[1]),
-                             np.float32(self.boxBounds[2]),
-                             np.float32(self.boxBounds[3]),
-                             np.float32(self.boxBounds[4]),
-                             np.float32(self.boxBounds[5]),
-                             np.float32(self.minVal),
-                             np.float32(self.maxVal),
-                             np.float32(self.gamma),
-                             np.float32(self.alphaPow),
-                             np.int32(numParts),
-                               np.int32(currentPart),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg)
+                             *((self.buf.data, self.buf_alpha.data,
+                                self.buf_depth.data, self.buf_tmp.data, self.buf_raw.data,
+                                np.int32(self.width), np.int32(self.height),
+                                np.float32(self.boxBounds[0]),
+                                np.float32(self.boxBounds[1]),
+                                np.float32(self.boxBounds[2]),
+                                np.float32(self.boxBounds[3]),
+                                np.float32(self.boxBounds[4]),
+                                np.float32(self.boxBounds[5]),
+                                np.float32(self.minVal),
+                                np.float32(self.maxVal),
+                                np.float32(self.gamma),
+                                np.float32(self.alphaPow),
+                                np.int32(max(2, int(steps*self.max_steps))),
+                                np.float32(steps*self.sampling_rate),
+                                np.int32(numParts),
+                                np.int32(currentPart),
+                                np.float32(jitter),
+                                self.invPBuf.data,
+                                self.invMBuf.data)
+                               +self._volume_args(self.dataImg)
+                               +(self.brickBuf.data,
+                                 np.int32(self.brick_size))))
+
+    def _rgb_buffer(self):
+        if self.buf_rgb is None:
+            self.buf_rgb = self.pool.array((self.height, self.width, 3), dtype=np.float32)
+        return self.buf_rgb
+
+    def _channel_params(self):
+        """the device buffer of the channel min/max/gamma/colors, only written if they changed"""
+        params = np.concatenate([self.channelMin, self.channelMax, self.channelGamma,
+                                 self.channelColors.flatten()]).astype(np.float32)
+
+        if self._channelParams is not None and np.array_equal(params, self._channelParams):
+            return self.channelParamsBuf
+
+        if self.channelParamsBuf is None or self.channelParamsBuf.shape != params.shape:
+            self.pool.release(self.channelParamsBuf)
+            self.channelParamsBuf = self.pool.array(params.shape, np.float32)
+        self.channelParamsBuf.write_array(params)
+        self._channelParams = params
+        return self.channelParamsBuf
+
+    def _render_channels(self):
+        """max projection of all channels of multi channel data into an rgb image"""
+        self.proc.run_kernel("max_project_channels",
+                             self._global_size(),
+                             None,
+                             *((self._rgb_buffer().data, self.buf_alpha.data,
+                                np.int32(self.width), np.int32(self.height),
+                                np.float32(self.boxBounds[0]),
+                                np.float32(self.boxBounds[1]),
+                                np.float32(self.boxBounds[2]),
+                                np.float32(self.boxBounds[3]),
+                                np.float32(self.boxBounds[4]),
+                                np.float32(self.boxBounds[5]),
+                                np.float32(self.alphaPow),
+                                np.int32(self.max_steps),
+                                np.int32(self.nChannels),
+                                self._channel_params().data,
+                                self.invPBuf.data,
+                                self.invMBuf.data)
+                               +self._volume_args(self.dataImg)
+                               +(np.int32(self.dtype in [np.uint16, np.uint8]),)))
+
+        self._set_result(output=self.buf_rgb, output_alpha=self.buf_alpha)
+
+    def _render_emission_absorption(self):
+        """front to back compositing with the pre-integrated transfer function"""
+        if self._slabs is not None:
+            self._render_slabs("emission_absorption")
+        else:
+            self._run_emission_absorption()
 
-        self.output = self.buf.get()
-        self.output_alpha = self.buf_alpha.get()
-        self.output_depth = self.buf_depth.get()
+        self._set_result(output=self.buf_rgb, output_alpha=self.buf_alpha)
 
-    def _convolve_scalar(self, buf, radius=11):
+    def _run_emission_absorption(self, steps=1.):
+        """steps scales the number of steps"""
+        self.proc.run_kernel("emission_absorption",
+                             self._global_size(),
+                             None,
+                             *((self._rgb_buffer().data, self.buf_alpha.data,
+                                np.int32(self.width), np.int32(self.height),
+                                np.float32(self.boxBounds[0]),
+                                np.float32(self.boxBounds[1]),
+                                np.float32(self.boxBounds[2]),
+                                np.float32(self.boxBounds[3]),
+                                np.float32(self.boxBounds[4]),
+                                np.float32(self.boxBounds[5]),
+                                np.float32(self.minVal),
+                                np.float32(self.maxVal),
+                                np.float32(self.minVal+self._tfEmpty*(self.maxVal-self.minVal)),
+                                np.int32(max(2, int(steps*self.max_steps))),
+                                self._tfTable.data,
+                                np.int32(self._tfTable.shape[0]),
+                                self.invPBuf.data,
+                                self.invMBuf.data)
+                               +self._volume_args(self.dataImg)
+                               +(np.int32(self.dtype in [np.uint16, np.uint8]),
+                                 self.brickBuf.data,
+                                 np.int32(self.brick_size))))
+
+    def _convolve_scalar(self, buf, radius=11, size=None):
+        """blurs buf of size (Nx,Ny) (default: the render size) with a window of radius pixels"""
+        Nx, Ny = size or (self.width, self.height)
+        tile = VolumeRenderer.conv_tile
+        globalSize = (tile*int(np.ceil(1.*Nx/tile)), tile*int(np.ceil(1.*Ny/tile)))
+        localSize = (tile, tile)
+        if self._nViews>1:
+            globalSize, localSize = globalSize+(self._nViews,), localSize+(1,)
 
         self.proc.run_kernel("conv_x",
-                             (self.width, self.height), None,
+                             globalSize, localSize,
                              buf.data,
                              self.buf_tmp.data,
+                             np.int32(Nx), np.int32(Ny),
                              np.int32(radius))
         self.proc.run_kernel("conv_y",
-                             (self.width, self.height), None,
+                             globalSize, localSize,
                              self.buf_tmp.data,
                              buf.data,
+                             np.int32(Nx), np.int32(Ny),
                              np.int32(radius))
 
     def _convolve_vec(self, buf, radius=11):
         self.proc.run_kernel("conv_vec_x",
-                             (self.width, self.height), None,
+                             self._global_size(), None,
                              buf.data,
                              self.buf_tmp_vec.data,
                              np.int32(radius))
 
         self.proc.run_kernel("conv_vec_y",
-                             (self.width, self.height), None,
+                             self._global_size(), None,
                              self.buf_tmp_vec.data,
                              buf.data,
                              np.int32(radius))
 
-    def _render_isosurface2(self):
-        self.proc.run_kernel("iso_surface",
-                             (self.width, self.height),
-                             None,
-                             self.buf.data, self.buf_alpha.data,
-                             self.buf_depth.data, self.buf_normals.data,
-                             np.int32(self.width), np.int32(self.height),
-                             np.float32(self.boxBounds[0]),
-                             np.float32(self.boxBounds[1]),
-                             np.float32(self.boxBounds[2]),
-                             np.float32(self.boxBounds[3]),
-                             np.float32(self.boxBounds[4]),
-                             np.float32(self.boxBounds[5]),
-                             np.float32(self.maxVal/2),
-                             np.float32(self.gamma),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg,
-                             np.int32(self.dtype in [np.uint16, np.uint8])
-                             )
-
-        self._convolve_vec(self.buf_normals, 5)
-
-        self.output = self.buf.get()
-        self.output_alpha = self.buf_alpha.get()
-        self.output_depth = self.buf_depth.get()
-        self.output_normals = self.buf_normals.get()
-
     def _render_isosurface(self):
         """
         with ambient occlusion
         """
+        if self._slabs is not None:
+            self._render_slabs("iso_surface")
+        else:
+            self._run_iso_surface()
 
-        self.proc.run_kernel("iso_surface",
-                             (self.width, self.height),
-                             None,
-                             self.buf.data, self.buf_alpha.data,
-                             self.buf_depth.data, self.buf_normals.data,
-                             np.int32(self.width), np.int32(self.height),
-                             np.float32(self.boxBounds[0]),
-                             np.float32(self.boxBounds[1]),
-                             np.float32(self.boxBounds[2]),
-                             np.float32(self.boxBounds[3]),
-                             np.float32(self.boxBounds[4]),
-                             np.float32(self.boxBounds[5]),
-                             np.float32(self.maxVal/2),
-                             np.float32(self.gamma),
-                             self.invPBuf.data,
-                             self.invMBuf.data,
-                             self.dataImg,
-                             np.int32(self.dtype in [np.uint16, np.uint8])
-                             )
-        self._convolve_vec(self.buf_normals, 7)
-        #
-        self.proc.run_kernel("occlusion",
-                             (self.width, self.height),
-                             None,
-                             self.buf_occlusion.data,
-                             np.int32(self.width), np.int32(self.height),
-                             np.int32(self.occ_radius),
-                             np.int32(self.occ_n_points),
-                             self.buf_depth.data,
-                             self.buf_normals.data,
-                             )
+        if not self._inBatch:
+            self._isoKey = self._occ_key()
 
-        self._convolve_scalar(self.buf_occlusion, 5)
+        self._shade_isosurface()
+
+    def _shade_isosurface(self):
+        """shades the iso surface in buf_depth/buf_normals with the (accumulated) occlusion"""
+        occlusion = self._render_occlusion()
 
         self.proc.run_kernel("shading",
-                             (self.width, self.height),
+                             self._global_size(),
                              None,
                              self.buf.data, self.buf_alpha.data,
                              np.int32(self.width), np.int32(self.height),
@@ -492,18 +1683,112 @@ class VolumeRenderer:
                              np.float32(self.occ_strength),
                              self.buf_normals.data,
                              self.buf_depth.data,
-                             self.buf_occlusion.data,
+                             occlusion.data,
 
                              )
 
         # self._convolve_scalar(self.buf,13)
         # self._convolve_vec(self.buf_normals,101)
 
-        self.output = self.buf.get()
-        self.output_alpha = self.buf_alpha.get()
-        self.output_depth = self.buf_depth.get()
-        self.output_normals = self.buf_normals.get()
-        self.output_occlusion = self.buf_occlusion.get()
+        self._set_result(output=self.buf,
+                         output_alpha=self.buf_alpha,
+                         output_depth=self.buf_depth,
+                         output_normals=self.buf_normals,
+                         output_occlusion=occlusion)
+
+    def _occ_key(self):
+        """everything the occlusion of a frame depends on"""
+        return (self.modelView.tobytes(), self.projection.tobytes(), tuple(self.stackUnits),
+                tuple(self.boxBounds), self.maxVal, self.max_steps, self.level,
+                self.width, self.height, self.occ_radius, self.occ_n_points, self.occ_half_res)
+
+    def _render_occlusion(self):
+        """computes the ambient occlusion of buf_depth, returns the buffer that holds it"""
+        # the number of frames already accumulated for the current view
+        nFrames = 0
+        if self.occ_accumulate>1 and not self._inBatch:
+            key = self._occ_key()
+            if key==self._occKey:
+                nFrames = self._occFrames
+                if nFrames>=self.occ_accumulate:
+                    return self.buf_occlusion_acc
+            self._occKey, self._occFrames = key, nFrames+1
+
+        Nx, Ny = self.width, self.height
+        if self.occ_half_res:
+            occlusion, size, scale = self.buf_occlusion_low, ((Nx+1)//2, (Ny+1)//2), 2
+        else:
+            occlusion, size, scale = self.buf_occlusion, (Nx, Ny), 1
+
+        globalSize = size+((self._nViews,) if self._nViews>1 else ())
+
+        self.proc.run_kernel("occlusion",
+                             globalSize,
+                             None,
+                             occlusion.data,
+                             np.int32(size[0]), np.int32(size[1]),
+                             np.int32(self.occ_radius),
+                             np.int32(self.occ_n_points),
+                             self.buf_depth.data,
+                             np.int32(Nx), np.int32(Ny),
+                             np.int32(scale),
+                             self.occOffsetBuf.data,
+                             np.int32(self._tileOffset[0]),
+                             np.int32(self._tileOffset[1]),
+                             np.int32(nFrames)
+                             )
+
+        self._convolve_scalar(occlusion, 5, size)
+
+        if self.occ_half_res:
+            self.proc.run_kernel("occlusion_upsample",
+                                 self._global_size(),
+                                 None,
+                                 self.buf_occlusion.data,
+                                 np.int32(Nx), np.int32(Ny),
+                                 self.buf_occlusion_low.data,
+                                 np.int32(size[0]), np.int32(size[1]),
+                                 self.buf_depth.data)
+
+        if self.occ_accumulate<=1 or self._inBatch:
+            return self.buf_occlusion
+
+        if self.buf_occlusion_acc is None:
+            self.buf_occlusion_acc = self.pool.zeros((self.height, self.width), dtype=np.float32)
+
+        self.proc.run_kernel("occlusion_accumulate",
+                             self._global_size(),
+                             None,
+                             self.buf_occlusion_acc.data,
+                             self.buf_occlusion.data,
+                             np.float32(1./(nFrames+1)))
+        return self.buf_occlusion_acc
+
+    def _run_iso_surface(self):
+        gradBuf = self._gradient_buffer()
+        self.proc.run_kernel("iso_surface",
+                             self._global_size(),
+                             None,
+                             *((self.buf.data, self.buf_alpha.data,
+                                self.buf_depth.data, self.buf_normals.data,
+                                np.int32(self.width), np.int32(self.height),
+                                np.float32(self.boxBounds[0]),
+                                np.float32(self.boxBounds[1]),
+                                np.float32(self.boxBounds[2]),
+                                np.float32(self.boxBounds[3]),
+                                np.float32(self.boxBounds[4]),
+                                np.float32(self.boxBounds[5]),
+                                np.float32(self.maxVal/2),
+                                np.float32(self.gamma),
+                                np.int32(self.max_steps),
+                                self.invPBuf.data,
+                                self.invMBuf.data)
+                               +self._volume_args(self.dataImg)
+                               +(np.int32(self.dtype in [np.uint16, np.uint8]),
+                                 self.brickBuf.data,
+                                 np.int32(self.brick_size),
+                                 (self._gradientDummy if gradBuf is None else gradBuf).data,
+                                 np.int32(gradBuf is not None))))
 
     def render(self, data=None, stackUnits=None,
                minVal=None, maxVal=None, gamma=None,
@@ -536,13 +1821,309 @@ class VolumeRenderer:
             print("no data provided, set_data(data) before")
             return
 
+        self.select_level(allow_upload=not self.defer_level_upload)
+
         if modelView is None and not hasattr(self, 'modelView'):
             print("no modelView provided and set_modelView() not called before!")
             return
 
-        if method=="max_project":
+        self._render_method(method, numParts, currentPart)
+
+        return self.result
+
+    def refine(self, method="max_project", numParts=1, currentPart=0):
+        """renders the part currentPart of a render with numParts parts (as render does)
+        and returns the largest change of buf (i.e. the output) this part caused
+
+        the parts of a max projection sample the rays interleaved and are
+        accumulated on the device, so a small change means the image has converged
+
+        the result is not copied to the host, so several parts can be rendered
+        before the output is fetched once (e.g. from the renderer's result)
+        """
+        if not hasattr(self, 'dataImg'):
+            raise ValueError("no data provided, set_data(data) before")
+
+        prev = self.pool.array(self.buf.shape, np.float32)
+        cl.enqueue_copy(self.buf.queue, prev.data, self.buf.data)
+
+        self.select_level(allow_upload=not self.defer_level_upload)
+        if method=="iso_surface" and self.nChannels==1 and self._isoKey==self._occ_key():
+            # the surface is unchanged, so a pass only adds occlusion samples
+            self._shade_isosurface()
+        else:
+            self._render_method(method, numParts, currentPart)
+
+        change = self._max_change(prev)
+        self.pool.release(prev)
+        return change
+
+    def _max_change(self, prev):
+        """the largest absolute difference of buf and prev (reduced on the device)"""
+        partMax = self.pool.array((_MAX_DIFF_GROUPS,), np.float32)
+        self.proc.run_kernel("max_abs_diff", (_MAX_DIFF_GROUP*_MAX_DIFF_GROUPS,), (_MAX_DIFF_GROUP,),
+                             self.buf.data, prev.data, partMax.data, np.int32(self.buf.size))
+        change = float(np.amax(partMax.get()))
+        self.pool.release(partMax)
+        return change
+
+    def can_accumulate(self, method="max_project"):
+        """whether accumulate renders jittered frames of method (see accumulate)"""
+        return (method=="max_project" and self.alphaPow==0 and self.nChannels==1
+                and getattr(self, "_slabs", None) is None)
+
+    def accumulate(self, method="max_project", frame=0, steps=1.):
+        """renders the frame-th frame of a temporally accumulated max projection and
+        returns the largest change of the output (inf for frame 0)
+
+        every frame samples the rays with steps*max_steps steps (or steps*sampling_rate),
+        starting at per pixel and per frame jittered offsets, and the frames 0..frame
+        are accumulated on the device (by their maximum, as the mean of maxima would
+        stay below the maximum), so that while the view does not change a few steps per
+        frame converge to the image of many steps (with noise instead of banding
+        in the first frames)
+
+        output_depth is the depth of the accumulated maximum, output_alpha does not
+        depend on the frame
+
+        only max projections with alpha_pow == 0 are accumulated, as the attenuation
+        of the others depends on the step length, other methods, alpha_pow > 0,
+        multi channel data and out of core volumes are rendered as by render
+        """
+        if not hasattr(self, 'dataImg'):
+            raise ValueError("no data provided, set_data(data) before")
+
+        self.select_level(allow_upload=not self.defer_level_upload)
+
+        if not self.can_accumulate(method):
+            self._render_method(method)
+            return 0.
+
+        self._isoKey = None
+        self._run_max_project(self.dtype, jitter=_golden_offset(frame), steps=steps)
+        # buf_raw now holds a single frame
+        self._rawState = None
+
+        if self.buf_accum is None:
+            # the accumulated output, raw maximum and its depth
+            self.buf_accum = self.pool.array((3,)+self.buf.shape, np.float32)
+
+        prev = None
+        if frame>0:
+            prev = self.pool.array(self.buf.shape, np.float32)
+            cl.enqueue_copy(self.buf.queue, prev.data, self.buf_accum.data, byte_count=prev.nbytes)
+
+        self.proc.run_kernel("accumulate_max", self._global_size(), None,
+                             self.buf_accum.data, self.buf.data, self.buf_raw.data,
+                             self.buf_depth.data, np.int32(frame))
+
+        self._set_result(output=self.buf,
+                         output_alpha=self.buf_alpha,
+                         output_depth=self.buf_depth)
+
+        if prev is None:
+            return np.inf
+
+        change = self._max_change(prev)
+        self.pool.release(prev)
+        return change
+
+    def _render_method(self, method, numParts=1, currentPart=0):
+        if not method in self.methods:
+            raise ValueError("unknown method: %s (valid: %s)"%(method, self.methods))
+
+        # the other methods overwrite the iso surface buffers
+        self._isoKey = None
+
+        if self.nChannels>1:
+            if method!="max_project":
+                raise NotImplementedError("multi channel data can only be rendered with max_project")
+            self._render_channels()
+        elif method=="max_project":
             self._render_max_project(self.dtype, numParts, currentPart)
+        elif method=="iso_surface":
+            self._render_isosurface()
+        elif method=="emission_absorption":
+            self._render_emission_absorption()
+
+    def render_tiled(self, size, tile_size=None, method="max_project"):
+        """renders an image of the given size (width, height) tile by tile
 
+        each tile is rendered into the buffers of the renderer (of size tile_size
+        if given, otherwise the current size) with a projection that maps the tile
+        onto the viewport, so the device memory does not depend on the output size
+
+        for iso surfaces the tiles overlap by the reach of the occlusion and
+        occlusion blur passes, so the stitched image has no seams
+
+        returns a RenderResult with outputs of shape (height, width)
+        """
+        Nx, Ny = size
+
+        if not hasattr(self, 'dataImg'):
+            print("no data provided, set_data(data) before")
+            return
+
+        renderSize = (self.width, self.height)
+        if tile_size is not None:
+            self.resize(tile_size)
+
+        w, h = self.width, self.height
+        margin = self._tile_margin(method)
+
+        if min(w, h)<=2*margin+1:
+            if tile_size is not None:
+                self.resize(renderSize)
+            raise ValueError("tile size (%s, %s) too small for an overlap of %s pixels"%(w, h, margin))
+
+        projection = self.projection
+        outputs = {}
+
+        # even steps (and margins), so the half resolution occlusion pixels of all tiles
+        # lie on the same grid
+        stepX, stepY = (w-2*margin)//2*2, (h-2*margin)//2*2
+
+        # the accumulation of the occlusion would differ between the tiles
+        occAccumulate = self.occ_accumulate
+        self.occ_accumulate = 1
+
+        try:
+            for y0 in range(0, Ny, stepY):
+                for x0 in range(0, Nx, stepX):
+                    self._tileOffset = (x0-margin, y0-margin)
+                    self.set_projection(np.dot(inv(self._tile_mat(size, self._tileOffset)), projection))
+                    res = self.render(method=method)
+
+                    nx, ny = min(stepX, Nx-x0), min(stepY, Ny-y0)
+                    for name in res.names():
+                        out = res.get(name)
+                        if not name in outputs:
+                            outputs[name] = np.empty((Ny, Nx)+out.shape[2:], out.dtype)
+                        outputs[name][y0:y0+ny, x0:x0+nx] = out[margin:margin+ny, margin:margin+nx]
+        finally:
+            self._tileOffset = (0, 0)
+            self.occ_accumulate = occAccumulate
+            self.set_projection(projection)
+            if tile_size is not None:
+                self.resize(renderSize)
+
+        self._set_result(**outputs)
+        return self.result
+
+    def _tile_margin(self, method):
+        """the overlap in pixels needed between tiles"""
         if method=="iso_surface":
-            self._render_isosurface()
+            # the occlusion radius and the half width of the occlusion (5) blur
+            # (at half resolution) rounded up to an even number
+            margin = self.occ_radius+2*(5//2)+2
+            return margin+margin%2
+        else:
+            return 0
+
+    def _tile_mat(self, size, offset):
+        """maps the normalized coordinates of the tile at offset (in pixels)
+        to the ones of the full image of the given size"""
+        Nx, Ny = size
+        mat = np.identity(4)
+        mat[0, 0], mat[0, 3] = 1.*self.width/Nx, (2.*offset[0]+self.width)/Nx-1.
+        mat[1, 1], mat[1, 3] = 1.*self.height/Ny, (2.*offset[1]+self.height)/Ny-1.
+        return mat
+
+    def render_batch(self, modelViews, projections=None, method="max_project"):
+        """renders several views at once (e.g. for turntables or stereo pairs)
+
+        modelViews is a list of N modelView matrices, projections is either None
+        (the current projection for all views), a single matrix or a list of N matrices
+
+        all views are rendered in single kernel launches over (width, height, N)
+        returns a RenderResult with outputs of shape (N, height, width)
+        """
+        modelViews = np.asarray(modelViews, np.float64).reshape((-1, 4, 4))
+        N = len(modelViews)
+
+        if projections is None:
+            projections = self.projection
+        projections = np.asarray(projections, np.float64).reshape((-1, 4, 4))
+        if len(projections)==1:
+            projections = np.repeat(projections, N, axis=0)
+        if len(projections)!=N:
+            raise ValueError("got %s modelViews but %s projections"%(N, len(projections)))
+
+        if not hasattr(self, 'dataImg'):
+            print("no data provided, set_data(data) before")
+            return
 
+        if self._slabs is not None:
+            # slabs are composited per view, so render the views one after another
+            return self._render_views(modelViews, projections, method)
+
+        # the matrices of all views have to fit into the constant memory
+        maxViews = max(1, int(get_device().get_info("MAX_CONSTANT_BUFFER_SIZE")//(2*16*4)))
+        if N>maxViews:
+            results = [self.render_batch(modelViews[i:i+maxViews], projections[i:i+maxViews], method)
+                       for i in range(0, N, maxViews)]
+            return RenderResult(**dict((name, np.concatenate([res.get(name) for res in results]))
+                                       for name in results[0].names()))
+
+        # use the finest pyramid level needed by any of the views
+        if self.n_levels()>1:
+            modelView, projection = self.modelView, self.projection
+            levels = []
+            for self.modelView, self.projection in zip(modelViews, projections):
+                levels.append(self._target_level())
+            self.modelView, self.projection = modelView, projection
+            if min(levels)!=self.level:
+                self.set_level(min(levels))
+
+        if self._batchBufs is None or self._batchBufs[0].shape[0]!=N:
+            self.pool.release(*(self._batchBufs or []))
+            self._batchBufs = [self.pool.array((N,)+b.shape, dtype=np.float32)
+                               for b in (self.buf, self.buf_alpha, self.buf_depth, self.buf_normals,
+                                         self.buf_tmp, self.buf_tmp_vec, self.buf_occlusion,
+                                         self.buf_occlusion_low, self._rgb_buffer(), self.buf_raw)]
+
+        mScale = self._stack_scale_mat()
+        invMs = np.stack([inv(np.dot(M, mScale)) for M in modelViews])
+        invPs = np.stack([inv(P) for P in projections])
+
+        # render with the batch buffers in place of the single view ones
+        state = (self.buf, self.buf_alpha, self.buf_depth, self.buf_normals,
+                 self.buf_tmp, self.buf_tmp_vec, self.buf_occlusion, self.buf_occlusion_low,
+                 self.buf_rgb, self.buf_raw, self.invMBuf, self.invPBuf)
+
+        (self.buf, self.buf_alpha, self.buf_depth, self.buf_normals,
+         self.buf_tmp, self.buf_tmp_vec, self.buf_occlusion, self.buf_occlusion_low,
+         self.buf_rgb, self.buf_raw) = self._batchBufs
+        self.invMBuf = OCLArray.from_array(invMs.reshape(-1).astype(np.float32))
+        self.invPBuf = OCLArray.from_array(invPs.reshape(-1).astype(np.float32))
+        self._nViews = N
+        self._inBatch = True
+
+        try:
+            self._render_method(method)
+        finally:
+            self._inBatch = False
+            (self.buf, self.buf_alpha, self.buf_depth, self.buf_normals,
+             self.buf_tmp, self.buf_tmp_vec, self.buf_occlusion, self.buf_occlusion_low,
+             self.buf_rgb, self.buf_raw, self.invMBuf, self.invPBuf) = state
+            self._nViews = 1
+
+        return self.result
+
+    def _render_views(self, modelViews, projections, method):
+        """renders the views one after another and stacks the outputs"""
+        modelView, projection = self.modelView, self.projection
+
+        outputs = []
+        for M, P in zip(modelViews, projections):
+            self.set_modelView(M)
+            self.set_projection(P)
+            res = self.render(method=method)
+            outputs.append(dict((name, res.get(name)) for name in res.names()))
+
+        self.set_modelView(modelView)
+        self.set_projection(projection)
+
+        self._set_result(**dict((name, np.stack([out[name] for out in outputs]))
+                                for name in outputs[0]))
+        return self.result
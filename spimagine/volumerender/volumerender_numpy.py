@@ -0,0 +1,406 @@
+"""
+a pure numpy renderer with the same interface as VolumeRenderer
+
+to be used on machines without an OpenCL device (e.g. headless servers),
+it follows the OpenCL kernels closely (ray setup, sampling, normalization)
+but is of course much slower. Rays are processed in chunks to limit the memory.
+
+supports method = "max_project" (with alpha_pow) and a basic "iso_surface"
+(phong shading without ambient occlusion)
+
+usage:
+
+rend = VolumeRendererNumpy((400,400))
+rend.set_data(d)
+rend.set_modelView(mat4_translate(0,0,-4))
+rend.render(maxVal = 100.)
+
+out = rend.output
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import numpy as np
+from numpy.linalg import inv
+from scipy.ndimage import map_coordinates
+from six.moves import range
+from six.moves import zip
+
+from spimagine.utils.transform_matrices import *
+from spimagine.volumerender.render_result import RenderResult
+
+logger = logging.getLogger(__name__)
+
+# the step number of the max_project kernels is rounded to multiples of this
+_LOOPUNROLL = 16
+
+
+def _default_max_steps():
+    # the config is imported here, so this module never needs OpenCL at import time
+    from spimagine.config import config
+    return config.__DEFAULTMAXSTEPS__
+
+
+class VolumeRendererNumpy(object):
+    """ renders a data volume by ray casting/max projection on the cpu
+
+    usage:
+               rend = VolumeRendererNumpy((400,400))
+               rend.set_data(d)
+               rend.set_units(1.,1.,2.)
+               rend.set_modelView(rotMatX(.7))
+    """
+    dtypes = [np.float32, np.uint16, np.uint8]
+    interpolation_orders = {"linear": 1, "nearest": 0}
+
+    def __init__(self, size=None, interpolation="linear", max_steps=None, chunk_samples=2**22):
+        """ e.g. size = (300,300)
+
+        chunk_samples is the maximal number of samples that are kept in memory at once
+        """
+        self.max_steps = _default_max_steps() if max_steps is None else max_steps
+        self.chunk_samples = chunk_samples
+
+        self.rebuild_program(interpolation=interpolation)
+
+        self.projection = np.zeros((4, 4))
+        self.modelView = np.zeros((4, 4))
+
+        if size:
+            self.resize(size)
+        else:
+            self.resize((200, 200))
+
+        self.set_dtype()
+        self.set_gamma()
+        self.set_max_val()
+        self.set_min_val()
+
+        self.set_occ_strength(.1)
+        self.set_occ_radius(21)
+        self.set_occ_n_points(30)
+
+        self.set_alpha_pow()
+        self.set_box_boundaries()
+        self.set_units()
+        self.set_modelView()
+        self.set_projection()
+
+    def rebuild_program(self, interpolation="linear"):
+        """there is nothing to build, only sets the interpolation order"""
+        if interpolation in VolumeRendererNumpy.interpolation_orders:
+            self.order = VolumeRendererNumpy.interpolation_orders[interpolation]
+        else:
+            raise KeyError(
+                "interpolation = '%s' not defined ,valid: %s" % (interpolation, list(VolumeRendererNumpy.interpolation_orders.keys())))
+
+    def set_dtype(self, dtype=None):
+        if dtype is None:
+            dtype = self.dtypes[0]
+
+        if dtype in self.dtypes:
+            self.dtype = dtype
+        else:
+            raise NotImplementedError("data type should be either %s not %s"%(self.dtypes, dtype))
+
+    def resize(self, size):
+        self.width, self.height = size
+        self.reset_buffer()
+
+    def reset_buffer(self):
+        self.output = np.zeros((self.height, self.width), dtype=np.float32)
+        self.output_alpha = np.zeros((self.height, self.width), dtype=np.float32)
+        self.output_depth = np.zeros((self.height, self.width), dtype=np.float32)
+
+    def set_max_val(self, maxVal=0.):
+        self.maxVal = maxVal
+
+    def set_min_val(self, minVal=0.):
+        self.minVal = minVal
+
+    def set_gamma(self, gamma=1.):
+        self.gamma = gamma
+
+    def set_occ_strength(self, occ=.2):
+        self.occ_strength = occ
+
+    def set_occ_radius(self, rad=21):
+        self.occ_radius = rad
+
+    def set_occ_n_points(self, n_points=31):
+        self.occ_n_points = n_points
+
+    def set_alpha_pow(self, alphaPow=0.):
+        self.alphaPow = alphaPow
+
+    def set_max_steps(self, max_steps=None):
+        """the number of samples along each ray (default: max_steps from the config)"""
+        if max_steps is None:
+            max_steps = _default_max_steps()
+        self.max_steps = max(2, int(max_steps))
+
+    def set_data(self, data, autoConvert=True, copyData=False):
+        logger.debug("set_data")
+
+        if not autoConvert and not data.dtype in self.dtypes:
+            raise NotImplementedError("data type should be either %s not %s"%(self.dtypes, data.dtype))
+
+        if data.dtype.type in self.dtypes:
+            self.set_dtype(data.dtype.type)
+
+        self.update_data(data, copyData=copyData)
+
+    def update_data(self, data, copyData=False):
+        if data.ndim!=3:
+            raise ValueError("data should be 3d (got ndim = %s)"%data.ndim)
+
+        # map_coordinates works on float32 without further copies
+        self._data = data.astype(np.float32, copy=copyData)
+        self.dataShape = self._data.shape[::-1]
+
+    def set_box_boundaries(self, boxBounds=[-1, 1, -1, 1, -1, 1]):
+        self.boxBounds = np.array(boxBounds)
+
+    def set_units(self, stackUnits=np.ones(3)):
+        self.stackUnits = np.array(stackUnits)
+
+    def set_projection(self, projection=mat4_perspective()):
+        self.projection = projection
+
+    def set_modelView(self, modelView=mat4_identity()):
+        self.modelView = 1.*modelView
+
+    def _stack_scale_mat(self):
+        # scaling the data according to size and units
+        Nx, Ny, Nz = self.dataShape
+        dx, dy, dz = self.stackUnits
+
+        maxDim = max(d*N for d, N in zip([dx, dy, dz], [Nx, Ny, Nz]))
+        return mat4_scale(1.*dx*Nx/maxDim, 1.*dy*Ny/maxDim, 1.*dz*Nz/maxDim)
+
+    def _rays(self):
+        """ the ray origins and directions (in model coordinates) of all pixels
+        and their intersection with the box, as in the kernels"""
+        invM = inv(np.dot(self.modelView, self._stack_scale_mat()))
+        invP = inv(self.projection)
+
+        u = np.arange(self.width)/(1.*self.width)*2.-1.
+        v = np.arange(self.height)/(1.*self.height)*2.-1.
+        U, V = [a.ravel() for a in np.meshgrid(u, v)]
+        ones = np.ones_like(U)
+
+        front = np.stack([U, V, -ones, ones], axis=-1)
+        back = np.stack([U, V, ones, ones], axis=-1)
+
+        orig0 = np.dot(front, invP.T)
+        orig0 /= orig0[:, 3:]
+        orig = np.dot(orig0, invM.T)
+        orig /= orig[:, 3:]
+
+        temp = np.dot(back, invP.T)
+        temp /= temp[:, 3:]
+        direc = temp-orig0
+        direc /= np.linalg.norm(direc, axis=-1, keepdims=True)
+        direc = np.dot(direc, invM.T)
+        direc[:, 3] = 0
+
+        boxMin, boxMax = self.boxBounds[::2], self.boxBounds[1::2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            invR = 1./direc[:, :3]
+            tbot = invR*(boxMin-orig[:, :3])
+            ttop = invR*(boxMax-orig[:, :3])
+            tnear = np.nanmax(np.minimum(tbot, ttop), axis=-1)
+            tfar = np.nanmin(np.maximum(tbot, ttop), axis=-1)
+
+        hit = tfar>tnear
+        tnear = np.maximum(tnear, 0)
+
+        return orig[:, :3], direc[:, :3], tnear, tfar, hit, invM
+
+    def _sample(self, pos):
+        """ pos are normalized texture coordinates (x,y,z) of shape (...,3)"""
+        coords = pos*np.array(self.dataShape)-.5
+        coords = coords.reshape((-1, 3)).T[::-1]
+        vals = map_coordinates(self._data, coords, order=self.order, mode="nearest", prefilter=False)
+        return vals.reshape(pos.shape[:-1])
+
+    def _chunks(self, n_rays, n_steps):
+        n = max(1, self.chunk_samples//n_steps)
+        for i in range(0, n_rays, n):
+            yield slice(i, min(i+n, n_rays))
+
+    def _render_max_project(self, numParts=1, currentPart=0):
+        orig, direc, tnear, tfar, hit, _ = self._rays()
+
+        reducedSteps = self.max_steps//numParts
+        nSteps = (reducedSteps//_LOOPUNROLL+1)*_LOOPUNROLL
+
+        dt = np.abs(tfar-tnear)/(max(reducedSteps//_LOOPUNROLL, 1)*_LOOPUNROLL)
+        orig = orig+(currentPart*dt)[:, np.newaxis]*direc
+
+        col = np.zeros(len(orig), np.float32)
+        depth = np.full(len(orig), np.inf, np.float32)
+        trans = np.ones(len(orig), np.float32)
+
+        isNormed = self.maxVal!=0
+        steps = np.arange(nSteps)
+
+        inds = np.where(hit)[0]
+        for sl in self._chunks(len(inds), nSteps):
+            ind = inds[sl]
+            pos0 = .5*(1.+orig[ind]+tnear[ind, np.newaxis]*direc[ind])
+            delta_pos = .5*dt[ind, np.newaxis]*direc[ind]
+            vals = self._sample(pos0[:, np.newaxis]+steps[:, np.newaxis]*delta_pos[:, np.newaxis])
+
+            if self.alphaPow==0:
+                vals = np.maximum(vals, 0)
+                if isNormed:
+                    vals = (vals-self.minVal)/(self.maxVal-self.minVal)
+            else:
+                if isNormed:
+                    vals = (vals-self.minVal)/(self.maxVal-self.minVal)
+                # as in max_project_short, the attenuation is weaker for integer data
+                alpha_pow = self.alphaPow*(np.sqrt(.1) if self.dtype in [np.uint16, np.uint8] else 1.)
+                att = 1.-alpha_pow**2*np.clip(vals, 0, 1)
+                cumsum = np.cumprod(att, axis=-1)
+                # the transmittance before every sample, rays stop once it drops to 0.01
+                before = np.concatenate([np.ones((len(ind), 1)), cumsum[:, :-1]], axis=-1)
+                vals = np.where(before>.01, np.maximum(before*vals, 0), 0)
+                isStopped = cumsum<=.01
+                trans[ind] = np.where(np.any(isStopped, axis=-1),
+                                      np.amax(np.where(isStopped, cumsum, 0), axis=-1), cumsum[:, -1])
+
+            maxInd = np.argmax(vals, axis=-1)
+            col[ind] = vals[np.arange(len(ind)), maxInd]
+            depth[ind] = tnear[ind]+(maxInd+currentPart)*dt[ind]
+
+        col = np.clip(np.maximum(col, 0)**self.gamma, 0, 1)
+        alpha = np.where(hit, 1., -1.).astype(np.float32)
+
+        col, alpha, depth, trans = [a.reshape((self.height, self.width)) for a in (col, alpha, depth, trans)]
+
+        if currentPart==0:
+            self.output, self.output_alpha, self.output_depth = col, alpha, depth
+            self.output_trans = trans
+        else:
+            self.output = np.maximum(col, self.output)
+            self.output_alpha = np.maximum(alpha, self.output_alpha)
+            self.output_depth = np.minimum(depth, self.output_depth)
+            self.output_trans = np.minimum(trans, self.output_trans)
+
+    def _render_isosurface(self):
+        orig, direc, tnear, tfar, hit, invM = self._rays()
+        isoVal = self.maxVal/2.
+        maxSteps = self.max_steps
+        nBisect = 8
+
+        col = np.zeros(len(orig), np.float32)
+        alpha = np.zeros(len(orig), np.float32)
+        depth = np.full(len(orig), np.inf, np.float32)
+        normals = np.zeros((len(orig), 3), np.float32)
+
+        dt = 1.*(tfar-tnear)/(maxSteps-1.)
+
+        light = np.dot(invM, [2, -1, -2, 0])[:3]
+        light /= np.linalg.norm(light)
+
+        inds = np.where(hit)[0]
+        for sl in self._chunks(len(inds), maxSteps):
+            ind = inds[sl]
+            pos0 = .5*(1.+orig[ind]+tnear[ind, np.newaxis]*direc[ind])
+            delta_pos = .5*dt[ind, np.newaxis]*direc[ind]
+            vals = self._sample(pos0[:, np.newaxis]+np.arange(maxSteps)[:, np.newaxis]*delta_pos[:, np.newaxis])
+
+            isGreater = vals[:, 0]>isoVal
+            crossed = (vals>isoVal)!=isGreater[:, np.newaxis]
+            isHit = np.any(crossed, axis=-1)
+            i = np.argmax(crossed, axis=-1)
+
+            ind, i, isGreater = ind[isHit], i[isHit], isGreater[isHit]
+            pos0, delta_pos = pos0[isHit], delta_pos[isHit]
+            if len(ind)==0:
+                continue
+
+            # refine the hit position by bisecting the interval between the last two steps
+            s0, s1 = np.zeros(len(ind)), np.ones(len(ind))
+            for _ in range(nBisect):
+                sm = .5*(s0+s1)
+                subVals = self._sample(pos0+(i-1+sm)[:, np.newaxis]*delta_pos)
+                subCrossed = (subVals>isoVal)!=isGreater
+                s0, s1 = np.where(subCrossed, s0, sm), np.where(subCrossed, sm, s1)
+
+            pos = pos0+(i-1+.5*(s0+s1))[:, np.newaxis]*delta_pos
+            t_hit = tnear[ind]+(i-1+.5*(s0+s1))*dt[ind]
+
+            # the normals from central differences with a step of one voxel
+            h = 1./np.array(self.dataShape)
+            normal = np.zeros((len(ind), 3))
+            for ax in range(3):
+                e = np.zeros(3)
+                e[ax] = h[ax]
+                normal[:, ax] = (self._sample(pos+e)-self._sample(pos-e))/h[ax]
+
+            normal /= np.maximum(np.linalg.norm(normal, axis=-1, keepdims=True), 1.e-20)
+            normal *= (1.-2*isGreater)[:, np.newaxis]
+
+            # phong shading
+            d = direc[ind]/np.linalg.norm(direc[ind], axis=-1, keepdims=True)
+            ln = np.dot(normal, light)
+            reflect = 2*ln[:, np.newaxis]*normal-light
+            reflect /= np.maximum(np.linalg.norm(reflect, axis=-1, keepdims=True), 1.e-20)
+            diffuse = np.maximum(0, ln)
+            specular = np.maximum(0, np.sum(reflect*d, axis=-1))**10
+
+            col[ind] = .3+.4*diffuse+(diffuse>0)*.3*specular
+            alpha[ind] = tnear[ind]
+            depth[ind] = t_hit
+            normals[ind] = normal
+
+        self.output = col.reshape((self.height, self.width))
+        self.output_alpha = alpha.reshape((self.height, self.width))
+        self.output_depth = depth.reshape((self.height, self.width))
+        self.output_normals = normals.reshape((self.height, self.width, 3))
+
+    def render(self, data=None, stackUnits=None,
+               minVal=None, maxVal=None, gamma=None,
+               modelView=None, projection=None,
+               boxBounds=None, return_alpha=False, method="max_project",
+               numParts=1, currentPart=0):
+
+        if data is not None:
+            self.set_data(data)
+
+        if maxVal is not None:
+            self.set_max_val(maxVal)
+
+        if minVal is not None:
+            self.set_min_val(minVal)
+
+        if gamma is not None:
+            self.set_gamma(gamma)
+
+        if stackUnits is not None:
+            self.set_units(stackUnits)
+
+        if modelView is not None:
+            self.set_modelView(modelView)
+
+        if projection is not None:
+            self.set_projection(projection)
+
+        if not hasattr(self, "_data"):
+            print("no data provided, set_data(data) before")
+            return
+
+        if method=="max_project":
+            self._render_max_project(numParts, currentPart)
+
+        if method=="iso_surface":
+            self._render_isosurface()
+
+        outputs = ("output", "output_alpha", "output_depth")
+        if method=="iso_surface":
+            outputs += ("output_normals",)
+        return RenderResult(**dict((name, getattr(self, name)) for name in outputs))
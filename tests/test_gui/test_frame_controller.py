@@ -0,0 +1,32 @@
+from __future__ import absolute_import, print_function
+
+from spimagine.gui.frame_controller import FrameTimeController
+
+
+def test_frame_controller():
+    """the level should go down for slow and up for fast frames, but not oscillate"""
+    ctrl = FrameTimeController(target_fps=10, n_frames=3)
+
+    # a render time that scales with the cost of the level
+    def frame_time(t_full):
+        return t_full*ctrl.resolution**2*ctrl.steps
+
+    for _ in range(100):
+        ctrl.add_frame(frame_time(.3))
+    assert ctrl.level>0
+    assert frame_time(.3)<=1.25*ctrl.target_time
+
+    # a constant load should settle on a single level
+    levels = set()
+    for _ in range(100):
+        ctrl.add_frame(frame_time(.3))
+        levels.add(ctrl.level)
+    assert len(levels)==1
+
+    for _ in range(100):
+        ctrl.add_frame(frame_time(.01))
+    assert ctrl.level==0
+
+
+if __name__ == '__main__':
+    test_frame_controller()
@@ -0,0 +1,39 @@
+"""
+
+mweigert@mpi-cbg.de
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+import numpy as np
+from spimagine.models.transform_model import TransformModel, LAYER_VOLUME, LAYER_SLICE, LAYER_BOX, LAYER_MESH
+from spimagine import Quaternion
+
+
+def test_layers():
+    """changes should only mark the layers of the view they affect"""
+    t = TransformModel()
+
+    layers = []
+    t._layersChanged.connect(layers.append)
+
+    def changed(f, *args):
+        del layers[:]
+        f(*args)
+        return np.bitwise_or.reduce(layers) if layers else 0
+
+    assert changed(t.setSlicePos, 10) == LAYER_SLICE
+    assert changed(t.setSliceDim, 1) == LAYER_SLICE
+    assert changed(t.setShowSlice, True) == LAYER_SLICE
+    assert changed(t.setBox, False) == LAYER_BOX
+    assert changed(t.setGamma, .5) == LAYER_VOLUME
+    assert changed(t.setMax, 100.) == LAYER_VOLUME
+    assert changed(t.setBounds, -1, 1, -1, 1, 0, 1) == LAYER_VOLUME | LAYER_BOX
+    assert changed(t.setSamplingRate, 2.) == LAYER_VOLUME
+    assert changed(t.setSamplingRate, 2.) == 0
+
+    view = changed(t.setQuaternion, Quaternion(.71, .71, 0, 0))
+    assert view & LAYER_VOLUME and view & LAYER_BOX and view & LAYER_MESH
+    assert not view & LAYER_SLICE
+
+
+if __name__ == '__main__':
+    test_layers()
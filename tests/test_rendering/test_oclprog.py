@@ -106,7 +106,7 @@ if __name__ == '__main__':
                          None,
                          rend.buf.data,
                          rend.buf_alpha.data,
-                         rend.buf_depth.data,
+                         rend.buf_depth.data, rend.buf_tmp.data, rend.buf_raw.data,
                          np.int32(rend.width),
                          np.int32(rend.height),
                          np.float32(rend.boxBounds[0]),
@@ -119,11 +119,16 @@ if __name__ == '__main__':
                          np.float32(rend.maxVal),
                          np.float32(rend.gamma),
                          np.float32(rend.alphaPow),
+                         np.int32(rend.max_steps),
+                         np.float32(rend.sampling_rate),
                          np.int32(1),
                          np.int32(0),
+                         np.float32(-1),
                          rend.invPBuf.data,
                          rend.invMBuf.data,
-                         rend.dataImg
+                         rend.dataImg,
+                         rend.brickBuf.data,
+                         np.int32(rend.brick_size)
                          )
 
     out = rend.buf.get()
@@ -0,0 +1,46 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+
+from spimagine.volumerender.memory_pool import MemoryPool
+
+
+def test_reuse():
+    """released objects should be handed out again for the same shape and dtype only"""
+    pool = MemoryPool(max_free_bytes=2**20)
+
+    a = pool.array((32, 16), np.float32)
+    img = pool.image((8, 16, 32), np.uint16)
+    pool.release(a, img, None)
+
+    assert pool.array((16, 32), np.float32) is not a
+    assert pool.array((32, 16), np.uint16) is not a
+    assert pool.array((32, 16), np.float32) is a
+    assert pool.image((8, 16, 32), np.float32) is not img
+    assert pool.image((8, 16, 32), np.uint16) is img
+
+    stats = pool.stats()
+    assert stats["reused"] == 2 and stats["released"] == 2 and stats["allocated"] == 5
+    assert stats["free"] == 0 and stats["free_bytes"] == 0
+
+    # zeros are zeros even if reused
+    a.fill(1)
+    pool.release(a)
+    z = pool.zeros((32, 16), np.float32)
+    assert z is a and np.all(z.get() == 0)
+
+
+def test_budget():
+    """the oldest released objects should be freed to stay within the budget"""
+    pool = MemoryPool(max_free_bytes=3*4*100)
+
+    bufs = [pool.array((100,), np.float32) for _ in range(4)]
+    pool.release(*bufs)
+    assert pool.stats()["free"] == 3 and pool.free_bytes == 3*4*100
+
+    # the first one was freed
+    assert not any(pool.array((100,), np.float32) is bufs[0] for _ in range(3))
+
+    pool.release(*bufs[1:])
+    pool.set_max_free_bytes(0)
+    assert pool.stats()["free"] == 0
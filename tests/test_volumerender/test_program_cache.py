@@ -0,0 +1,57 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import shutil
+import tempfile
+import numpy as np
+from gputools import OCLArray
+
+import spimagine
+from spimagine.volumerender import program_cache
+
+src_str = """
+__kernel void foo(__global float *output, const float val){
+  int i = get_global_id(0);
+  output[i] = i+val;
+}
+"""
+
+
+def test_program_cache():
+    """programs should be shared in process and be loaded from the disk cache after a restart"""
+    tmpdir = tempfile.mkdtemp()
+    cache_dir = spimagine.config.__PROGRAM_CACHE_DIR__
+    spimagine.config.__PROGRAM_CACHE_DIR__ = os.path.join(tmpdir, "cache")
+
+    try:
+        fname = os.path.join(tmpdir, "foo.cl")
+        with open(fname, "w") as f:
+            f.write(src_str)
+
+        program_cache.clear_cache(disk=False)
+        prog = program_cache.build_program(fname, ["-D", "FOO"])
+        assert program_cache.build_program(fname, ["-D", "FOO"]) is prog
+        assert program_cache.build_program(fname) is not prog
+        assert len(os.listdir(spimagine.config.__PROGRAM_CACHE_DIR__)) == 2
+
+        # as after a restart
+        program_cache.clear_cache(disk=False)
+        prog = program_cache.build_program(fname, ["-D", "FOO"])
+        assert isinstance(prog, program_cache._BinaryProgram)
+
+        out = OCLArray.empty(10, np.float32)
+        prog.run_kernel("foo", out.shape, None, out.data, np.float32(3))
+        assert np.allclose(out.get(), np.arange(10)+3)
+
+        # changing the source invalidates the binary
+        with open(fname, "w") as f:
+            f.write(src_str.replace("i+val", "i*val"))
+        prog = program_cache.build_program(fname, ["-D", "FOO"])
+        assert not isinstance(prog, program_cache._BinaryProgram)
+    finally:
+        spimagine.config.__PROGRAM_CACHE_DIR__ = cache_dir
+        program_cache.clear_cache(disk=False)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_program_cache()
@@ -0,0 +1,75 @@
+"""
+
+mweigert@mpi-cbg.de
+"""
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+import numpy as np
+from spimagine.volumerender.pyramid import VolumePyramid, block_mean
+
+
+def test_block_mean():
+    d = np.random.uniform(0, 100, (9, 10, 11)).astype(np.float32)
+    res = block_mean(d, (2, 2, 2))
+    assert res.shape == (5, 5, 6)
+    assert np.allclose(res[0, 0, 0], np.mean(d[:2, :2, :2]))
+    # the incomplete border blocks
+    assert np.allclose(res[-1, -1, -1], np.mean(d[8:, 8:, 10:]))
+
+
+def test_pyramid_anisotropic():
+    d = np.random.randint(0, 1000, (32, 128, 128)).astype(np.uint16)
+    p = VolumePyramid(d, stackUnits=(1., 1., 4.), min_size=16)
+    shapes = [p.shape(level) for level in range(len(p))]
+    # z is only downsampled once x and y have caught up with its spacing
+    assert shapes[1] == (32, 64, 64)
+    assert shapes[2] == (32, 32, 32)
+    assert shapes[3] == (16, 16, 16)
+    assert all(p[level].dtype == np.uint16 for level in range(len(p)))
+
+
+def test_pyramid_lazy():
+    """the levels should only be computed when accessed, with the announced shapes"""
+    d = np.random.uniform(0, 100, (64, 64, 64)).astype(np.float32)
+    p = VolumePyramid(d, min_size=8)
+    assert len(p.levels) == 1
+
+    assert p[2].shape == p.shape(2) == (16, 16, 16)
+    assert len(p.levels) == 3
+    assert np.allclose(p[1], block_mean(d, (2, 2, 2)))
+    assert p[-1].shape == p.shape(len(p)-1) and p.nbytes(3) == p[3].nbytes
+
+
+def test_renderer_levels():
+    from spimagine.volumerender.volumerender import VolumeRenderer
+    from spimagine.utils import mat4_translate
+
+    d = np.random.uniform(0, 100, (128,) * 3).astype(np.float32)
+
+    rend = VolumeRenderer((16, 16))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+
+    # volumes that fit get no pyramid
+    rend.set_data(d)
+    assert rend.n_levels() == 1
+
+    # force a pyramid
+    rend.memMax = d.nbytes // 2
+    rend.set_data(d)
+    rend.render(maxVal=100.)
+
+    # a small output does not need the finest level that fits
+    assert rend.n_levels() > 1
+    assert rend.level > 1
+    # the finer levels were not computed
+    assert len(rend.pyramid.levels) == rend.level+1
+
+    rend.resize((512, 512))
+    rend.render(maxVal=100.)
+    assert rend.level == 1
+
+    return rend
+
+
+if __name__ == '__main__':
+    test_renderer_levels()
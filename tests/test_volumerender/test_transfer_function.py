@@ -0,0 +1,32 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import numpy as np
+
+from spimagine.volumerender.transfer_function import preintegrate, extinction, transfer_function_from_colormap
+
+
+def test_preintegrate():
+    """the table should hold the mean extinction and extinction weighted color between two values"""
+    tf = transfer_function_from_colormap(np.outer(np.linspace(0, 1, 100), [1, .5, .2]), opacity=.1)
+    table = preintegrate(tf, size=64)
+    assert table.shape == (64, 64, 4)
+
+    # symmetric in front and back value
+    assert np.allclose(table, np.transpose(table, (1, 0, 2)), rtol=1.e-5)
+
+    # the diagonal is the transfer function itself
+    s = np.linspace(0, 1, 64)
+    tau = np.interp(s, np.linspace(0, 1, 100), extinction(tf))
+    assert np.allclose(np.diagonal(table[..., 3]), tau, rtol=1.e-4)
+
+    # for the full range the mean extinction is the integral
+    assert np.allclose(table[-1, 0, 3], np.sum(.5*(tau[1:]+tau[:-1])*np.diff(s)), rtol=1.e-3)
+
+    # constant transfer functions give constant tables
+    tf = np.tile([.2, .4, .6, .05], (10, 1))
+    table = preintegrate(tf, size=32)
+    assert np.allclose(table, table[0, 0])
+    assert np.allclose(table[0, 0, :3], [.2, .4, .6])
+
+
+if __name__ == '__main__':
+    test_preintegrate()
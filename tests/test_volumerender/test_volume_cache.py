@@ -0,0 +1,75 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+
+from spimagine.volumerender.volume_cache import VolumeCache, CacheBudget
+
+
+def test_lru():
+    """the least recently used volumes should be dropped first to stay within the budget"""
+    cache = VolumeCache(max_bytes=100)
+    vols = [object() for _ in range(5)]
+
+    for i in range(3):
+        assert cache.put(i, vols[i], 40)
+
+    # 3*40 > 100, so the first one was dropped
+    assert len(cache) == 2 and cache.nbytes == 80
+    assert cache.get(0) is None
+
+    # using 1 makes 2 the oldest one
+    assert cache.get(1) is vols[1]
+    cache.put(3, vols[3], 40)
+    assert 1 in cache and 3 in cache and not 2 in cache
+    assert cache.owns(vols[1]) and not cache.owns(vols[2])
+
+    # too big for the whole cache
+    assert not cache.put(4, vols[4], 200)
+    assert not 4 in cache
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+    cache.set_max_bytes(50)
+    assert len(cache) == 1 and 3 in cache
+
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_on_evict():
+    """every dropped or removed volume should be passed to on_evict"""
+    dropped = []
+    cache = VolumeCache(max_bytes=100, on_evict=dropped.append)
+    vols = [object() for _ in range(4)]
+
+    for i in range(3):
+        cache.put(i, vols[i], 40)
+    assert dropped == [vols[0]]
+
+    cache.remove(1)
+    cache.clear()
+    assert dropped == vols[:3]
+
+
+def test_shared_budget():
+    """caches sharing a budget should together stay within it, dropping the least recently used volume of all"""
+    budget = CacheBudget(max_bytes=100)
+    dropped_a, dropped_b = [], []
+    a = VolumeCache(on_evict=dropped_a.append, budget=budget)
+    b = VolumeCache(on_evict=dropped_b.append, budget=budget)
+    vols = [object() for _ in range(4)]
+
+    a.put(0, vols[0], 40)
+    b.put(0, vols[1], 40)
+    assert a.get(0) is vols[0]
+
+    # the volume of b is the oldest one now
+    a.put(1, vols[2], 40)
+    assert dropped_b == [vols[1]] and dropped_a == []
+    assert budget.nbytes == 80 and b.max_bytes == 100
+
+    b.put(1, vols[3], 40)
+    assert dropped_a == [vols[0]]
+
+    # setting the size of one cache sets the one of all
+    a.set_max_bytes(50)
+    assert budget.max_bytes == 50 and len(a) + len(b) == 1 and 1 in b
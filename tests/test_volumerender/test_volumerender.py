@@ -7,6 +7,7 @@ from __future__ import print_function, unicode_literals, absolute_import, divisi
 import numpy as np
 from spimagine.volumerender.volumerender import VolumeRenderer
 from spimagine.utils import mat4_translate
+from spimagine.utils.transform_matrices import mat4_rotation
 import matplotlib
 matplotlib.use("Qt5Agg")
 import matplotlib.pyplot as plt
@@ -195,10 +196,872 @@ def test_opacity():
 
     return rend
 
+def test_brick_skipping():
+    """empty space skipping should not change the rendered image"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    R = np.sqrt((X-.3) ** 2 + Y ** 2 + Z ** 2)
+
+    d = 200 * np.exp(-40 * R ** 2)
+
+    rend = VolumeRenderer((100,) * 2)
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+
+    for dtype in (np.float32, np.uint16):
+        rend.set_data(d.astype(dtype))
+        for method in ("max_project", "iso_surface"):
+            outs = []
+            for brick_size in (0, 8):
+                rend.set_brick_size(brick_size)
+                rend.render(method=method, minVal=1.e-6, maxVal=200.)
+                outs.append(rend.output.copy())
+
+            assert np.allclose(outs[0], outs[1], atol=1.e-2)
+
+    return rend
+
+
+def test_volume_buffer():
+    """reading the volume from a buffer should give the same image as from an image"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    R = np.sqrt((X-.3) ** 2 + Y ** 2 + Z ** 2)
+
+    d = (200 * np.exp(-40 * R ** 2)).astype(np.float32)
+
+    for interp in ("linear", "nearest"):
+        rend = VolumeRenderer((100,) * 2, interpolation=interp)
+        rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+        rend.set_data(d)
+
+        outs = []
+        for use_buffer in (False, True):
+            rend.rebuild_program(interpolation=interp, use_buffer=use_buffer)
+            for method in ("max_project", "iso_surface"):
+                rend.render(method=method, minVal=1.e-6, maxVal=200.)
+                outs.append(rend.output.copy())
+
+        assert np.allclose(outs[0], outs[2], atol=1.e-4)
+        assert np.allclose(outs[1], outs[3], atol=1.e-4)
+
+    return rend
+
+
+def test_render_result():
+    """outputs are copied from the device only when accessed"""
+    d = np.random.uniform(0, 100, (32, 33, 34)).astype(np.float32)
+
+    rend = VolumeRenderer((40, 30))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(d)
+
+    res = rend.render(maxVal=100.)
+    assert res is rend.result
+    assert "output_depth" in res and not "output_normals" in res
+    assert res.output.shape == (30, 40)
+    assert np.allclose(res.output, rend.buf.get())
+
+    res.prefetch("output_alpha")
+    res2 = rend.render(maxVal=50.)
+
+    # fetched and prefetched outputs stay available
+    assert np.allclose(res.output_alpha, res2.output_alpha)
+    assert not np.allclose(res.output, res2.output)
+    try:
+        res.output_depth
+        assert False
+    except RuntimeError:
+        pass
+
+    return rend
+
+
+def test_render_batch():
+    """rendering a batch of views should give the same images as rendering them one by one"""
+    d = np.random.uniform(0, 100, (32, 33, 34)).astype(np.float32)
+
+    rend = VolumeRenderer((40, 30))
+    rend.set_data(d)
+    rend.set_max_val(100.)
+
+    Ms = [np.dot(mat4_translate(0, 0, -4.), mat4_rotation(phi, 0, 1, 0)) for phi in np.linspace(0, np.pi, 5)]
+
+    for method in ("max_project", "iso_surface"):
+        res = rend.render_batch(Ms, method=method)
+        assert res.output.shape == (len(Ms), 30, 40)
+
+        for i, M in enumerate(Ms):
+            rend.set_modelView(M)
+            out = rend.render(method=method).output
+            assert np.allclose(res.output[i], out, atol=1.e-5)
+
+    return rend
+
+
+def test_render_batch_single():
+    """a batch of a single view should not reuse the results of the previous render"""
+    d = np.random.uniform(0, 100, (32, 33, 34)).astype(np.float32)
+
+    rend = VolumeRenderer((40, 30))
+    rend.set_data(d)
+    rend.set_max_val(100.)
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.render(method="max_project")
+
+    M = np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.7, 0, 1, 0))
+    res = rend.render_batch([M], method="max_project").output.copy()
+
+    rend.set_modelView(M)
+    out = rend.render(method="max_project").output
+    assert np.allclose(res[0], out, atol=1.e-5)
+
+    # nor the accumulated occlusion
+    rend.set_occ_accumulate(4)
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.render(method="iso_surface")
+    res = rend.render_batch([M], method="iso_surface").output.copy()
+
+    rend.set_occ_accumulate(1)
+    rend.set_modelView(M)
+    out = rend.render(method="iso_surface").output
+    assert np.allclose(res[0], out, atol=1.e-5)
+
+
+def test_render_tiled():
+    """the stitched tiles should give the same image as rendering at once"""
+    d = np.random.uniform(0, 100, (32, 33, 34)).astype(np.float32)
+
+    rend = VolumeRenderer((70, 50))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_occ_radius(5)
+    rend.set_data(d)
+    rend.set_max_val(100.)
+
+    for method in ("max_project", "iso_surface"):
+        out = rend.render(method=method).output
+        out_tiled = rend.render_tiled((70, 50), tile_size=(40, 30), method=method).output
+        assert out_tiled.shape == (50, 70)
+        assert rend.width == 70 and rend.height == 50
+
+        # the blurs and occlusion see beyond the image border in the tiled version
+        m = rend._tile_margin(method)
+        assert np.allclose(out[m:-m or None, m:-m or None], out_tiled[m:-m or None, m:-m or None], atol=1.e-3)
+
+    return rend
+
+
+def test_channels():
+    """the rgb projection of multi channel data should be the sum of the colored single channel projections"""
+    x = np.linspace(-1, 1, 40)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = np.stack([100*np.exp(-20*((X-.3)**2+Y**2+Z**2)),
+                  200*np.exp(-10*((X+.3)**2+Y**2+Z**2)),
+                  50*np.exp(-20*(X**2+(Y-.4)**2+Z**2))]).astype(np.float32)
+
+    for use_buffer in (False, True):
+        rend = VolumeRenderer((50, 40))
+        rend.rebuild_program(use_buffer=use_buffer)
+        rend.set_modelView(mat4_translate(0, 0, -4.))
+
+        outs = []
+        for c, (maxVal, gamma) in enumerate(((100., 1.), (150., .7), (50., 1.))):
+            rend.render(data=d[c], minVal=0., maxVal=maxVal, gamma=gamma)
+            outs.append(rend.output.copy())
+
+        rend.set_data(d)
+        for c, (maxVal, gamma) in enumerate(((100., 1.), (150., .7), (50., 1.))):
+            rend.set_channel(c, minVal=0., maxVal=maxVal, gamma=gamma)
+        out = rend.render().output
+        assert out.shape == (40, 50, 3)
+
+        expected = np.clip(sum(out_c[..., np.newaxis]*col for out_c, col in zip(outs, rend.channelColors)), 0, 1)
+        assert np.allclose(out, expected, atol=2.e-2)
+
+    return rend
+
+
+def test_channel_params():
+    """the channel parameters should be kept on the device and only be written if they change"""
+    d = np.random.uniform(0, 100, (3, 20, 30, 40)).astype(np.float32)
+    rend = VolumeRenderer((50, 40))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(d)
+    rend.render()
+
+    n = rend.pool.n_allocated
+    paramsBuf = rend.channelParamsBuf
+    writes = []
+    write_array = paramsBuf.write_array
+    paramsBuf.write_array = lambda arr: writes.append(arr) or write_array(arr)
+
+    for _ in range(3):
+        rend.render()
+    assert rend.pool.n_allocated == n and writes == []
+
+    out = rend.output.copy()
+    rend.set_channel(0, gamma=.5)
+    rend.render()
+    assert rend.channelParamsBuf is paramsBuf and len(writes) == 1
+    assert not np.allclose(rend.output, out)
+
+    return rend
+
+
+def test_emission_absorption():
+    """the pre-integrated transfer function should give nearly the same images for few and many steps"""
+    x = np.linspace(-1, 1, 64)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-10*(np.sqrt(X**2+Y**2+Z**2)-.5)**2)).astype(np.float32)
+
+    rend = VolumeRenderer((50, 40))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(d)
+
+    tf = np.zeros((256, 4), np.float32)
+    tf[:, :3] = [1., .5, .2]
+    tf[128:, 3] = .1
+    rend.set_transfer_function(tf)
+
+    outs = []
+    for steps in (32, 500):
+        rend.set_max_steps(steps)
+        res = rend.render(method="emission_absorption", minVal=0., maxVal=100.)
+        assert res.output.shape == (40, 50, 3)
+        assert np.all(res.output_alpha <= 1.)
+        outs.append(res.output.copy())
+
+    assert outs[1].max() > .5
+    assert np.allclose(outs[0], outs[1], atol=1.e-2)
+
+    # skipping the transparent bricks should not change anything
+    rend.set_brick_size(0)
+    rend.set_data(d)
+    assert np.allclose(rend.render(method="emission_absorption").output, outs[1], atol=1.e-5)
+
+    # the slabs of out of core volumes are composited front to back (from both sides)
+    d[..., :32] *= .7
+    tf[:, 0] = np.linspace(0, 1, 256)
+    tf[:, 2] = np.linspace(1, 0, 256)
+    tf[128:, 3] = 2.
+    rend.set_transfer_function(tf)
+    rend.set_max_steps(200)
+    for angle in (.4, np.pi-.4):
+        rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(angle, 1, 1, 0)))
+        rend.set_out_of_core(False)
+        rend.memMax = 2*d.nbytes
+        rend.set_data(d)
+        out = rend.render(method="emission_absorption").output.copy()
+
+        rend.set_out_of_core(True)
+        rend.memMax = 12*d[0].nbytes
+        rend.set_data(d)
+        assert rend._slabs is not None
+        res = rend.render(method="emission_absorption")
+        assert res.output.shape == (40, 50, 3)
+        # only a few grazing rays at the silhouette of the opaque shell differ
+        diff = np.amax(np.abs(res.output-out), axis=-1)
+        assert np.mean(diff > 2.e-2) < 1.e-2 and np.mean(diff) < 5.e-3
+
+    return rend
+
+
+def test_iso_surface_refinement():
+    """the bisected hits should not depend on the step size and the
+    normals from the gradient volume should be the same as the ones computed at the hits"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    R = np.sqrt((X-.2) ** 2 + Y ** 2 + Z ** 2)
+
+    d = (200 * np.exp(-4 * R ** 2)).astype(np.float32)
+
+    rend = VolumeRenderer((100,) * 2)
+    rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+    rend.set_data(d)
+
+    depths = []
+    for max_steps in (400, 24):
+        rend.set_max_steps(max_steps)
+        rend.render(method="iso_surface", minVal=1.e-6, maxVal=200.)
+        depths.append(rend.output_depth.copy())
+
+    hit = np.isfinite(depths[0]) & np.isfinite(depths[1])
+    assert np.any(hit)
+    # only grazing rays at the silhouette might miss the surface with fewer steps
+    assert np.mean(np.isfinite(depths[0]) != np.isfinite(depths[1])) < 1.e-2
+    assert np.allclose(depths[0][hit], depths[1][hit], atol=1.e-3)
+
+    normals = []
+    for use_gradient in (False, True):
+        rend.set_gradient_volume(use_gradient)
+        rend.render(method="iso_surface", minVal=1.e-6, maxVal=200.)
+        normals.append(rend.output_normals.copy())
+    assert rend._gradient is not None
+
+    assert np.allclose(np.linalg.norm(normals[1][hit], axis=-1), 1., atol=1.e-4)
+    assert np.allclose(normals[0][hit], normals[1][hit], atol=2.e-2)
+
+    return rend
+
+
+def test_occlusion():
+    """the half resolution and accumulated occlusion should be close to the full resolution one"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*(np.sin(8*X)*np.sin(7*Y)*np.sin(6*Z)+1)*np.exp(-2*(X**2+Y**2+Z**2))).astype(np.float32)
+
+    rend = VolumeRenderer((101, 80))
+    rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+    rend.set_data(d)
+    rend.set_max_val(100.)
+
+    occs = []
+    for half_res, n_frames in ((False, 1), (True, 1), (True, 4)):
+        rend.set_occ_half_res(half_res)
+        rend.set_occ_accumulate(n_frames)
+        for _ in range(n_frames):
+            res = rend.render(method="iso_surface")
+        occs.append(res.get("output_occlusion").copy())
+
+    assert occs[0].shape == occs[1].shape == (80, 101)
+    for occ in occs[1:]:
+        assert np.mean(np.abs(occ-occs[0])) < 1.e-2
+
+    # the accumulated occlusion is reused as long as the view does not change
+    out = rend.output.copy()
+    assert np.array_equal(rend.render(method="iso_surface").output, out)
+
+    return rend
+
+
+def test_iso_refine():
+    """refining an iso surface should only accumulate the occlusion, without casting the rays again"""
+    x = np.linspace(-1, 1, 48)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (200*np.exp(-4*((X-.2)**2+Y**2+Z**2))).astype(np.float32)
+
+    outs = []
+    for refine in (False, True):
+        rend = VolumeRenderer((60, 50))
+        rend.set_modelView(mat4_translate(0, 0, -4.))
+        rend.set_data(d)
+        rend.set_occ_accumulate(4)
+        rend.render(method="iso_surface", minVal=0., maxVal=100.)
+
+        kernels = []
+        rend.proc.run_kernel = lambda name, *args, **kw: kernels.append(name) or \
+            type(rend.proc).run_kernel(rend.proc, name, *args, **kw)
+        for _ in range(3):
+            if refine:
+                rend.refine("iso_surface")
+            else:
+                rend.render(method="iso_surface")
+        outs.append(rend.result.output.copy())
+
+        assert ("iso_surface" in kernels) != refine
+        assert kernels.count("occlusion") == 3
+
+    assert np.allclose(outs[0], outs[1])
+
+    # a new view is cast again
+    kernels[:] = []
+    rend.set_modelView(mat4_translate(0, 0, -3.))
+    rend.refine("iso_surface")
+    assert "iso_surface" in kernels
+    # the program is shared by all renderers
+    del rend.proc.run_kernel
+
+    return rend
+
+
+def test_prefetch_data():
+    """rendering a prefetched (swapped) volume should give the same as uploading it"""
+    N = 48
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    ds = [(100*np.exp(-10*((X-.1*t)**2+Y**2+Z**2))).astype(np.float32) for t in range(4)]
+
+    for use_buffer in (False, True):
+        rend = VolumeRenderer((60, 50))
+        rend.rebuild_program(use_buffer=use_buffer)
+        rend.set_modelView(mat4_translate(0, 0, -4.))
+        rend.set_max_val(100.)
+
+        outs = []
+        for d in ds:
+            rend.update_data(d)
+            outs.append(rend.render().output.copy())
+
+        rend.update_data(ds[0])
+        for i in range(1, len(ds)):
+            assert rend.prefetch_data(ds[i])
+            img = rend._backImg
+            rend.update_data(ds[i])
+            assert rend.dataImg is img
+            assert np.allclose(rend.render().output, outs[i])
+
+        # a different array than the prefetched one is uploaded as usual
+        assert rend.prefetch_data(ds[0])
+        rend.update_data(ds[1].copy())
+        assert np.allclose(rend.render().output, outs[1])
+
+        # a different shape cannot be prefetched
+        assert not rend.prefetch_data(ds[0][:10])
+
+    return rend
+
+
+def test_volume_cache():
+    """revisited timepoints should be taken from the device cache"""
+    N = 40
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    ds = [(100*np.exp(-10*((X-.1*t)**2+Y**2+Z**2))).astype(np.float32) for t in range(3)]
+
+    rend = VolumeRenderer((60, 50))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(ds[0])
+    rend.set_max_val(100.)
+    rend.set_cache_size(10*ds[0].nbytes)
+
+    outs, imgs = [], []
+    for t, d in enumerate(ds):
+        rend.update_data(d, cacheKey=t)
+        imgs.append(rend.dataImg)
+        outs.append(rend.render().output.copy())
+
+    assert len(rend.volumeCache) == 3
+    for t in (1, 0, 2):
+        # a copy of the data, as only the key matters
+        rend.update_data(ds[t].copy(), cacheKey=t)
+        assert rend.dataImg is imgs[t]
+        assert np.allclose(rend.render().output, outs[t])
+    assert rend.volumeCache.hits == 3
+
+    # prefetching a cached timepoint is not needed
+    assert not rend.prefetch_data(ds[1], cacheKey=1)
+
+    # a prefetched timepoint is cached as well and the cached volumes are not overwritten
+    rend.clear_volume_cache()
+    rend.update_data(ds[0], cacheKey=0)
+    assert rend.prefetch_data(ds[1], cacheKey=1)
+    rend.update_data(ds[1], cacheKey=1)
+    assert rend.prefetch_data(ds[2], cacheKey=2)
+    rend.update_data(ds[2], cacheKey=2)
+    for t in range(3):
+        rend.update_data(ds[t], cacheKey=t)
+        assert np.allclose(rend.render().output, outs[t])
+
+    return rend
+
+
+def test_volume_cache_slabs():
+    """the slabs of an out of core volume should be released when a cached volume replaces it"""
+    d = np.ones((40, 32, 32), np.float32)
+    small = np.ones((8, 32, 32), np.float32)
+
+    rend = VolumeRenderer((30, 30))
+    rend.set_out_of_core(True)
+    rend.memMax = 12*d[0].nbytes
+    rend.set_cache_size(10*small.nbytes)
+    rend.update_data(small, cacheKey=0)
+
+    for update in (lambda: rend.update_data(small, cacheKey=0), lambda: rend.update_data(2*small)):
+        rend.update_data(d)
+        assert rend._slabs is not None
+        slabImgs = [img for img, _ in rend._slabImgs.values()]
+        update()
+        assert rend._slabs is None and rend._slabImgs == {}
+        assert all(id(img) in rend.pool._free for img in slabImgs)
+
+    return rend
+
+
+def test_volume_cache_shared():
+    """the timepoint caches of all renderers on a device should share one budget"""
+    d = np.ones((32,)*3, np.float32)
+    rends = [VolumeRenderer((30, 30)) for _ in range(2)]
+    assert rends[0].volumeCache.budget is rends[1].volumeCache.budget
+
+    rends[0].set_cache_size(3*d.nbytes)
+    assert rends[1].volumeCache.max_bytes == 3*d.nbytes
+
+    for t in range(2):
+        for rend in rends:
+            rend.update_data(d+t, cacheKey=t)
+    assert len(rends[0].volumeCache) + len(rends[1].volumeCache) <= 3
+    assert rends[0].volumeCache.budget.nbytes <= 3*d.nbytes
+
+    return rends
+
+
+def test_out_of_core():
+    """rendering slab by slab should give the same image as rendering at once"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    R = np.sqrt((X-.3) ** 2 + Y ** 2 + Z ** 2)
+
+    d = (200 * np.exp(-10 * R ** 2)).astype(np.float32)
+
+    outs = []
+    for out_of_core in (False, True):
+        rend = VolumeRenderer((100,) * 2)
+        rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+        rend.set_out_of_core(out_of_core)
+        # force slabs of 10 slices
+        rend.memMax = 12*d[0].nbytes
+        rend.set_data(d)
+        assert (rend._slabs is not None)==out_of_core
+
+        rend.render(method="max_project", minVal=1.e-6, maxVal=200.)
+        out_max = rend.output.copy()
+        rend.render(method="iso_surface", minVal=1.e-6, maxVal=200.)
+        outs.append((out_max, rend.output_depth.copy()))
+
+    # the slabs are sampled at slightly different positions
+    assert np.allclose(outs[0][0], outs[1][0], atol=5.e-2)
+    hit = np.isfinite(outs[0][1]) & np.isfinite(outs[1][1])
+    assert np.mean(np.isfinite(outs[0][1]) != np.isfinite(outs[1][1])) < 1.e-2
+    assert np.allclose(outs[0][1][hit], outs[1][1][hit], atol=5.e-2)
+
+    # with alpha_pow > 0 the slabs together take the steps of the full volume
+    # (without the per pixel start offsets of progressive parts)
+    rend.set_alpha_pow(.5)
+    calls = []
+    run_max_project = rend._run_max_project
+    rend._run_max_project = lambda *args, **kw: calls.append(kw) or run_max_project(*args, **kw)
+    out = rend.render(method="max_project").output.copy()
+    assert all(kw.get("numParts", 1) == 1 for kw in calls)
+    assert np.isclose(sum(kw.get("steps", 1.) for kw in calls), 1.)
+
+    # the composited slabs are frame buffers of the pool, that are reused after resizing
+    bufs = rend._frame_buffers()
+    assert all(any(b is b2 for b2 in bufs) for b in rend._acc)
+    rend.resize((70, 40))
+    assert rend._acc is None
+    rend.resize((100, 100))
+    rend.render(method="max_project")
+    assert all(any(b is b2 for b2 in bufs) for b in rend._frame_buffers())
+
+    rend.set_out_of_core(False)
+    rend.memMax = 2*d.nbytes
+    rend.set_data(d)
+    assert np.mean(np.abs(rend.render(method="max_project").output-out)) < 5.e-3
+
+    return rend
+
+
+def test_out_of_core_streamed():
+    """streamed slabs should be uploaded once per frame and give the same image as resident ones"""
+    d = np.random.uniform(0, 100, (64, 32, 33)).astype(np.float32)
+
+    rend = VolumeRenderer((60, 50))
+    rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+    rend.set_out_of_core(True)
+    rend.memMax = 12*d[0].nbytes
+    rend.set_data(d)
+    out = rend.render(method="max_project", minVal=0., maxVal=100.).output.copy()
+
+    rend._slabs_resident = False
+    rend._slabImgs = {}
+
+    uploads = []
+    write_volume = rend._write_volume
+    rend._write_volume = lambda img, data: (uploads.append(data.shape), write_volume(img, data))
+
+    for _ in range(2):
+        res = rend.render(method="max_project").output
+        assert np.allclose(res, out, atol=1.e-5)
+    # every slab exactly once per frame
+    shapes = [d[slice(*rend._slab_range(i))].shape for i in range(len(rend._slabs))]
+    assert uploads == 2*shapes
+
+
+
+def test_memory_pool():
+    """resizing back and forth and switching datasets should reuse the device memory"""
+    rend = VolumeRenderer((60, 50))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(np.ones((30, 40, 50), np.float32))
+    out = rend.render().output.copy()
+
+    bufs = rend._frame_buffers()
+    rend.resize((70, 40))
+    rend.resize((60, 50))
+    assert all(b is None or any(b is b2 for b2 in bufs) for b in rend._frame_buffers())
+
+    img = rend.dataImg
+    rend.set_data(np.zeros((30, 40, 50), np.float32))
+    rend.set_data(np.ones((30, 40, 50), np.float32))
+    assert rend.dataImg is img
+    assert np.allclose(rend.render().output, out)
+
+    # the parameters the viewer sets for every frame allocate nothing if unchanged
+    rend.render(method="iso_surface")
+    n = rend.pool.n_allocated
+    offsetBuf = rend.occOffsetBuf
+    for _ in range(3):
+        rend.set_occ_n_points(rend.occ_n_points)
+        rend.render(method="iso_surface")
+    assert rend.pool.n_allocated == n
+    assert rend.occOffsetBuf is offsetBuf
+
+    # nor do the brick and gradient buffers of the next dataset or the value range
+    rend.set_gradient_volume(True)
+    rend.render(method="iso_surface")
+    assert rend.value_range() == (1., 1.)
+    assert all(hasattr(b, "_poolKey") for b in (rend.brickBuf, rend._gradient[1], rend._gradientDummy))
+    n = rend.pool.n_allocated
+    for val in (0., 1.):
+        rend.set_data(np.full((30, 40, 50), val, np.float32))
+        rend.render(method="iso_surface")
+        assert rend.value_range() == (val, val)
+        rend.set_brick_size(0)
+        assert hasattr(rend.brickBuf, "_poolKey")
+        rend.set_brick_size(16)
+    # (besides the one buffer that is passed if there are no bricks)
+    assert rend.pool.n_allocated <= n+1
+
+
+def test_convert_dtypes():
+    """data of other types should be converted (and scaled) on the device, also in chunks"""
+    d = np.round(100*np.random.uniform(0, 1, (30, 40, 50))).astype(np.float32)
+
+    rend = VolumeRenderer((60, 50))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_max_val(100.)
+    rend.set_data(d)
+    out = rend.render().output.copy()
+
+    # a few slices per chunk
+    rend.convert_chunk_bytes = 7*d[0].nbytes
+
+    for dtype in (np.int8, np.int16, np.int32, np.uint32, np.int64, np.float16, np.float64):
+        rend.set_data(d.astype(dtype))
+        assert rend.dtype == np.float32
+        assert np.allclose(rend.render().output, out)
+
+    # into the current type
+    rend.set_data(d.astype(np.uint16))
+    out16 = rend.render().output.copy()
+    rend.update_data(d.astype(np.float64))
+    assert rend.dtype == np.uint16
+    assert np.allclose(rend.render().output, out16)
+
+    rend.set_data(d>50)
+    assert rend.dtype == np.uint8
+
+    rend.set_value_scale(.5, 10.)
+    rend.set_data(d.astype(np.int16))
+    rend.set_min_val(10.)
+    rend.set_max_val(60.)
+    assert np.allclose(rend.render().output, out, atol=1.e-5)
+
+
+def test_storage():
+    """half and quantized volumes should need less memory and stay within their error bounds"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-4*(X**2+Y**2+Z**2))+np.random.uniform(0, 1, (N,)*3)).astype(np.float32)
+
+    rend = VolumeRenderer((80, 60))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(d)
+    out = rend.render(method="max_project", minVal=0., maxVal=100.).output.copy()
+    nbytes = rend._device_nbytes(d)
+    assert rend.storage_error() == 0
+
+    # a few bricks per chunk
+    rend.convert_chunk_bytes = 20*d[0].nbytes
+
+    for storage, ratio in (("half", 2), ("quantized", 3.5)):
+        rend.set_storage(storage)
+        assert rend._device_nbytes(d)*ratio <= nbytes
+
+        err = rend.storage_error()
+        assert 0 < err < 1
+        mi, ma = rend.value_range()
+        assert abs(mi-d.min()) <= err and abs(ma-d.max()) <= err
+
+        # max projection (and interpolation) do not increase the error
+        res = rend.render(method="max_project", minVal=0., maxVal=100.).output
+        assert np.amax(np.abs(res-out)) <= 1.01*err/100.
+
+        # the slabs of out of core rendering are stored the same way
+        rend.set_out_of_core(True)
+        rend.memMax = 10*d[0].nbytes
+        rend.update_data(d)
+        assert rend._slabs is not None
+        res = rend.render(method="max_project", minVal=0., maxVal=100.).output
+        assert np.allclose(res, out, atol=5.e-2)
+        rend.set_out_of_core(False)
+        rend.memMax = 2*nbytes
+        rend.update_data(d)
+
+    rend.set_storage("native")
+    assert np.allclose(rend.render(method="max_project", minVal=0., maxVal=100.).output, out)
+
+    # values beyond the half range are stored as float32
+    rend.set_data(1000*d)
+    out = rend.render(method="max_project", minVal=0., maxVal=1.e5).output.copy()
+    rend.set_storage("half")
+    assert rend._storage_mode() == "native" and rend.storage_error() == 0
+    assert np.allclose(rend.render(method="max_project").output, out)
+
+    # unless they are scaled into it
+    rend.set_value_scale(.01)
+    rend.update_data(1000*d)
+    assert rend._storage_mode() == "half"
+    assert 0 < rend.storage_error() <= 1.001*1000*d.max()*.01*2.**-11
+
+
+def test_transfer_remap():
+    """changing only minVal, maxVal or gamma of a max projection should give the same
+    image as rendering it again"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-4*(X**2+Y**2+Z**2))+np.random.uniform(0, 10, (N,)*3)).astype(np.float32)
+
+    for dtype in (np.float32, np.uint16):
+        rend, ref = VolumeRenderer((80, 60)), VolumeRenderer((80, 60))
+        for r in (rend, ref):
+            r.set_modelView(mat4_translate(0, 0, -4.))
+            r.set_data(d.astype(dtype))
+
+        for numParts in (1, 3):
+            for part in range(numParts):
+                rend.render(method="max_project", minVal=5., maxVal=100., gamma=1.,
+                            numParts=numParts, currentPart=part)
+
+            for minVal, maxVal, gamma in ((5., 50., 1.), (20., 80., .5), (5., 120., 2.)):
+                rend.set_min_val(minVal)
+                rend.set_max_val(maxVal)
+                rend.set_gamma(gamma)
+                assert rend._can_remap(numParts, 0)
+                out = rend.render(method="max_project", numParts=numParts).output
+
+                for part in range(numParts):
+                    res = ref.render(method="max_project", minVal=minVal, maxVal=maxVal, gamma=gamma,
+                                     numParts=numParts, currentPart=part)
+                assert np.allclose(out, res.output, atol=1.e-5)
+
+        # a smaller minVal reaches into skipped bricks
+        rend.set_min_val(0.)
+        assert not rend._can_remap(numParts, 0)
+
+
+def test_progressive():
+    """the interleaved parts of a progressive max projection should add up to the full render"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-4*(X**2+Y**2+Z**2))).astype(np.float32)
+
+    rend = VolumeRenderer((80, 60))
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.set_data(d)
+    out = rend.render(method="max_project", minVal=0., maxVal=100.).output.copy()
+
+    numParts = 4
+    first = rend.render(method="max_project", numParts=numParts).output.copy()
+    changes = [rend.refine("max_project", numParts, part) for part in range(1, numParts)]
+
+    # the parts only add samples
+    res = rend.result.output
+    assert np.all(res >= first)
+    assert max(changes) < np.amax(np.abs(first-out))+1.e-6
+    assert np.allclose(res, out, atol=1.e-2)
+
+    # a part that was already rendered changes nothing
+    assert rend.refine("max_project", numParts, 1) == 0
+
+    # the change is the largest difference of the outputs, reduced without new allocations
+    n = rend.pool.n_allocated
+    before = rend.buf.get()
+    change = rend.refine("max_project", 2*numParts, 1)
+    assert np.isclose(change, np.amax(np.abs(rend.buf.get()-before)))
+    assert change > 0 and rend.pool.n_allocated == n
+
+
+def test_sampling_rate():
+    """with a sampling rate the step length should follow the voxel size"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-4*(X**2+Y**2+Z**2))).astype(np.float32)
+
+    rend = VolumeRenderer((100, 100))
+    rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.5, 1, 1, 0)))
+    rend.set_data(d)
+    rend.set_max_steps(400)
+    out = rend.render(method="max_project", minVal=0., maxVal=100.).output.copy()
+
+    errs = []
+    for rate in (.25, 2.):
+        rend.set_sampling_rate(rate)
+        res = rend.render(method="max_project").output
+        errs.append(np.amax(np.abs(res-out)))
+
+    assert errs[1] < 2.e-3
+    assert errs[1] < errs[0]
+
+    # max_steps is the upper limit
+    rend.set_max_steps(20)
+    assert not np.allclose(rend.render(method="max_project").output, res, atol=2.e-3)
+
+
+def test_accumulate():
+    """jittered frames with few steps should accumulate to the render with many steps"""
+    N = 64
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    d = (100*np.exp(-200*((X-.5)**2+(Y+.3)**2+(Z-.2)**2))).astype(np.float32)
+
+    rend = VolumeRenderer((100, 100))
+    rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.5, 1, 1, 0)))
+    rend.set_data(d)
+    rend.set_max_steps(400)
+    out = rend.render(method="max_project", minVal=0., maxVal=100.).output.copy()
+    depth = rend.output_depth.copy()
+
+    rend.set_max_steps(20)
+    banded = rend.render(method="max_project").output.copy()
+
+    frames = 16
+    changes = [rend.accumulate("max_project", frame) for frame in range(frames)]
+    res = rend.result.output
+
+    assert changes[0] == np.inf
+    assert max(changes[-4:]) < max(changes[1:5])
+    assert np.amax(np.abs(banded-out)) > .1
+    assert np.allclose(res, out, atol=1.e-2)
+
+    # the depth is the one of the accumulated maximum
+    hit = out > .1
+    assert np.any(hit)
+    assert np.allclose(rend.result.output_depth[hit], depth[hit], atol=2.e-2)
+
+    # the same frames with a quarter of the steps
+    rend.set_max_steps(80)
+    for frame in range(frames):
+        rend.accumulate("max_project", frame, steps=.25)
+    assert np.allclose(rend.result.output, res, atol=1.e-5)
+
+    # the attenuation of alpha_pow > 0 depends on the step length, so it is rendered as usual
+    rend.set_alpha_pow(.5)
+    assert not rend.can_accumulate("max_project")
+    assert rend.accumulate("max_project", 3, steps=.25) == 0
+    assert np.array_equal(rend.result.output, rend.render(method="max_project").output)
+
+
 if __name__=="__main__":
     #rend = test_speed_multipass()
     #rend = test_linear_nearest_switch()
 
     rend = test_opacity()
-
-
@@ -0,0 +1,81 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import numpy as np
+from spimagine.volumerender.volumerender import VolumeRenderer
+from spimagine.volumerender.volumerender_numpy import VolumeRendererNumpy
+from spimagine.utils import mat4_translate
+from spimagine.utils.transform_matrices import mat4_rotation
+
+
+def _data(N=64):
+    x = np.linspace(-1, 1, N)
+    Z, Y, X = np.meshgrid(x, x, x, indexing="ij")
+    R1 = np.sqrt((X-.3) ** 2 + Y ** 2 + Z ** 2)
+    R2 = np.sqrt((X+.3) ** 2 + (Y-.2) ** 2 + Z ** 2)
+    return (200 * np.exp(-30 * R1 ** 2) + 100 * np.exp(-40 * R2 ** 2)).astype(np.float32)
+
+
+def test_numpy_renderer():
+    """the numpy renderer should give the same images as the OpenCL one"""
+    d = _data()
+
+    outs = []
+    for Renderer in (VolumeRenderer, VolumeRendererNumpy):
+        rend = Renderer((80, 60))
+        rend.set_modelView(np.dot(mat4_translate(0, 0, -4.), mat4_rotation(.4, 1, 1, 0)))
+        rend.set_data(d)
+
+        rend.render(method="max_project", minVal=1.e-6, maxVal=200.)
+        out_max = rend.output.copy()
+
+        rend.set_alpha_pow(.5)
+        rend.render(method="max_project")
+        out_alpha = rend.output.copy()
+        rend.set_alpha_pow(0)
+
+        rend.set_max_steps(40)
+        rend.render(method="max_project")
+        out_steps = rend.output.copy()
+        rend.set_max_steps()
+
+        outs.append((out_max, out_alpha, out_steps))
+
+    for out_cl, out_np in zip(*outs):
+        assert np.allclose(out_cl, out_np, atol=1.e-3)
+
+
+def test_numpy_iso_surface():
+    d = _data()
+
+    rend = VolumeRendererNumpy((80, 80), chunk_samples=10000)
+    rend.set_modelView(mat4_translate(0, 0, -4.))
+    rend.render(data=d, method="iso_surface", maxVal=100.)
+
+    hit = np.isfinite(rend.output_depth)
+    assert np.any(hit) and not np.all(hit)
+    assert np.all(rend.output[hit] >= .3)
+    assert np.allclose(np.linalg.norm(rend.output_normals[hit], axis=-1), 1.)
+    return rend
+
+
+def test_numpy_without_opencl():
+    """the numpy renderer should be usable without any OpenCL platform"""
+    import os
+    import subprocess
+    import sys
+    import spimagine
+
+    env = dict(os.environ, OCL_ICD_VENDORS="/nonexistent",
+               PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(spimagine.__file__)),
+                                           os.environ.get("PYTHONPATH", "")]))
+    src = """
+import numpy as np
+from spimagine.volumerender.volumerender_numpy import VolumeRendererNumpy
+rend = VolumeRendererNumpy((20, 20))
+rend.render(data=np.ones((16, 16, 16), np.float32), maxVal=1.)
+assert rend.output.max() > 0
+"""
+    subprocess.check_call([sys.executable, "-c", src], env=env)
+
+
+if __name__ == "__main__":
+    rend = test_numpy_iso_surface()